@@ -0,0 +1,91 @@
+"""escape_markdownのベンチマーク。
+
+従来のescape_html_filterとunescape_html_filterを順に適用する方法と、
+1回の走査で行うescape_markdownの処理時間を比較する。
+
+また、Translaterの置換方法ごとに、置換群の大きさと処理時間を比較する。
+
+Usage:
+    python -m benchmarks.bench_escape
+"""
+import timeit
+
+from blogs.escape import (
+    HtmlAccepter, escape_html, escape_html_filter, escape_markdown,
+)
+
+
+# blogs.viewsのACCEPT_TAGSと同じ(Djangoの設定なしで実行するため複製)
+ACCEPT_TAGS = [
+    'b', 'blockquote', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'li', 'ol', 'ol[start]', 'p', 'pre', 'sub', 'sup', 'strong',
+    'strike', 'ul', 'br', 'hr',
+]
+
+PROSE = (
+    '## 見出し\n'
+    'これは<b>説明</b>の文です。a < b && c > d のような式も書きます。<br>\n'
+    '<ul>\n<li>項目1</li>\n<li>項目2</li>\n</ul>\n'
+    '<script>alert("xss")</script>\n\n'
+)
+
+CODE = (
+    '```python\n'
+    'def escape(text):\n'
+    '    if a < b and c > d:\n'
+    '        return "<div class=\'x\'>" + text + "</div>"\n'
+    '    return text & mask\n'
+    '```\n\n'
+)
+
+
+def create_code_heavy_text(size):
+    """コードブロックを多く含む、size文字以上の記事を作る。"""
+    unit = PROSE + CODE * 3
+    return unit * (size // len(unit) + 1)
+
+
+def legacy_escape_markdown(text, *accept_texts):
+    """エスケープ後に許容タグの数だけ置換を行う従来の方法。"""
+    text = escape_html_filter(text)
+    accepter = HtmlAccepter()
+    accepter.accepts(*accept_texts)
+    return accepter.unescape_html_filter(text)
+
+
+def main(sizes=(100 * 1024, 500 * 1024), number=20):
+    for size in sizes:
+        text = create_code_heavy_text(size)
+        assert escape_markdown(text, ACCEPT_TAGS) == \
+            legacy_escape_markdown(text, ACCEPT_TAGS)
+
+        legacy = min(timeit.repeat(
+            lambda: legacy_escape_markdown(text, ACCEPT_TAGS),
+            number=number, repeat=3)) / number
+        fused = min(timeit.repeat(
+            lambda: escape_markdown(text, ACCEPT_TAGS),
+            number=number, repeat=3)) / number
+        print('%7d KB  legacy: %8.3f ms  fused: %8.3f ms  x%.2f' % (
+            len(text) // 1024, legacy * 1000, fused * 1000, legacy / fused))
+
+
+def compare_strategies(size=100 * 1024, tag_counts=(20, 50, 100, 200),
+                       number=5):
+    text = escape_html(create_code_heavy_text(size))
+    for tag_count in tag_counts:
+        tags = ACCEPT_TAGS + ['tag%d' % i for i in range(tag_count)]
+        results = []
+        for strategy in ('replace', 'automaton'):
+            accepter = HtmlAccepter(strategy)
+            accepter.accepts(tags)
+            accepter.translate(text)
+            results.append(min(timeit.repeat(
+                lambda: accepter.translate(text),
+                number=number, repeat=3)) / number)
+        print('%4d keys  replace: %8.3f ms  automaton: %8.3f ms' % (
+            len(accepter.group), results[0] * 1000, results[1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
+    compare_strategies()
@@ -0,0 +1,78 @@
+"""マークダウンの変換のベンチマーク。
+
+変換ごとにMarkdownのインスタンスと拡張機能を作る従来の方法と、
+ConverterPoolでインスタンスを使い回す方法の処理時間を比較する。
+小さい記事ほど、インスタンスを作る時間の割合が大きい。
+
+また、記事の1段落だけを変えた場合に、記事全体を変換する方法と
+ブロックごとに変換する方法(render_blocks)の処理時間を比較する。
+
+Usage:
+    python -m benchmarks.bench_render
+"""
+import timeit
+
+import markdown
+
+from benchmarks.corpora import create_text
+
+
+EXTENSIONS = [
+    'markdown.extensions.extra',
+    'markdown.extensions.toc',
+]
+
+
+def main(sizes=(256, 1024, 10 * 1024), number=200):
+    from blogs.render import ConverterPool
+
+    pool = ConverterPool()
+    for size in sizes:
+        text = create_text('prose', size)
+        assert markdown.markdown(text, extensions=EXTENSIONS) == \
+            pool.convert(text, EXTENSIONS)
+
+        per_call = min(timeit.repeat(
+            lambda: markdown.markdown(text, extensions=EXTENSIONS),
+            number=number, repeat=3)) / number
+        pooled = min(timeit.repeat(
+            lambda: pool.convert(text, EXTENSIONS),
+            number=number, repeat=3)) / number
+        print('%7d B  per call: %8.3f ms  pooled: %8.3f ms  x%.2f' % (
+            size, per_call * 1000, pooled * 1000, per_call / pooled))
+
+
+def compare_incremental(kinds=('prose', 'fence', 'japanese'),
+                        size=50 * 1024, number=20):
+    from blogs.render import (
+        _render_document, can_render_blocks, render_blocks, render_cache,
+    )
+
+    for kind in kinds:
+        text = create_text(kind, size)
+        if not can_render_blocks(text):
+            print('%-10s skipped: not splittable' % kind)
+            continue
+        # 変換済みの記事の末尾の段落だけを変える
+        edits = [text + '\n\nedited %d\n' % i for i in range(number)]
+        render_blocks(text)
+
+        start = timeit.default_timer()
+        for edit in edits:
+            _render_document(edit)
+        whole = (timeit.default_timer() - start) / number
+        start = timeit.default_timer()
+        for edit in edits:
+            render_blocks(edit)
+        blocks = (timeit.default_timer() - start) / number
+        render_cache.clear()
+        print('%-10s %d KB  whole: %8.3f ms  blocks: %8.3f ms  x%.2f' % (
+            kind, size // 1024, whole * 1000, blocks * 1000, whole / blocks))
+
+
+if __name__ == '__main__':
+    from benchmarks.suite import _setup_django
+
+    _setup_django()
+    main()
+    compare_incremental()
@@ -0,0 +1,76 @@
+"""ベンチマーク用の記事を生成する。
+
+同じ種類と大きさからは常に同じ記事を生成する。
+"""
+import random
+
+
+PROSE_UNITS = [
+    '## Heading\n\n',
+    'This paragraph explains how the blog renders **markdown** text. ',
+    'It has *emphasis*, `inline code` and a [link](https://example.com). ',
+    'Numbers like 1 and 2 are compared here.\n\n',
+    '- list item one\n- list item two\n- list item three\n\n',
+    '> quoted text for the reader.\n\n',
+    '<b>bold</b> and <br> tags are accepted.\n',
+]
+
+FENCE_UNITS = [
+    'Some explanation before the code.\n\n',
+    '```python\ndef f(a, b):\n    if a < b and b > 0:\n'
+    '        return "<div class=\'x\'>" + a + "</div>"\n'
+    '    return a & b\n```\n\n',
+    '```html\n<ul>\n  <li>item</li>\n</ul>\n'
+    '<script>alert(1)</script>\n```\n\n',
+    '```\n$ echo "a" > out.txt && cat out.txt\n```\n\n',
+]
+
+JAPANESE_UNITS = [
+    '## 見出し\n\n',
+    'これはマークダウンで書かれた技術ブログの記事です。',
+    '日本語の文章には特殊文字がほとんど含まれません。',
+    '<b>強調</b>や<br>は許容されます。\n\n',
+    '- 項目その1\n- 項目その2\n\n',
+    '```\nprint("こんにちは")\n```\n\n',
+]
+
+LT_DENSE_UNITS = [
+    '<', '<<', '<b', '<b>', '</b>', '<br>', '< >', '<&>', '<<<>>>',
+    '<script>', 'a<b', '\n',
+]
+
+CORPORA = {
+    'prose': PROSE_UNITS,
+    'fence': FENCE_UNITS,
+    'japanese': JAPANESE_UNITS,
+    'lt_dense': LT_DENSE_UNITS,
+}
+
+SIZES = {
+    '1KB': 1024,
+    '100KB': 100 * 1024,
+    '1MB': 1024 * 1024,
+    '5MB': 5 * 1024 * 1024,
+}
+
+
+def create_text(kind, size, seed=0):
+    """kindの種類の記事をsize文字生成する。
+
+    Args:
+        kind (str): CORPORAのkey。
+        size (int): 文字数。
+        seed (int): 乱数のシード。
+
+    Returns:
+        str: 生成した記事。
+    """
+    units = CORPORA[kind]
+    rng = random.Random('%s-%d' % (kind, seed))
+    pieces = []
+    length = 0
+    while length < size:
+        unit = rng.choice(units)
+        pieces.append(unit)
+        length += len(unit)
+    return ''.join(pieces)[:size]
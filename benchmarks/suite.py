@@ -0,0 +1,211 @@
+"""エスケープとマークダウン変換のベンチマーク。
+
+生成した記事(benchmarks.corpora)ごとに、各処理の1秒あたりの実行回数と
+ピークメモリを計測する。--saveで結果をベースラインとして保存し、
+以降の実行でベースラインよりthreshold以上悪化した項目があれば
+終了コード1で終了する。
+
+ベースラインは計測したマシンに依存するため、同じマシンで比較すること。
+
+Usage:
+    python -m benchmarks.suite --save
+    python -m benchmarks.suite
+    python -m benchmarks.suite --only escape_markdown --sizes 1KB 100KB
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import django
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'baseline.json')
+# 1項目あたりの計測時間の目安(秒)
+MIN_DURATION = 0.2
+# マークダウン変換は遅いため、この大きさまで計測する
+MARKDOWN_MAX_SIZE = 100 * 1024
+
+
+def _setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+
+class _Uncached:
+    """変換結果を保持しないRenderCacheの代わり"""
+    def get_many_or_render(self, texts, render, namespace=''):
+        return [render(text) for text in texts]
+
+
+def _render_uncached(text):
+    """ブロックの変換結果のキャッシュを通さずにrender_markdownを呼ぶ
+
+    長い記事はブロックごとの変換結果をキャッシュするため、そのままでは
+    2回目以降の計測がキャッシュの読み込みになる。
+    """
+    from blogs import render
+
+    cache = render.render_cache
+    render.render_cache = _Uncached()
+    try:
+        return render.render_markdown(text)
+    finally:
+        render.render_cache = cache
+
+
+def create_benchmarks():
+    """計測する処理を作成する。
+
+    Returns:
+        dict: 名前と(前処理, 計測する処理, 最大の大きさ)の組。
+    """
+    from blogs.escape import (
+        create_sentence, escape_html_filter, escape_markdown, get_accepter,
+    )
+    from blogs.templatetags.markdown import markdown_to_html
+    from blogs.views import ACCEPT_TAGS
+
+    accepter = get_accepter(ACCEPT_TAGS)
+
+    def no_prepare(text):
+        return text
+
+    return {
+        'create_sentence': (no_prepare, create_sentence, None),
+        'escape_html_filter': (no_prepare, escape_html_filter, None),
+        'unescape_html_filter': (
+            escape_html_filter, accepter.unescape_html_filter, None
+        ),
+        'escape_markdown': (
+            no_prepare, lambda text: escape_markdown(text, ACCEPT_TAGS), None
+        ),
+        # キャッシュを通さない変換
+        'markdown_to_html': (
+            lambda text: escape_markdown(text, ACCEPT_TAGS),
+            _render_uncached,
+            MARKDOWN_MAX_SIZE,
+        ),
+        # キャッシュに載った後の変換
+        'markdown_to_html_cached': (
+            lambda text: escape_markdown(text, ACCEPT_TAGS),
+            markdown_to_html,
+            None,
+        ),
+    }
+
+
+def measure(func, arg):
+    """funcの1秒あたりの実行回数とピークメモリ(KB)を計測する。"""
+    # ウォームアップ
+    func(arg)
+
+    best = float('inf')
+    total = 0.0
+    while total < MIN_DURATION:
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+
+    gc.collect()
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'ops_per_sec': 1 / best if best else float('inf'),
+        'peak_kb': peak / 1024,
+    }
+
+
+def run(names, kinds, sizes):
+    """指定された処理、記事の種類、大きさの組み合わせを全て計測する。"""
+    from benchmarks.corpora import SIZES, create_text
+
+    benchmarks = create_benchmarks()
+    results = {}
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for kind in kinds:
+            text = create_text(kind, size)
+            for name in names:
+                prepare, func, max_size = benchmarks[name]
+                if max_size is not None and size > max_size:
+                    continue
+                key = '%s/%s/%s' % (name, kind, size_name)
+                results[key] = measure(func, prepare(text))
+                print('%-45s %12.2f ops/s %10.1f KB' % (
+                    key,
+                    results[key]['ops_per_sec'],
+                    results[key]['peak_kb'],
+                ))
+                sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ベースラインよりthreshold以上悪化した項目を返す。"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append('%s: %.2f ops/s (baseline %.2f)' % (
+                key, result['ops_per_sec'], base['ops_per_sec']))
+        if result['peak_kb'] > base['peak_kb'] * (1 + threshold) + 1:
+            regressions.append('%s: %.1f KB (baseline %.1f)' % (
+                key, result['peak_kb'], base['peak_kb']))
+    return regressions
+
+
+def main(argv=None):
+    from benchmarks.corpora import CORPORA, SIZES
+
+    names = list(create_benchmarks())
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=names, default=names)
+    parser.add_argument('--kinds', nargs='+', choices=list(CORPORA),
+                        default=list(CORPORA))
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES),
+                        default=list(SIZES))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='許容する悪化の割合')
+    parser.add_argument('--save', action='store_true',
+                        help='結果をベースラインとして保存する')
+    args = parser.parse_args(argv)
+
+    results = run(args.only, args.kinds, args.sizes)
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('saved baseline: %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline: run with --save first')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    _setup_django()
+    sys.exit(main())
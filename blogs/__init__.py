@@ -1 +1,3 @@
 from . import *
+
+default_app_config = 'blogs.apps.BlogsConfig'
@@ -1,6 +1,13 @@
 from django.contrib import admin
 
-from blogs.models import Article, Category
+from blogs.models import Article, Category, ImageJob
 
 admin.site.register(Article)
 admin.site.register(Category)
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    """失敗したジョブの確認用"""
+    list_display = ('__str__', 'status', 'attempts', 'created_at')
+    list_filter = ('status', )
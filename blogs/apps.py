@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class BlogsConfig(AppConfig):
     name = 'blogs'
+
+    def ready(self):
+        from blogs import signals  # noqa: F401
+        from blogs.page_cache import check_shared_cache
+
+        checks.register(check_shared_cache, checks.Tags.caches)
@@ -1,5 +1,43 @@
 import re
+from array import array
 from collections import deque
+from functools import lru_cache, partial
+
+
+# Html特殊文字とエスケープ後の文字列
+HTML_ESCAPE_CHARS = {
+    '&':  '&amp;',
+    '<':  '&lt;',
+    '>':  '&gt;',
+    '"':  '&quot;',
+    '\'': '&#39;'
+}
+# プロセス内で保持するコンパイル済みHtmlAccepterの数
+ACCEPTER_CACHE_SIZE = 32
+# Translaterで選べる置換の方法
+TRANSLATE_STRATEGIES = ('auto', 'replace', 'str', 'automaton')
+# 'auto'でreplace_transを使う置換群の最大の大きさ
+# (100KBの記事で計測すると、これより大きい置換群ではAhoCorasickの方が速い)
+# keyどうしが重なり得る置換群では大きさによらずAhoCorasickを使う
+AUTOMATON_THRESHOLD = 160
+# escape_markdown_iterでファイルから1度に読み込む文字数
+STREAM_CHUNK_SIZE = 64 * 1024
+# 属性を許可するタグの書式(例: 'ol[start]', 'a[href][title]')
+_ACCEPT_SPEC_PATTERN = re.compile(
+    r'([A-Za-z][A-Za-z0-9]*)((?:\[[A-Za-z][-A-Za-z0-9]*\])+)\Z'
+)
+# 許可する属性の値の最大の長さ
+MAX_ATTRIBUTE_VALUE_LENGTH = 256
+# 属性の値に使えない文字
+_ATTRIBUTE_VALUE_CHARS = '[^"<>&\'`]'
+# 次の```までを最短で含む```ブロック
+_QUOT_BLOCK_PATTERN = '```[^`]*(?:`(?!``)[^`]*)*```'
+# unescape_markdownで```ブロックとエスケープ後の特殊文字を探す正規表現
+_UNESCAPE_PATTERN = re.compile(
+    '(' + _QUOT_BLOCK_PATTERN + ')|' +
+    '|'.join(re.escape(v) for v in HTML_ESCAPE_CHARS.values())
+)
+_HTML_UNESCAPE_CHARS = {v: k for k, v in HTML_ESCAPE_CHARS.items()}
 
 
 class Phrase:
@@ -9,6 +47,8 @@ class Phrase:
         is_accepted (bool): エスケープを許容するかどうか。
         text (str): 語句本体。
     """
+    __slots__ = ('is_accepted', 'text')
+
     def __init__(self, text=''):
         self.is_accepted = False
         self.text = text
@@ -20,32 +60,120 @@ class Phrase:
         return 'Phrase(' + self.text + ')'
 
 
+class PhraseView:
+    """Sentenceの語句をPhraseとして参照する。
+
+    取り出した時に初めて文字列を切り出してPhraseを作る。
+    取り出したPhraseを変更してもSentenceには反映されない。
+    """
+    __slots__ = ('_sentence',)
+
+    def __init__(self, sentence):
+        self._sentence = sentence
+
+    def __len__(self):
+        return len(self._sentence)
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError('index must be int')
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('phrase index out of range')
+        text, is_accepted = self._sentence.get_text(index)
+        phrase = Phrase(text)
+        phrase.is_accepted = is_accepted
+        return phrase
+
+    def __iter__(self):
+        for text, is_accepted in self._sentence.texts():
+            phrase = Phrase(text)
+            phrase.is_accepted = is_accepted
+            yield phrase
+
+    def __str__(self):
+        return str(deque(self))
+
+    def __repr__(self):
+        return repr(deque(self))
+
+
 class Sentence:
     """文を表す。
 
+    語句を元の文字列のコピーとして持たず、
+    (開始位置, 終了位置, エスケープを許容するかどうか)の組で持つ。
+
     Attributes:
-        _phrases (deque): Phraseのリスト。
+        _base (str): 語句を切り出す元の文字列。
+        _pieces (list): set_phraseで追加し、まだ_baseにつないでいない文字列。
+        _length (int): _baseと_piecesを合わせた長さ。
+        _spans (array): 語句ごとの開始位置、終了位置、許容するかどうか。
     """
-    def __init__(self):
-        self._phrases = deque()
+    __slots__ = ('_base', '_pieces', '_length', '_spans')
+
+    def __init__(self, text=''):
+        self._base = text
+        self._pieces = []
+        self._length = len(text)
+        self._spans = array('q')
+
+    @property
+    def _text(self):
+        """語句を切り出す文字列。追加した文字列は必要になった時につなぐ"""
+        if self._pieces:
+            self._pieces.insert(0, self._base)
+            self._base = ''.join(self._pieces)
+            self._pieces = []
+        return self._base
 
     @property
     def phrases(self):
-        return self._phrases
+        return PhraseView(self)
+
+    def __len__(self):
+        return len(self._spans) // 3
 
     def set_phrase(self, phrase):
         if isinstance(phrase, str):
-            self._phrases.append(Phrase(phrase))
+            text, is_accepted = phrase, False
         elif isinstance(phrase, Phrase):
-            self._phrases.append(phrase)
+            text, is_accepted = phrase.text, phrase.is_accepted
         else:
             raise ValueError('phrase must be str or Phrase instance')
+        # 元の文字列にない語句は末尾に追加して参照する。
+        # 毎回文字列をつなぐと語句の数の2乗の時間がかかるため、リストにためる
+        start_i = self._length
+        self._pieces.append(text)
+        self._length += len(text)
+        self.add_span(start_i, self._length, is_accepted)
+
+    def add_span(self, start_i, end_i, is_accepted):
+        """元の文字列のtext[start_i:end_i]を語句として追加する。"""
+        self._spans.extend((start_i, end_i, is_accepted))
+
+    def get_text(self, index):
+        """index番目の語句の文字列と、許容するかどうかを返す。"""
+        start_i, end_i, is_accepted = self._spans[index * 3:index * 3 + 3]
+        return self._text[start_i:end_i], bool(is_accepted)
+
+    def texts(self):
+        """語句の文字列と、許容するかどうかを順に返す。
+
+        Yields:
+            tuple: (語句の文字列, 許容するかどうか)。
+        """
+        text = self._text
+        spans = self._spans
+        for i in range(0, len(spans), 3):
+            yield text[spans[i]:spans[i + 1]], bool(spans[i + 2])
 
     def __str__(self):
-        return 'Sentence(' + str(self._phrases) + ')'
+        return 'Sentence(' + str(self.phrases) + ')'
 
     def __repr__(self):
-        return 'Sentence(' + str(self._phrases) + ')'
+        return 'Sentence(' + str(self.phrases) + ')'
 
 
 def create_sentence(text):
@@ -73,37 +201,24 @@ def create_sentence(text):
             Phrase('ここはエスケープ対象の文です。\\n')
         )
     """
-    sentence = Sentence()
+    sentence = Sentence(text)
     # phraseは0から
     phrase_count = 0
     current_i = 0
 
-    result_iter = re.finditer('```', text)
-
-    # phraseの間に```を入れるために準備
-    quot_phrase = Phrase('```')
-    quot_phrase.is_accepted = True
-    for result in result_iter:
-        result_start_i, result_end_i = result.span()
-
-        phrase = Phrase(text[current_i:result_start_i])
-        if phrase_count % 2 == 0:
-            # 偶数の場合エスケープ対象
-            phrase.is_accepted = False
-        else:
-            # 奇数の場合エスケープ対象外
-            phrase.is_accepted = True
-        sentence.set_phrase(phrase)
+    result_i = text.find('```')
+    while result_i >= 0:
+        # 偶数の場合エスケープ対象、奇数の場合エスケープ対象外
+        sentence.add_span(current_i, result_i, phrase_count % 2 == 1)
 
         phrase_count += 1
-        current_i = result_end_i
+        current_i = result_i + 3
 
         # Phraseの間に```を入れる
-        sentence.set_phrase(quot_phrase)
+        sentence.add_span(result_i, current_i, True)
+        result_i = text.find('```', current_i)
 
-    end_phrase = Phrase(text[current_i:])
-    end_phrase.is_accepted = False
-    sentence.set_phrase(end_phrase)
+    sentence.add_span(current_i, len(text), False)
 
     return sentence
 
@@ -149,11 +264,172 @@ def str_trans(text, d):
     return text.translate(str.maketrans(d))
 
 
+def _is_independent(d):
+    """replace_transで置換しても最左最長で置換した結果と同じになるかどうか。
+
+    keyどうしが重ならず、置換後の文字列が新たなkeyの一部にならなければ、
+    keyごとに順に置換しても置換の順序によって結果は変わらない。
+
+    Args:
+        d (dict): 変換する文字を定義。
+
+    Returns:
+        bool: 結果が同じになる場合はTrue。
+    """
+    # keyの先頭と末尾の一部(key自身は含まない)
+    prefixes = {k[:i] for k in d for i in range(1, len(k))}
+    suffixes = {k[-i:] for k in d for i in range(1, len(k))}
+    for text in d:
+        # 他のkeyの先頭と重なる
+        if any(text[-i:] in prefixes for i in range(1, len(text))):
+            return False
+    for value in d.values():
+        if not value or \
+                any(value[-i:] in prefixes for i in range(1, len(value))) or \
+                any(value[:i] in suffixes for i in range(1, len(value))):
+            return False
+    for key in d:
+        if any(key != other and key in other for other in d) or \
+                any(key in value or value in key for value in d.values()):
+            return False
+    return True
+
+
+class AhoCorasick:
+    """複数の文字列を1回の走査で置換するAho-Corasickオートマトン。
+
+    置換対象が重なる場合は最も左から始まるものを、
+    同じ位置から始まる場合は最も長いものを優先する。
+
+    Attributes:
+        _group (dict): 置換前と置換後を定義したグループ。
+        _goto (list): 状態ごとの遷移先(dict)。
+        _fail (list): 状態ごとの失敗時の遷移先。
+        _depth (list): 状態ごとの先頭からの文字数。
+        _output (list): 状態ごとに、末尾で一致する最も長いkey。
+        _skip (re.Pattern): keyの先頭になる文字を探す正規表現。
+    """
+    def __init__(self, d):
+        if '' in d:
+            raise ValueError('key must not be empty')
+        self._group = dict(d)
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._output = [None]
+        for key in self._group:
+            self._add_key(key)
+        self._create_fail()
+        self._skip = re.compile(
+            '[' + ''.join(re.escape(c) for c in self._goto[0]) + ']'
+        )
+
+    def _add_key(self, key):
+        """keyをトライ木に追加する。"""
+        state = 0
+        for c in key:
+            next_state = self._goto[state].get(c)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._output.append(None)
+                self._goto[state][c] = next_state
+            state = next_state
+        self._output[state] = key
+
+    def _create_fail(self):
+        """幅優先で失敗時の遷移先を作成する。"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and c not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(c, 0)
+                if self._output[next_state] is None:
+                    # 自身がkeyでなければ、末尾で一致する最も長いkeyを引き継ぐ
+                    self._output[next_state] = \
+                        self._output[self._fail[next_state]]
+
+    def translate(self, text):
+        """置換を行う。
+
+        Args:
+            text (str): 変換対象文字列。
+
+        Returns:
+            str: 変換後の文字列。
+        """
+        goto, fail, depth, output = \
+            self._goto, self._fail, self._depth, self._output
+        pieces = []
+        last_i = 0
+        current_i = 0
+        state = 0
+        # 確定待ちの置換対象
+        found_key = None
+        found_i = 0
+        while True:
+            if current_i >= len(text):
+                if found_key is None:
+                    break
+                # 末尾まで読んだら確定待ちの置換対象を確定する
+                is_fixed = True
+            else:
+                if state == 0 and found_key is None:
+                    # keyの先頭になる文字まで読み飛ばす
+                    result = self._skip.search(text, current_i)
+                    if result is None:
+                        break
+                    current_i = result.start()
+                c = text[current_i]
+                while state and c not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(c, 0)
+                current_i += 1
+                # 読み途中の部分がfound_iより右から始まる場合、
+                # found_iより左から始まる置換対象はもう現れない
+                is_fixed = found_key is not None and \
+                    current_i - depth[state] > found_i
+
+            if is_fixed:
+                pieces.append(text[last_i:found_i])
+                pieces.append(self._group[found_key])
+                last_i = current_i = found_i + len(found_key)
+                state = 0
+                found_key = None
+                continue
+
+            key = output[state]
+            if key is not None:
+                key_i = current_i - len(key)
+                if found_key is None or key_i < found_i or \
+                        (key_i == found_i and len(key) > len(found_key)):
+                    found_key = key
+                    found_i = key_i
+
+        pieces.append(text[last_i:])
+        return ''.join(pieces)
+
+
 class Translater:
     """文字の置換を行う。
 
+    置換の方法はstrategyで選ぶ。
+
+    * 'replace': replace_transでkeyごとに置換する。
+    * 'str': str_transで1文字ずつ置換する。keyは全て1文字であること。
+    * 'automaton': AhoCorasickで全てのkeyを1回の走査で置換する。
+    * 'auto': permutation_groupから上記のいずれかを選ぶ。
+      どれを選んでもAhoCorasickと同じく最左最長で置換した結果になる。
+
     Attributes:
-        translate (function): replaceを使って変換する関数。
+        strategy (str): 置換の方法。
+        translate (function): strategyに応じて変換する関数。
         permutation_group (dict): 置換前と置換後を定義したグループを保持。
 
     Methods:
@@ -161,28 +437,109 @@ class Translater:
         setgroup: permutation_groupに保存。
         translate: permutation_groupに保存されている文字で変換。
     """
-    def __init__(self):
-        self._translate = replace_trans
+    def __init__(self, strategy='auto'):
+        if strategy not in TRANSLATE_STRATEGIES:
+            raise ValueError('strategy must be one of ' +
+                             ', '.join(TRANSLATE_STRATEGIES))
+        self._strategy = strategy
+        self._translate = None
         self._permutation_group = {}
 
     @property
     def group(self):
         return self._permutation_group
 
+    @property
+    def strategy(self):
+        return self._strategy
+
     def setgroup(self, key, value):
         """置換前と置換後を保存する。"""
         self._permutation_group.setdefault(key, value)
+        # 変換する関数は次に使う時に作り直す
+        self._translate = None
 
     def translate(self, text):
         """置換を行う。"""
-        escaped_text = self._translate(text, self._permutation_group)
+        if self._translate is None:
+            self._translate = self._create_translate()
+        escaped_text = self._translate(text)
         return escaped_text
 
+    def _select_strategy(self):
+        """'auto'の場合に使う置換の方法を選ぶ。"""
+        group = self._permutation_group
+        if all(len(k) == 1 for k in group):
+            return 'str'
+        if '' in group:
+            return 'replace'
+        if len(group) <= AUTOMATON_THRESHOLD and _is_independent(group):
+            return 'replace'
+        return 'automaton'
+
+    def _create_translate(self):
+        """permutation_groupからstrategyに応じて変換する関数を作成。"""
+        group = self._permutation_group
+        strategy = self._strategy
+        if strategy == 'auto':
+            strategy = self._select_strategy()
+
+        if strategy == 'str':
+            one_over_size_in_keys = [k for k in group.keys() if len(k) > 1]
+            if len(one_over_size_in_keys) > 0:
+                raise ValueError('key mast be one size')
+            table = str.maketrans(group)
+            return lambda text: text.translate(table)
+        if strategy == 'automaton':
+            return AhoCorasick(group).translate
+        return lambda text: replace_trans(text, group)
+
 
 class HtmlAccepter(Translater):
-    """HTMLタグのアンエスケープを行う。"""
-    def __init__(self):
-        super().__init__()
+    """HTMLタグのアンエスケープを行う。
+
+    'ol[start]'のように[]で属性名を指定したタグは、
+    <ol start="42">のように指定した属性を持つ開始タグも許容する。
+    属性は半角スペース1つで区切り、値は"で囲む。
+
+    Attributes:
+        _attribute_tags (dict): 属性を許可するタグ名と属性名のset。
+        _is_compiled (bool): 許容タグの正規表現を作成済みかどうか。
+        _escape_pattern (re.Pattern): escape_filterで使う正規表現。
+        _unescape_pattern (re.Pattern): エスケープ後の属性付きタグの正規表現。
+        _max_tag_length (int): 許容タグの最大の長さ。
+    """
+    def __init__(self, strategy='auto'):
+        super().__init__(strategy)
+        self._attribute_tags = {}
+        self._is_compiled = False
+        self._escape_pattern = None
+        self._unescape_pattern = None
+        self._max_tag_length = 0
+
+    def setgroup(self, key, value):
+        """置換前と置換後を保存する。
+
+        作成済みの正規表現は次に使う時に作り直す。
+        """
+        super().setgroup(key, value)
+        self._is_compiled = False
+
+    def compile(self):
+        """escape_filterで使う正規表現を作成して保持する。
+
+        Returns:
+            HtmlAccepter: 自身。
+        """
+        self._escape_pattern = self._create_escape_pattern()
+        self._unescape_pattern = None
+        if self._attribute_tags:
+            self._unescape_pattern = re.compile(
+                '&lt;(' + self._create_attribute_tag_pattern('&quot;') +
+                ')&gt;'
+            )
+        self._is_compiled = True
+        return self
 
     def accepts(self, *args):
         """エスケープを無効したいタグを登録。
@@ -193,6 +550,14 @@ class HtmlAccepter(Translater):
         """
         accept_texts = self._create_accept_texts(args)
         for accept_text in accept_texts:
+            result = _ACCEPT_SPEC_PATTERN.match(accept_text)
+            if result:
+                # 属性を許可するタグは、属性のないタグも登録する
+                accept_text = result.group(1)
+                attributes = re.findall(r'\[(.+?)\]', result.group(2))
+                self._attribute_tags.setdefault(accept_text, set()) \
+                    .update(attributes)
+                self._is_compiled = False
             # 開始タグを作成し登録する
             escaped_start_tag = self._create_escaped_tag(accept_text)
             unescaped_start_tag = self._create_tag(accept_text)
@@ -203,7 +568,8 @@ class HtmlAccepter(Translater):
             self.setgroup(escaped_end_tag, unescaped_end_tag)
         return self._permutation_group
 
-    def _create_accept_texts(self, args):
+    @staticmethod
+    def _create_accept_texts(args):
         if not isinstance(args, tuple):
             raise ValueError('input string type')
 
@@ -238,15 +604,210 @@ class HtmlAccepter(Translater):
         Returns:
             str: ```で囲まれた文以外アンエスケープした文字列。
         """
+        if not self._is_compiled:
+            self.compile()
         sentence = create_sentence(text)
 
-        unescaped_text = ''
-        for phrase in sentence.phrases:
-            if phrase.is_accepted:
-                unescaped_text += phrase.text
+        unescaped_texts = []
+        for phrase_text, is_accepted in sentence.texts():
+            if is_accepted:
+                unescaped_texts.append(phrase_text)
+            else:
+                phrase_text = self.translate(phrase_text)
+                if self._unescape_pattern is not None:
+                    phrase_text = self._unescape_pattern.sub(
+                        _unescape_attribute_tag, phrase_text
+                    )
+                unescaped_texts.append(phrase_text)
+        return ''.join(unescaped_texts)
+
+    def escape_filter(self, text):
+        """Html特殊文字のエスケープと許容タグのアンエスケープを同時に行う。
+
+        escape_html_filterの結果をunescape_html_filterに渡した場合と
+        同じ文字列を返す。```で囲まれたブロックと許容タグを1つの正規表現で
+        探すため、許容タグの数だけ文字列をコピーしない。
+
+        Args:
+            text (str): エスケープしてほしい文字列。
+
+        Returns:
+            str: ```で囲まれた文以外エスケープし、許容タグのみ戻した文字列。
+        """
+        if not self._is_compiled:
+            self.compile()
+        pattern = self._escape_pattern
+        if pattern is None:
+            # 1回の走査で扱えないタグが登録されている場合
+            return self.unescape_html_filter(escape_html_filter(text))
+
+        return self._escape_text(text)
+
+    def escape_filter_iter(self, chunks):
+        """escape_filterを分割された文字列に対して順に行う。
+
+        チャンクの境目で分かれた```や許容タグも、escape_filterに
+        全体を渡した場合と同じように扱う。保持するのは処理途中の
+        チャンクの末尾と、閉じられていない```ブロックの中身のみ。
+
+        Args:
+            chunks (iterable): エスケープしてほしい文字列のチャンク。
+
+        Yields:
+            str: エスケープ後の文字列のチャンク。
+        """
+        if not self._is_compiled:
+            self.compile()
+        if self._escape_pattern is None:
+            # 1回の走査で扱えないタグが登録されている場合は全体を処理する
+            yield self.escape_filter(''.join(chunks))
+            return
+
+        buffer = ''
+        # ```ブロックの中かどうか
+        in_quot = False
+        quot_texts = []
+        for chunk in chunks:
+            buffer += chunk
+            while True:
+                quot_i = buffer.find('```')
+                if quot_i < 0:
+                    break
+                if in_quot:
+                    quot_texts.append(buffer[:quot_i])
+                    yield '```' + ''.join(quot_texts) + '```'
+                    quot_texts = []
+                elif quot_i:
+                    yield self._escape_text(buffer[:quot_i])
+                buffer = buffer[quot_i + 3:]
+                in_quot = not in_quot
+
+            # ```がないため、末尾の`は次のチャンクと合わせて```になりうる
+            end_i = len(buffer) - min(len(buffer) - len(buffer.rstrip('`')), 2)
+            if in_quot:
+                quot_texts.append(buffer[:end_i])
             else:
-                unescaped_text += self.translate(phrase.text)
-        return unescaped_text
+                end_i = self._find_escape_end(buffer, end_i)
+                if end_i:
+                    yield self._escape_text(buffer[:end_i])
+            buffer = buffer[end_i:]
+
+        if in_quot:
+            # 閉じられていない```以降はエスケープ対象
+            yield '```'
+            buffer = ''.join(quot_texts) + buffer
+        if buffer:
+            yield self._escape_text(buffer)
+
+    def _find_escape_end(self, text, end_i):
+        """text[:end_i]のうち、続きを読まずにエスケープできる位置を返す。
+
+        末尾付近の'<'は次のチャンクと合わせて許容タグになりうるため、
+        その手前までとする。
+        """
+        start_i = max(0, end_i - self._max_tag_length + 1)
+        tag_i = text.rfind('<', start_i, end_i)
+        if tag_i >= 0:
+            return tag_i
+        return end_i
+
+    def _escape_text(self, text):
+        """compile済みの正規表現でエスケープする。"""
+        # 分割すると偶数番目がエスケープ対象、
+        # 奇数番目が```で囲まれたブロックか許容タグになる
+        pieces = self._escape_pattern.split(text)
+        pieces[::2] = [_escape_chars(piece) for piece in pieces[::2]]
+        return ''.join(pieces)
+
+    def _create_escape_pattern(self):
+        """```で囲まれたブロックと許容タグを探す正規表現を作成。
+
+        ```はcreate_sentenceと同じく先頭から順に2つずつ組にする。
+        閉じられていない```はどちらにもマッチせず、エスケープ対象になる。
+
+        Returns:
+            re.Pattern: ```で囲まれたブロックか許容タグにマッチする正規表現。
+                        1回の走査で扱えないタグがある場合はNone。
+        """
+        tags = []
+        for escaped_tag, tag in self._permutation_group.items():
+            tag_name = tag[1:-1]
+            if escaped_tag != self._create_escaped_tag(tag_name) \
+                    or tag != self._create_tag(tag_name):
+                return None
+            if escape_html(tag_name) == tag_name:
+                tags.append(tag)
+            elif any(c in tag_name for c in '&<>'):
+                return None
+            # '"'などを含むタグはエスケープ後の文字列に現れないため無視する
+
+        self._max_tag_length = max(
+            [len(tag) for tag in tags] +
+            [self._get_attribute_tag_length(name)
+             for name in self._attribute_tags],
+            default=0
+        )
+        # タグは全て'<'で始まるため、先頭の'<'をくくり出す
+        tags.sort(key=len, reverse=True)
+        tag_alternatives = [re.escape(tag[1:]) for tag in tags]
+        if self._attribute_tags:
+            tag_alternatives.append(
+                self._create_attribute_tag_pattern('"') + '>'
+            )
+        alternatives = [_QUOT_BLOCK_PATTERN]
+        if tag_alternatives:
+            alternatives.append('<(?:' + '|'.join(tag_alternatives) + ')')
+        return re.compile('(' + '|'.join(alternatives) + ')')
+
+    def _create_attribute_tag_pattern(self, quot):
+        """属性を許可するタグの'<'と'>'の間にマッチする正規表現を作成。
+
+        タグ名ごとに属性名の選択肢を持つ1つの正規表現にまとめる。
+        属性の数と値の長さに上限があるため、タグの長さにも上限がある。
+
+        Args:
+            quot (str): 属性の値を囲む文字列。
+
+        Returns:
+            str: 正規表現。
+        """
+        alternatives = []
+        for name in sorted(self._attribute_tags, key=len, reverse=True):
+            attributes = sorted(self._attribute_tags[name],
+                                key=len, reverse=True)
+            alternatives.append(
+                re.escape(name) +
+                '(?: (?:' + '|'.join(map(re.escape, attributes)) + ')=' +
+                re.escape(quot) + _ATTRIBUTE_VALUE_CHARS +
+                '{0,%d}' % MAX_ATTRIBUTE_VALUE_LENGTH + re.escape(quot) +
+                '){0,%d}' % len(attributes)
+            )
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    def _get_attribute_tag_length(self, name):
+        """属性を許可するタグの最大の長さを返す。"""
+        attributes = self._attribute_tags[name]
+        attribute_length = max(len(attribute) for attribute in attributes)
+        # ' attr="value"'の長さ
+        attribute_length += len(' =""') + MAX_ATTRIBUTE_VALUE_LENGTH
+        return len('<' + name + '>') + attribute_length * len(attributes)
+
+
+def _unescape_attribute_tag(result):
+    """エスケープ後の属性付きタグを元に戻す。"""
+    return '<' + result.group(1).replace('&quot;', '"') + '>'
+
+
+def _escape_chars(text):
+    """Html特殊文字をエスケープする。
+
+    escape_htmlと同じ結果を返す。str.translateは変換表にない文字
+    (日本語など)を多く含む文字列で遅くなるため、replaceを使う。
+    """
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    return text.replace('<', '&lt;').replace('>', '&gt;') \
+               .replace('"', '&quot;').replace('\'', '&#39;')
 
 
 def escape_html(text):
@@ -262,14 +823,7 @@ def escape_html(text):
     Returns:
         str: エスケープ後文字列。
     """
-    d = {
-        '&':  '&amp;',
-        '<':  '&lt;',
-        '>':  '&gt;',
-        '"':  '&quot;',
-        '\'': '&#39;'
-    }
-    return str_trans(text, d)
+    return str_trans(text, HTML_ESCAPE_CHARS)
 
 
 def escape_html_filter(text):
@@ -285,40 +839,52 @@ def escape_html_filter(text):
     """
     sentence = create_sentence(text)
 
-    escaped_text = ''
-    for phrase in sentence.phrases:
-        if phrase.is_accepted:
-            escaped_text += phrase.text
+    escaped_texts = []
+    for phrase_text, is_accepted in sentence.texts():
+        if is_accepted:
+            escaped_texts.append(phrase_text)
         else:
-            escaped_text += escape_html(phrase.text)
-    return escaped_text
+            escaped_texts.append(escape_html(phrase_text))
+    return ''.join(escaped_texts)
 
 
-def _create_escape_filters(*accept_texts):
-    """フィルターを作成。
+def get_accepter(*accept_texts):
+    """エスケープしないタグを登録したコンパイル済みHtmlAccepterを返す。
 
-    エスケープやアンエスケープ処理を行う関数のリストを返す。
+    タグの順番や重複によらず、同じタグの組み合わせにはプロセス内で
+    同じインスタンスを返す。共有されるため、返されたHtmlAccepterに
+    タグを追加しないこと。
 
     Args:
         accepts_texts (str, list or tuple): エスケープ対象外文字列。
 
-    Yields:
-        function: escape_html_filterとunescape_html_filter。
+    Returns:
+        HtmlAccepter: accept_textsを登録したHtmlAccepter。
+
+    Raises:
+        ValueError: accept_textsが文字列でない場合。
     """
-    # Html特殊文字をエスケープするフィルター
-    yield escape_html_filter
+    if not accept_texts:
+        return _compile_accepter(())
+    accept_texts = HtmlAccepter._create_accept_texts(accept_texts)
+    return _compile_accepter(tuple(sorted(set(accept_texts))))
+
 
-    # 許容されたHtmlタグはアンエスケープするフィルター
+@lru_cache(maxsize=ACCEPTER_CACHE_SIZE)
+def _compile_accepter(accept_texts):
+    """タグの組み合わせごとにHtmlAccepterを作成してキャッシュする。"""
+    accepter = HtmlAccepter()
     if accept_texts:
-        accepter = HtmlAccepter()
-        accepter.accepts(*accept_texts)
-        yield accepter.unescape_html_filter
+        accepter.accepts(list(accept_texts))
+    return accepter.compile()
 
 
 def escape_markdown(text, *accept_texts):
     """markdown用のタグをエスケープ。
 
     エスケープしないタグがあれば無効とする。
+    escape_html_filterとunescape_html_filterを順に適用した場合と
+    同じ結果を、1回の走査で返す。
 
     Args:
         text (str): エスケープ対象文字列。
@@ -327,7 +893,61 @@ def escape_markdown(text, *accept_texts):
     Returns:
         str: エスケープ後文字列。
     """
-    filters = _create_escape_filters(*accept_texts)
-    for filter in filters:
-        text = filter(text)
-    return text
+    accepter = get_accepter(*accept_texts)
+    return accepter.escape_filter(text)
+
+
+def escape_markdown_iter(chunks, *accept_texts):
+    """markdown用のタグを分割された文字列のまま順にエスケープ。
+
+    escape_markdownと同じ結果を、チャンクに分けて返す。
+    大きな記事を全て読み込まずに処理するために使う。
+
+    Args:
+        chunks (str, iterable or file object): エスケープ対象文字列。
+                                               ファイルオブジェクトの場合は
+                                               STREAM_CHUNK_SIZEずつ読み込む。
+        accept_texts (str, list or tuple): エスケープしないタグ。
+
+    Yields:
+        str: エスケープ後文字列のチャンク。
+    """
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+    elif hasattr(chunks, 'read'):
+        chunks = iter(partial(chunks.read, STREAM_CHUNK_SIZE), '')
+    accepter = get_accepter(*accept_texts)
+    yield from accepter.escape_filter_iter(chunks)
+
+
+def unescape_markdown(text):
+    """escape_markdownでエスケープした文字列を元に戻す。
+
+    ```で囲まれたブロック以外のHtml特殊文字を戻す。
+    許容タグはエスケープされていないため、どのタグを許容したかに
+    よらず元の文字列になる。
+
+    Args:
+        text (str): escape_markdownでエスケープした文字列。
+
+    Returns:
+        str: エスケープ前の文字列。
+    """
+    def replace(result):
+        if result.group(1):
+            return result.group(1)
+        return _HTML_UNESCAPE_CHARS[result.group()]
+    return _UNESCAPE_PATTERN.sub(replace, text)
+
+
+def resanitize_markdown(text, *accept_texts):
+    """エスケープ済みの文字列を、エスケープしないタグを変えてエスケープし直す。
+
+    Args:
+        text (str): escape_markdownでエスケープした文字列。
+        accept_texts (str, list or tuple): エスケープしないタグ。
+
+    Returns:
+        str: エスケープ後文字列。
+    """
+    return escape_markdown(unescape_markdown(text), *accept_texts)
@@ -1,7 +1,7 @@
 from django import forms
-from markdownx.widgets import MarkdownxWidget
 
 from blogs.models import Article
+from blogs.widgets import MarkdownPreviewWidget
 
 
 class ArticleForm(forms.ModelForm):
@@ -19,7 +19,7 @@ class ArticleForm(forms.ModelForm):
             'title_seo', 'description', 'keywords'
         )
         widgets = {
-            'text': MarkdownxWidget(attrs={'class': 'textarea'}),
+            'text': MarkdownPreviewWidget(attrs={'class': 'textarea'}),
         }
 
     def __init__(self, *args, **kwargs):
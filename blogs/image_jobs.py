@@ -0,0 +1,309 @@
+"""アップロードされた画像をリクエストの外で縮小して保存する
+
+viewはtake_uploadとenqueueで元の画像をストレージに置き、ImageJobを
+追加するだけにする。フォームはsave_formで保存し、ワーカーが更新する
+画像の列を古い値で上書きしない。
+process_image_jobsコマンドがジョブを取り出し、縮小した画像を
+ストレージに保存してモデルの画像を差し替える。処理が終わるまで、
+モデルの<フィールド名>_pendingはTrueになり、ページには代わりの画像を
+表示する。縮小した画像と一緒に、WebPなどのレンディションも作る
+(blogs.renditions)。
+"""
+import datetime
+import io
+import logging
+import sys
+import traceback
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile, UploadedFile,
+)
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+
+from blogs.models import ImageJob
+from blogs.renditions import (
+    delete_renditions, dumps, make_renditions, renditions_field,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# 記事のサムネイルとプロフィール画像の大きさ
+THUMBNAIL_SIZE = (150, 150)
+PROFILE_IMAGE_SIZE = (150, 150)
+
+DEFAULT_MAX_ATTEMPTS = 3
+# これより長く処理中のジョブは、止まったものとして取り出し直す
+DEFAULT_STALE_SECONDS = 60 * 10
+# 失敗したジョブと元の画像を、原因を調べられるよう残しておく秒数
+DEFAULT_FAILED_RETENTION_SECONDS = 60 * 60 * 24 * 7
+
+
+def resize_image(image, size):
+    """画像を指定のサイズにリサイズする関数"""
+    # 画像のフォーマットを取得
+    im_format = 'png'
+    if '.' in image.name:
+        im_format = image.name.split('.')[1]
+
+    im = Image.open(image)
+    im = im.resize(size, Image.LANCZOS)
+
+    output_file = io.BytesIO()
+    if im_format == 'png':
+        im.save(output_file, format='PNG')
+    else:
+        im.save(output_file, format='JPEG')
+    output_file.seek(0)
+
+    return InMemoryUploadedFile(
+        output_file,
+        'ImageField',
+        image.name,
+        'image/%s' % im_format,
+        sys.getsizeof(output_file),
+        None
+    )
+
+
+def _pending_field(field_name):
+    return '%s_pending' % field_name
+
+
+def _jobs_for(instance, field_name):
+    return ImageJob.objects.filter(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=str(instance.pk),
+        field_name=field_name,
+    )
+
+
+def take_upload(form, field_name):
+    """フォームで新しくアップロードされた画像を取り出す
+
+    インスタンスの画像は変更前のままにし、処理が終わるまでの印を付ける。
+    新しい画像がなければNoneを返す。
+    """
+    upload = form.cleaned_data.get(field_name)
+    if not isinstance(upload, UploadedFile):
+        return None
+    setattr(form.instance, field_name, form.initial.get(field_name) or '')
+    setattr(form.instance, _pending_field(field_name), True)
+    return upload
+
+
+def enqueue(instance, field_name, upload, size):
+    """保存済みのインスタンスの画像を縮小するジョブを追加する
+
+    同じ画像のまだ処理していないジョブは、新しい画像で置き換える。
+    """
+    cancel(instance, field_name)
+    upload.seek(0)
+    storage = getattr(instance, field_name).storage
+    source = storage.save(
+        '%s/%s' % (ImageJob.SOURCE_DIR, upload.name), upload
+    )
+    return ImageJob.objects.create(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=str(instance.pk),
+        field_name=field_name,
+        file_name=upload.name,
+        source=source,
+        width=size[0],
+        height=size[1],
+    )
+
+
+def cancel(instance, field_name):
+    """処理を始めていないジョブを削除する
+
+    元の画像はblogs.signalsで削除する。
+    """
+    _jobs_for(instance, field_name).exclude(status=ImageJob.RUNNING).delete()
+
+
+def clear_image(form, field_name):
+    """フォームでクリアされた画像のファイルとレンディションを削除する
+
+    インスタンスはフォームの値で上書き済みのため、フォームの初期値から
+    ファイルを探す。FieldFile.deleteはインスタンスの値も消すため
+    使わない。
+    """
+    instance = form.instance
+    cancel(instance, field_name)
+    setattr(instance, _pending_field(field_name), False)
+    old = form.initial.get(field_name)
+    if old:
+        old.storage.delete(old.name)
+        delete_renditions(
+            old.storage, getattr(instance, renditions_field(field_name))
+        )
+    setattr(instance, renditions_field(field_name), '')
+
+
+def save_form(form, field_name):
+    """フォームのインスタンスを保存して返す
+
+    画像と<フィールド名>_pending、レンディションの列はワーカーも更新する。
+    フォームを表示した時の古い値で処理結果を上書きしないよう、
+    画像をクリアした場合と新しい画像を受け取った場合だけ保存する。
+    """
+    instance = form.save(commit=False)
+    if instance._state.adding:
+        instance.save()
+    else:
+        pending_field = _pending_field(field_name)
+        image_fields = {
+            field_name, pending_field, renditions_field(field_name),
+        }
+        value = form.cleaned_data.get(field_name)
+        if value is False:
+            # clear_imageが全ての列を変えた
+            changed = image_fields
+        elif isinstance(value, UploadedFile):
+            # take_uploadは処理中の印だけを変えた
+            changed = {pending_field}
+        else:
+            changed = set()
+        skipped = image_fields - changed
+        instance.save(update_fields=[
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in skipped
+        ])
+    form.save_m2m()
+    return instance
+
+
+def _claimable():
+    stale_seconds = getattr(
+        settings, 'IMAGE_JOB_STALE_SECONDS', DEFAULT_STALE_SECONDS
+    )
+    stale = timezone.now() - datetime.timedelta(seconds=stale_seconds)
+    return Q(status=ImageJob.PENDING) | Q(
+        status=ImageJob.RUNNING, started_at__lt=stale
+    )
+
+
+def claim_next():
+    """次のジョブを処理中にして返す。なければNone
+
+    複数のワーカーが同じジョブを取らないよう、状態を条件にした
+    UPDATEで取り出す。
+    """
+    candidates = ImageJob.objects.filter(_claimable()).order_by(
+        'created_at'
+    ).values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        claimed = ImageJob.objects.filter(_claimable(), pk=pk).update(
+            status=ImageJob.RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ImageJob.objects.get(pk=pk)
+    return None
+
+
+def _finish(instance, job, **fields):
+    """インスタンスの画像を更新し、他にジョブがなければ印を外す"""
+    pending_field = _pending_field(job.field_name)
+    others = _jobs_for(instance, job.field_name).exclude(pk=job.pk)
+    fields[pending_field] = others.exclude(
+        status=ImageJob.FAILED
+    ).exists()
+    for name, value in fields.items():
+        setattr(instance, name, value)
+    # シグナルでページのキャッシュを外すためsaveを使う
+    instance.save(update_fields=list(fields))
+
+
+def process(job):
+    """ジョブの画像を縮小して保存し、ジョブを削除する"""
+    model = job.content_type.model_class()
+    try:
+        instance = model._default_manager.get(pk=job.object_id)
+    except model.DoesNotExist:
+        job.delete()
+        return
+
+    field_file = getattr(instance, job.field_name)
+    with field_file.storage.open(job.source) as source:
+        data = source.read()
+    image = resize_image(
+        ContentFile(data, name=job.file_name), (job.width, job.height)
+    )
+    old_name = field_file.name
+    old_renditions = getattr(instance, renditions_field(job.field_name))
+    field_file.save(job.file_name, image, save=False)
+    try:
+        renditions = make_renditions(
+            ContentFile(data), (job.width, job.height), field_file
+        )
+    except Exception:
+        # レンディションがなくても縮小した画像は表示できる
+        logger.exception('renditions for image job %s failed', job.pk)
+        renditions = []
+    _finish(instance, job, **{
+        job.field_name: field_file.name,
+        renditions_field(job.field_name): dumps(renditions),
+    })
+    if old_name and old_name != field_file.name:
+        field_file.storage.delete(old_name)
+    delete_renditions(field_file.storage, old_renditions)
+    job.delete()
+
+
+def _fail(job):
+    """失敗したジョブを待機中に戻す。回数を超えたら失敗にする"""
+    max_attempts = getattr(
+        settings, 'IMAGE_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS
+    )
+    job.error = traceback.format_exc()
+    if job.attempts < max_attempts:
+        job.status = ImageJob.PENDING
+        job.save(update_fields=['status', 'error'])
+        return
+    job.status = ImageJob.FAILED
+    job.save(update_fields=['status', 'error'])
+    # 代わりの画像を出し続けないよう、変更前の画像に戻す
+    model = job.content_type.model_class()
+    instance = model._default_manager.filter(pk=job.object_id).first()
+    if instance is not None:
+        _finish(instance, job)
+
+
+def delete_failed_jobs():
+    """残しておく期間を過ぎた失敗したジョブを削除し、削除した数を返す
+
+    元の画像はblogs.signalsで削除する。
+    """
+    retention = getattr(
+        settings, 'IMAGE_JOB_FAILED_RETENTION_SECONDS',
+        DEFAULT_FAILED_RETENTION_SECONDS
+    )
+    expired = timezone.now() - datetime.timedelta(seconds=retention)
+    deleted, _ = ImageJob.objects.filter(
+        status=ImageJob.FAILED, created_at__lt=expired
+    ).delete()
+    return deleted
+
+
+def process_jobs(limit=None):
+    """待っているジョブを順に処理し、処理した数を返す"""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next()
+        if job is None:
+            break
+        try:
+            process(job)
+        except Exception:
+            logger.exception('image job %s failed', job.pk)
+            _fail(job)
+        count += 1
+    return count
@@ -0,0 +1,225 @@
+"""マークダウンの変換を別プロセスで時間を区切って行う
+
+入れ子の深いリストや大きな表、大量の強調記号を含む記事は、変換に
+数秒かかることがある。その間ワーカーが他のリクエストを処理できなく
+ならないよう、変換は別プロセスでCPU時間の上限を決めて行い、上限を
+超えた場合はエスケープした本文をそのまま表示する。
+
+プロセスはforkserverから起動する。マルチスレッドのプロセスをforkすると、
+他のスレッドが持っていたロックを子プロセスが引き継いで止まることがある。
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+
+import django
+from django.conf import settings
+from django.utils.html import escape
+
+
+logger = logging.getLogger(__name__)
+
+# 1回の変換に使えるCPU時間(秒)。0かNoneなら別プロセスを使わない
+RENDER_CPU_BUDGET = 2.0
+# CPU時間を数えられない処理で止まった場合に、プロセスを止めるまでの
+# 経過時間のCPU時間に対する倍率
+RENDER_WALL_FACTOR = 3
+# 変換用のプロセスでDjangoの準備が終わるまで待つ秒数
+WORKER_START_TIMEOUT = 30
+
+
+class RenderBudgetExceeded(Exception):
+    """変換がCPU時間の上限を超えた"""
+
+
+class RenderFailed(Exception):
+    """変換できなかった
+
+    一時的な失敗(transientがTrue)の場合、呼び出し側は結果を保存せず、
+    htmlをそのリクエストだけ表示する。CPU時間の上限を超えた場合は
+    何度変換しても同じなので、htmlを保存して変換し直さない。
+
+    Attributes:
+        html (str): 代わりに表示するエスケープした本文。
+        transient (bool): プロセスの異常など、変換し直せば成功しうるか。
+    """
+    def __init__(self, html, transient=True):
+        super().__init__(html)
+        self.html = html
+        self.transient = transient
+
+
+def fallback_html(text):
+    """変換できなかった本文をエスケープして整形済みテキストにする"""
+    return '<pre>%s</pre>' % escape(text)
+
+
+def _on_budget_exceeded(signum, frame):
+    raise RenderBudgetExceeded()
+
+
+def _worker_main(conn, budget, settings_module):
+    """変換用のプロセスで、受け取った本文を順に変換する"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 変換の関数を読み込めるよう、親プロセスと同じ設定で準備する
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    django.setup()
+    # 共有キャッシュやデータベースの障害で変換が失敗しないよう、
+    # ブロックのキャッシュはプロセス内だけで持つ
+    from blogs.render import render_cache
+    render_cache.detach()
+    signal.signal(signal.SIGPROF, _on_budget_exceeded)
+    conn.send('ready')
+    while True:
+        try:
+            render, text = conn.recv()
+        except (EOFError, OSError):
+            # 親プロセスが終了した
+            return
+        try:
+            signal.setitimer(signal.ITIMER_PROF, budget)
+            try:
+                result = ('ok', render(text))
+            finally:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+        except RenderBudgetExceeded:
+            result = ('budget', None)
+        except Exception as e:
+            result = ('error', repr(e))
+        conn.send(result)
+
+
+class IsolatedRenderer:
+    """変換用のプロセスを保持し、CPU時間の上限をつけて変換する
+
+    プロセスはスレッドごとに1つ起動して使い回す。
+
+    Args:
+        budget (float): 1回の変換に使えるCPU時間(秒)。0なら別プロセスを
+                        使わない。省略時はMARKDOWN_RENDER_CPU_BUDGETの
+                        設定を使う。
+    """
+    def __init__(self, budget=None):
+        if budget is None:
+            budget = getattr(
+                settings, 'MARKDOWN_RENDER_CPU_BUDGET', RENDER_CPU_BUDGET
+            )
+        self.budget = budget
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """カウンタを0に戻す"""
+        self.renders = 0
+        self.budget_exceeded = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def stats(self):
+        """カウンタの値を返す"""
+        return {
+            'renders': self.renders,
+            'budget_exceeded': self.budget_exceeded,
+            'errors': self.errors,
+            'restarts': self.restarts,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _start(self):
+        context = multiprocessing.get_context('forkserver')
+        parent, child = context.Pipe()
+        # override_settingsの中ではSETTINGS_MODULEがNoneになる
+        settings_module = (
+            settings.SETTINGS_MODULE or
+            os.environ.get('DJANGO_SETTINGS_MODULE')
+        )
+        process = context.Process(
+            target=_worker_main,
+            args=(child, self.budget, settings_module),
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        self._local.worker = (process, parent)
+        if not parent.poll(WORKER_START_TIMEOUT) or parent.recv() != 'ready':
+            raise OSError('render worker did not start')
+        return process, parent
+
+    def stop(self):
+        """このスレッドの変換用のプロセスを止める"""
+        worker = getattr(self._local, 'worker', None)
+        if worker is None:
+            return
+        process, conn = worker
+        self._local.worker = None
+        conn.close()
+        process.terminate()
+        process.join()
+
+    def _restart(self):
+        """次の変換で新しいプロセスを起動する"""
+        self._count('restarts')
+        self.stop()
+
+    def render(self, render, text, article_id=None):
+        """renderでtextを変換する
+
+        上限を超えた場合や変換に失敗した場合は、ログに記録して
+        RenderFailedを送出する。上限を超えた場合だけtransientをFalseにする。
+
+        Args:
+            render (function): 本文をhtmlに変換するモジュールの関数。
+            text (str): マークダウン。
+            article_id: ログに記録する記事のid。
+
+        Returns:
+            str: 変換後のhtml。
+
+        Raises:
+            RenderFailed: 変換できなかった。
+        """
+        if not self.budget:
+            return render(text)
+        self._count('renders')
+
+        try:
+            worker = getattr(self._local, 'worker', None)
+            if worker is None or not worker[0].is_alive():
+                worker = self._start()
+            conn = worker[1]
+            conn.send((render, text))
+            if conn.poll(self.budget * RENDER_WALL_FACTOR):
+                status, result = conn.recv()
+            else:
+                # シグナルで止められない処理の中で止まっている
+                status, result = 'budget', None
+                self._restart()
+        except (EOFError, OSError) as e:
+            # プロセスを起動できなかったか、変換中に終了した
+            status, result = 'error', repr(e)
+            self._restart()
+
+        if status == 'ok':
+            return result
+        if status == 'budget':
+            self._count('budget_exceeded')
+            logger.warning(
+                'markdown render exceeded %ss of CPU time (article %s)',
+                self.budget, article_id
+            )
+            raise RenderFailed(fallback_html(text), transient=False)
+        self._count('errors')
+        logger.warning(
+            'markdown render failed (article %s): %s',
+            article_id, result
+        )
+        raise RenderFailed(fallback_html(text))
+
+
+isolated_renderer = IsolatedRenderer()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from blogs.models import Article
+from blogs.renditions import dumps, make_renditions, renditions_field
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    """レンディションのない保存済みの画像からレンディションを作るコマンド
+
+    ImageJobより前にアップロードされた画像が対象。元の画像は残って
+    いないため、縮小済みの画像より大きい幅のレンディションは作らない。
+    """
+    help = 'Create renditions for stored images that have none.'
+
+    TARGETS = (
+        (Article, 'thumbnail'),
+        (Profile, 'image'),
+    )
+
+    def handle(self, *args, **options):
+        created_count = 0
+        for model, field_name in self.TARGETS:
+            renditions = renditions_field(field_name)
+            queryset = model._default_manager.exclude(
+                **{field_name: ''}
+            ).filter(**{renditions: ''}).only('pk', field_name, renditions)
+            for instance in queryset.iterator():
+                field_file = getattr(instance, field_name)
+                with field_file.open('rb') as source:
+                    value = make_renditions(
+                        source, (field_file.width, field_file.height),
+                        field_file
+                    )
+                setattr(instance, renditions, dumps(value))
+                # シグナルでページのキャッシュを外すためsaveを使う
+                instance.save(update_fields=[renditions])
+                created_count += 1
+
+        self.stdout.write('created renditions for %d images' % created_count)
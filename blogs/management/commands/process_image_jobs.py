@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blogs.image_jobs import delete_failed_jobs, process_jobs
+
+
+class Command(BaseCommand):
+    """アップロードされた画像を縮小して保存するワーカー
+
+    ImageJobを古い順に取り出して処理する。--onceがなければ、ジョブが
+    なくなってもinterval秒ごとに確認を続ける。失敗したまま残す期間を
+    過ぎたジョブは、元の画像と一緒に削除する。
+    """
+    help = 'Resize uploaded images queued in ImageJob and store them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='待っているジョブを処理したら終了する')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='ジョブがない時に待つ秒数')
+
+    def handle(self, *args, **options):
+        processed_count = 0
+        deleted_count = 0
+        while True:
+            deleted_count += delete_failed_jobs()
+            count = process_jobs()
+            processed_count += count
+            if options['once']:
+                break
+            if not count:
+                # 長く待つ間に切れた接続を使わない
+                close_old_connections()
+                time.sleep(options['interval'])
+
+        self.stdout.write('processed %d images' % processed_count)
+        if deleted_count:
+            self.stdout.write('deleted %d failed jobs' % deleted_count)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from blogs.models import Category
+
+
+class Command(BaseCommand):
+    """カテゴリーの公開記事数を数え直すコマンド
+
+    シグナルを送らない更新(QuerySet.updateなど)で数がずれた場合に使う。
+    ずれていたカテゴリーだけを更新する。
+    """
+    help = 'Recount Category.public_article_count from the articles.'
+
+    def handle(self, *args, **options):
+        categories = Category.objects.annotate(
+            count=Count('article', filter=Q(article__is_public=True))
+        )
+        fixed_count = 0
+        for category in categories:
+            if category.public_article_count == category.count:
+                continue
+            Category.objects.filter(pk=category.pk).update(
+                public_article_count=category.count
+            )
+            fixed_count += 1
+
+        self.stdout.write('fixed %d categories' % fixed_count)
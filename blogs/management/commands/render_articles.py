@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blogs import page_cache
+from blogs.models import Article
+from blogs.render import RENDERER_VERSION
+
+
+class Command(BaseCommand):
+    """保存済みのhtmlを変換し直すコマンド
+
+    RENDERER_VERSIONが古い記事を主キー順にbatch-sizeずつ読み込み、
+    変換したhtmlをchunk-sizeずつ短いトランザクションで保存する。
+    CPU時間の上限を超えた記事はエスケープした本文を保存する。一時的に
+    変換できなかった記事は保存せず、次に表示する時に変換し直す。
+    bulk_updateはシグナルを送らないため、詳細ページのキャッシュは
+    トランザクションごとに外す。
+    """
+    help = 'Render Article.html for articles with a stale renderer version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='1度に読み込む記事の数')
+        parser.add_argument('--chunk-size', type=int, default=50,
+                            help='1つのトランザクションで更新する記事の数')
+        parser.add_argument('--all', action='store_true',
+                            help='変換方法が新しい記事も変換し直す')
+
+    def handle(self, *args, **options):
+        queryset = Article.objects.only('pk', 'text').order_by('pk')
+        if not options['all']:
+            queryset = queryset.exclude(html_version=RENDERER_VERSION)
+
+        rendered_count = 0
+        failed_count = 0
+        last_pk = None
+        while True:
+            batch_queryset = queryset
+            if last_pk is not None:
+                batch_queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[:options['batch_size']].iterator())
+            if not batch:
+                break
+
+            saved = []
+            for article in batch:
+                if article.render_html():
+                    rendered_count += 1
+                else:
+                    failed_count += 1
+                if article.html_version == RENDERER_VERSION:
+                    saved.append(article)
+            chunk_size = options['chunk_size']
+            for i in range(0, len(saved), chunk_size):
+                chunk = saved[i:i + chunk_size]
+                with transaction.atomic():
+                    Article.objects.bulk_update(
+                        chunk, ['html', 'html_version', 'html_failed']
+                    )
+                page_cache.purge(*[
+                    'article:%s' % article.pk for article in chunk
+                ])
+            last_pk = batch[-1].pk
+
+        self.stdout.write('rendered %d articles' % rendered_count)
+        if failed_count:
+            self.stdout.write('failed to render %d articles' % failed_count)
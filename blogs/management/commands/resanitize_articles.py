@@ -0,0 +1,134 @@
+import difflib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blogs import page_cache
+from blogs.escape import resanitize_markdown
+from blogs.models import Article
+from blogs.views import ACCEPT_TAGS
+
+
+class Command(BaseCommand):
+    """全ての記事を現在のACCEPT_TAGSでエスケープし直すコマンド
+
+    記事は主キー順にbatch-sizeずつ読み込み、プロセスプールで
+    エスケープし直した後、chunk-sizeずつ短いトランザクションで
+    bulk_updateする。バッチごとに最後の主キーをcheckpointに保存し、
+    --resumeで続きから再開できる。
+    更新した記事の保存済みhtmlは、次に表示する時かrender_articlesで
+    変換し直される。bulk_updateはシグナルを送らないため、詳細ページの
+    キャッシュはトランザクションごとに外す。
+    """
+    help = 'Re-sanitize Article.text with the current ACCEPT_TAGS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='1度に読み込む記事の数')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='1つのトランザクションで更新する記事の数')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='プロセスの数。1ならプールを使わない')
+        parser.add_argument('--checkpoint', default='resanitize.checkpoint',
+                            help='処理済みの最後の主キーを保存するファイル')
+        parser.add_argument('--resume', action='store_true',
+                            help='checkpointの続きから再開する')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='更新せずに差分を表示する')
+
+    def handle(self, *args, **options):
+        last_pk = None
+        if options['resume'] and os.path.exists(options['checkpoint']):
+            with open(options['checkpoint']) as f:
+                last_pk = f.read().strip() or None
+
+        accept_tags = list(ACCEPT_TAGS)
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'])
+
+        checked_count = 0
+        updated_count = 0
+        try:
+            for batch in self._iter_batches(options['batch_size'], last_pk):
+                texts = [article.text for article in batch]
+                if executor is None:
+                    new_texts = map(
+                        resanitize_markdown, texts, repeat(accept_tags)
+                    )
+                else:
+                    chunksize = max(1, len(texts) // (options['workers'] * 4))
+                    new_texts = executor.map(
+                        resanitize_markdown, texts, repeat(accept_tags),
+                        chunksize=chunksize
+                    )
+
+                changed = []
+                for article, new_text in zip(batch, new_texts):
+                    if new_text != article.text:
+                        if options['dry_run']:
+                            self._write_diff(article, new_text)
+                        article.text = new_text
+                        # 保存済みのhtmlを古いものとして扱う
+                        article.html_version = 0
+                        changed.append(article)
+
+                if not options['dry_run']:
+                    self._update(changed, options['chunk_size'])
+                    self._save_checkpoint(options['checkpoint'], batch[-1].pk)
+                checked_count += len(batch)
+                updated_count += len(changed)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # 最後まで終わったらcheckpointは不要
+        if not options['dry_run'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+        verb = 'would update' if options['dry_run'] else 'updated'
+        self.stdout.write('checked %d articles, %s %d' % (
+            checked_count, verb, updated_count))
+
+    def _iter_batches(self, batch_size, last_pk):
+        """主キー順にbatch_sizeずつ記事を返す。"""
+        queryset = Article.objects.only('pk', 'text').order_by('pk')
+        while True:
+            if last_pk is not None:
+                batch_queryset = queryset.filter(pk__gt=last_pk)
+            else:
+                batch_queryset = queryset
+            batch = list(batch_queryset[:batch_size].iterator())
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def _update(self, articles, chunk_size):
+        """chunk_sizeずつ短いトランザクションで更新する。"""
+        for i in range(0, len(articles), chunk_size):
+            chunk = articles[i:i + chunk_size]
+            with transaction.atomic():
+                Article.objects.bulk_update(chunk, ['text', 'html_version'])
+            page_cache.purge(*[
+                'article:%s' % article.pk for article in chunk
+            ])
+
+    def _save_checkpoint(self, path, pk):
+        """書き込み途中で止まっても壊れないように置き換える。"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(pk))
+        os.replace(tmp_path, path)
+
+    def _write_diff(self, article, new_text):
+        diff = difflib.unified_diff(
+            article.text.splitlines(keepends=True),
+            new_text.splitlines(keepends=True),
+            fromfile='%s (current)' % article.pk,
+            tofile='%s (resanitized)' % article.pk,
+        )
+        self.stdout.write(''.join(diff))
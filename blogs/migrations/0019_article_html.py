@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0018_auto_20201115_1312'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='HTML'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='html_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='HTMLの変換方法'),
+        ),
+    ]
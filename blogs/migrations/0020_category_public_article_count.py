@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_public_articles(apps, schema_editor):
+    Category = apps.get_model('blogs', 'Category')
+    categories = Category.objects.annotate(
+        count=Count('article', filter=Q(article__is_public=True))
+    )
+    for category in categories:
+        category.public_article_count = category.count
+        category.save(update_fields=['public_article_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0019_article_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='public_article_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='公開記事数'),
+        ),
+        migrations.RunPython(count_public_articles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:55
+
+from django.db import migrations, models
+
+# 自動で作られる中間テーブルにはMeta.indexesを書けないため、直接作る
+CATEGORY_ARTICLE_INDEX = models.Index(
+    fields=['category', 'article'], name='article_category_article_idx'
+)
+
+
+def _through(apps):
+    Article = apps.get_model('blogs', 'Article')
+    return Article._meta.get_field('categories').remote_field.through
+
+
+def add_category_index(apps, schema_editor):
+    schema_editor.add_index(_through(apps), CATEGORY_ARTICLE_INDEX)
+
+
+def remove_category_index(apps, schema_editor):
+    schema_editor.remove_index(_through(apps), CATEGORY_ARTICLE_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0020_category_public_article_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['is_public', 'created_at', 'id'], name='article_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['author', 'created_at'], name='article_author_created_idx'),
+        ),
+        migrations.RunPython(add_category_index, remove_category_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0022_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='thumbnail_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
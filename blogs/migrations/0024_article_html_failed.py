@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0023_article_thumbnail_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='html_failed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='HTMLの変換の失敗'),
+        ),
+    ]
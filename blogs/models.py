@@ -1,22 +1,63 @@
+import logging
 import uuid
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.urls import reverse
 from markdownx.models import MarkdownxField
 
+from blogs.isolation import RenderFailed, isolated_renderer
+from blogs.render import RENDERER_VERSION, render_markdown
+
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+# 一覧のカードと表に表示する列
+LIST_FIELDS = (
+    'id', 'title', 'created_at', 'description', 'thumbnail',
+    'thumbnail_pending', 'thumbnail_renditions', 'is_public',
+)
+
 
 class Category(models.Model):
     """カテゴリー"""
     name = models.CharField('カテゴリー名', max_length=255, unique=True)
+    # 公開記事の数。blogs.signalsで記事の変更に合わせて更新する
+    public_article_count = models.PositiveIntegerField(
+        '公開記事数',
+        default=0,
+        editable=False
+    )
 
     def __str__(self):
         return self.name
 
 
+class ListModelIterable(ModelIterable):
+    """一覧用に読み込んだ記事に印を付ける"""
+    def __iter__(self):
+        for article in super().__iter__():
+            article._for_list = True
+            yield article
+
+
+class ArticleQuerySet(models.QuerySet):
+    def for_list(self):
+        """一覧に表示する列だけを読み込む
+
+        本文やhtmlなどの大きな列は読み込まない。DEBUGの場合、読み込んで
+        いない列に後からアクセスするとログに警告を出す。
+        """
+        queryset = self.only(*LIST_FIELDS)
+        queryset._iterable_class = ListModelIterable
+        return queryset
+
+
 class Article(models.Model):
     """記事"""
     # pkにuuidを使う
@@ -37,15 +78,193 @@ class Article(models.Model):
     )
     is_public = models.BooleanField('公開', default=True)
     thumbnail = models.ImageField(upload_to='thumbnail', blank=True)
+    # アップロードされた画像をImageJobで処理している間はTrue
+    thumbnail_pending = models.BooleanField(default=False, editable=False)
+    # thumbnailから作ったWebPなどの画像の情報(blogs.renditions)
+    thumbnail_renditions = models.TextField(
+        default='', blank=True, editable=False
+    )
     categories = models.ManyToManyField(Category, blank=True)
     # SEO
     title_seo = models.CharField('タイトル', max_length=255, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     keywords = models.CharField(max_length=255, null=True, blank=True)
+    # 本文を変換したhtmlと、変換に使ったRENDERER_VERSION
+    html = models.TextField('HTML', blank=True, default='', editable=False)
+    html_version = models.PositiveIntegerField(
+        'HTMLの変換方法',
+        default=0,
+        editable=False
+    )
+    # CPU時間の上限を超えて、htmlがエスケープした本文になっているか
+    html_failed = models.BooleanField(
+        'HTMLの変換の失敗',
+        default=False,
+        editable=False
+    )
+
+    class Meta:
+        indexes = [
+            # 公開記事の一覧(is_public=True, 新しい順)。idはカーソルでの
+            # ページ分割で同じ日時の記事を並べるため
+            models.Index(
+                fields=['is_public', 'created_at', 'id'],
+                name='article_public_created_idx'
+            ),
+            # プロフィールの記事一覧(author, 新しい順)
+            models.Index(
+                fields=['author', 'created_at'],
+                name='article_author_created_idx'
+            ),
+        ]
+
+    objects = ArticleQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        article = super().from_db(db, field_names, values)
+        article._remember_text()
+        return article
+
+    def refresh_from_db(self, using=None, fields=None):
+        """読み込んでいない列へのアクセスも、ここで読み込まれる"""
+        if fields and settings.DEBUG and getattr(self, '_for_list', False):
+            logger.warning(
+                'deferred fields %s of article %s loaded after for_list()',
+                ', '.join(fields), self.pk
+            )
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or 'text' in fields:
+            self._remember_text()
+
+    def _remember_text(self):
+        """保存時に本文が変わったか分かるよう、読み込んだ本文を覚えておく"""
+        self._saved_text = self.__dict__.get('text')
+
+    def save(self, *args, **kwargs):
+        """本文が変わっていれば、htmlも変換し直して保存する
+
+        viewだけでなく、管理画面やshellでの保存もhtmlに反映する。
+        QuerySet.updateやbulk_updateでは呼ばれないため、本文を変える
+        場合はhtml_versionを0にすること。
+        """
+        update_fields = kwargs.get('update_fields')
+        text_saved = update_fields is None or 'text' in update_fields
+        text_changed = 'text' in self.__dict__ and (
+            self._state.adding or
+            self.text != getattr(self, '_saved_text', None)
+        )
+        if text_saved and text_changed:
+            self.render_html()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {
+                    'html', 'html_version', 'html_failed',
+                }
+        super().save(*args, **kwargs)
+        self._remember_text()
+
+    def render_html(self):
+        """本文をhtmlに変換して保持する。保存はしない
+
+        変換できなかった場合はエスケープした本文を保持する。CPU時間の
+        上限を超えた場合は、変換方法か本文が変わるまで変換し直さないよう
+        html_failedをTrueにしてhtml_versionを今の版にする。一時的な失敗の
+        場合は、次に表示する時に変換し直すようhtml_versionを0にする。
+
+        Returns:
+            bool: 変換できたらTrue。
+        """
+        try:
+            self.html = isolated_renderer.render(
+                render_markdown, self.text, article_id=self.pk
+            )
+        except RenderFailed as e:
+            self.html = e.html
+            self.html_failed = not e.transient
+            self.html_version = 0 if e.transient else RENDERER_VERSION
+            return False
+        self.html_failed = False
+        self.html_version = RENDERER_VERSION
+        return True
+
+    def get_html(self):
+        """変換済みのhtmlを返す
+
+        変換方法が古い場合は変換し直して保存する。一時的な失敗の場合は
+        保存せず、エスケープした本文を返す
+        """
+        if self.html_version != RENDERER_VERSION:
+            self.render_html()
+            if self.html_version == RENDERER_VERSION:
+                Article.objects.filter(pk=self.pk).update(
+                    html=self.html,
+                    html_version=self.html_version,
+                    html_failed=self.html_failed
+                )
+        return self.html
+
     def get_absolute_url(self):
         """更新完了時の戻り先URL"""
         return reverse('blogs:article_detail', kwargs={'pk': self.id})
+
+
+class ImageJob(models.Model):
+    """アップロードされた画像の縮小と保存を待つジョブ
+
+    リクエスト中は元の画像をストレージのSOURCE_DIRに置くだけにし、縮小と
+    保存はprocess_image_jobsコマンドが行う。終わったジョブは削除する。
+    元の画像はデータベースに入れない(MySQLのmax_allowed_packetを超える)。
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, '待機中'),
+        (RUNNING, '処理中'),
+        (FAILED, '失敗'),
+    )
+    # 処理を待つ元の画像を置くディレクトリ
+    SOURCE_DIR = 'image_jobs'
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=36)
+    field_name = models.CharField(max_length=50)
+    # アップロードされたファイルの名前と、ストレージに置いた元の画像の名前
+    file_name = models.CharField(max_length=255)
+    source = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'created_at'],
+                name='imagejob_status_created_idx'
+            ),
+            models.Index(
+                fields=['content_type', 'object_id'],
+                name='imagejob_object_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s %s.%s' % (self.content_type, self.object_id,
+                             self.field_name)
+
+    @property
+    def storage(self):
+        """元の画像と縮小した画像を保存するストレージ"""
+        model = ContentType.objects.get_for_id(
+            self.content_type_id
+        ).model_class()
+        return model._meta.get_field(self.field_name).storage
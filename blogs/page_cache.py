@@ -0,0 +1,187 @@
+"""ログインしていない読者向けのページのキャッシュ
+
+ページはグループに属し、キーにはグループごとの世代を含める。記事などが
+変わった時は関係するグループの世代を変えるだけで、そのグループの
+ページはすべて読まれなくなる。
+
+グループ:
+    listing: 記事一覧とカテゴリーごとの一覧のすべて(カテゴリーの記事数)
+    index: カテゴリーで絞り込まない記事一覧
+    category:<name>: カテゴリーで絞り込んだ記事一覧
+    article:<pk>: 記事の詳細
+    profile:<user_name>: プロフィール
+
+世代は保存したプロセスで変えるため、全てのプロセスが同じキャッシュを
+使う必要がある(config.settingsのCACHES)。
+"""
+import hashlib
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+
+DEFAULT_CACHE_ALIAS = 'default'
+DEFAULT_TIMEOUT = 60 * 5
+
+KEY_PREFIX = 'page-cache:'
+
+
+def _cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)]
+
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+# プロセスごとに別のキャッシュになるバックエンド
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """ページのキャッシュがプロセス間で共有されるか確認する"""
+    alias = getattr(settings, 'PAGE_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    # 開発用のサーバーは1プロセスなのでLocMemCacheでよい
+    if (settings.DEBUG or not _timeout() or
+            backend not in PROCESS_LOCAL_BACKENDS):
+        return []
+    return [checks.Warning(
+        'The page cache uses %s, which is not shared between processes.'
+        % backend,
+        hint='Pages purged in one worker stay cached in the others. '
+             'Set CACHE_URL to a shared cache such as redis:// or '
+             'memcache://.',
+        id='blogs.W001',
+    )]
+
+
+def _generation_key(group):
+    # カテゴリー名やユーザー名を含むため、memcachedで使える文字にする
+    digest = hashlib.md5(group.encode('utf-8')).hexdigest()
+    return '%sgeneration:%s' % (KEY_PREFIX, digest)
+
+
+def _generations(groups):
+    """グループの世代。なければ新しく決める"""
+    cache = _cache()
+    keys = [_generation_key(group) for group in groups]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # 同時に決めた場合は先に保存された方を使う
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def purge(*groups):
+    """グループのページをすべてキャッシュから外す"""
+    if groups:
+        _cache().set_many({
+            _generation_key(group): uuid.uuid4().hex for group in groups
+        }, None)
+
+
+def normalize_query(query, params):
+    """paramsのパラメーターだけを、順番と表記をそろえて並べる
+
+    pageの'01'や'1'は、省略した場合と同じページになる。
+    """
+    normalized = []
+    for name in sorted(params):
+        if name not in query:
+            continue
+        value = query[name]
+        if name == 'page':
+            value = value.strip()
+            if value.isdigit():
+                value = str(int(value))
+            if value == '1':
+                continue
+        normalized.append((name, value))
+    return urlencode(normalized)
+
+
+def page_key(request, groups, params=()):
+    """リクエストのページのキャッシュのキー"""
+    parts = [request.path, normalize_query(request.GET, params)]
+    parts.extend(_generations(groups))
+    digest = hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def _is_cacheable_request(request):
+    """セッションを持たない読者のGETだけをキャッシュする"""
+    return (
+        request.method == 'GET' and
+        settings.SESSION_COOKIE_NAME not in request.COOKIES
+    )
+
+
+def _is_cacheable_response(request, response):
+    """Cookieを設定する、またはCSRFのトークンを含むページは除く"""
+    return (
+        response.status_code == 200 and
+        not response.cookies and
+        not request.META.get('CSRF_COOKIE_USED') and
+        not response.has_header('Cache-Control')
+    )
+
+
+def cache_anonymous_page(groups, params=()):
+    """ログインしていない読者のGETのレスポンスをキャッシュする
+
+    Args:
+        groups: (request, **kwargs)からページのグループの一覧を返す関数。
+        params (tuple): キーに含めるクエリパラメーター。他は無視する。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            timeout = _timeout()
+            if not timeout or not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            key = page_key(request, groups(request, **kwargs), params)
+            response = _cache().get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+
+            def store(response):
+                if _is_cacheable_response(request, response):
+                    # ログインすると内容が変わる
+                    patch_vary_headers(response, ('Cookie',))
+                    _cache().set(key, response, timeout)
+
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+def index_groups(request):
+    category = request.GET.get('category')
+    if category is None:
+        return ['listing', 'index']
+    return ['listing', 'category:%s' % category]
+
+
+def article_groups(request, pk):
+    return ['article:%s' % pk]
+
+
+def profile_groups(request, name):
+    return ['profile:%s' % name]
@@ -0,0 +1,215 @@
+"""記事一覧のページ分割
+
+CursorPaginatorは(created_at, id)の位置でページを分け、OFFSETや
+COUNT(*)を使わない。前後のページへの位置は外から中身の分からない
+トークンで渡す。
+"""
+import base64
+import binascii
+import json
+import uuid
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    """トークンを読み取れない"""
+
+
+def encode_cursor(direction, article):
+    """記事の位置と向きをトークンにする
+
+    Args:
+        direction (str): 'next'なら記事より後、'previous'なら前のページ。
+        article (Article): ページの端の記事。
+    """
+    created_at = article.created_at
+    data = [
+        direction,
+        created_at.isoformat() if created_at is not None else None,
+        str(article.pk),
+    ]
+    token = base64.urlsafe_b64encode(json.dumps(data).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """トークンから向きと(created_at, id)を取り出す"""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, created_at, pk = json.loads(data.decode('utf-8'))
+        if direction not in ('next', 'previous'):
+            raise ValueError(direction)
+        if created_at is not None:
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError('invalid datetime')
+        return direction, created_at, uuid.UUID(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+class CursorPage:
+    """CursorPaginatorの1ページ
+
+    テンプレートからはDjangoのPageと同じように記事を順に取り出せる。
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return encode_cursor('next', self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return encode_cursor('previous', self.object_list[0])
+
+
+class CursorPaginator:
+    """記事を新しい順に(created_at, id)の位置で分ける
+
+    created_atがNULLの記事は、データベースの並び順に合わせて最初
+    (PostgreSQLなど)か最後(SQLite、MySQL)にまとめて並べる。NULLの
+    記事とそれ以外は別々に読み、どちらも(is_public, created_at, id)の
+    インデックスを位置から順に読むだけで済むようにする。
+
+    Args:
+        queryset (QuerySet): 記事のクエリセット。並び順は上書きする。
+        per_page (int): 1ページの記事の数。
+    """
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, token=None):
+        """トークンの位置のページを返す。トークンがなければ最初のページ"""
+        if not token:
+            articles = self._read(None, None, False, start=True)
+            return self._page(articles, False, False)
+
+        direction, created_at, pk = decode_cursor(token)
+        if direction == 'next':
+            articles = self._read(created_at, pk, False)
+            return self._page(articles, False, True)
+        articles = self._read(created_at, pk, True)
+        return self._page(articles, True, False)
+
+    def _segments(self):
+        """新しい順に並ぶ(created_atがNULLか, クエリセット)の組"""
+        dated = (False, self.queryset.filter(created_at__isnull=False))
+        undated = (True, self.queryset.filter(created_at__isnull=True))
+        if connection.features.nulls_order_largest:
+            return [undated, dated]
+        return [dated, undated]
+
+    def querysets(self, created_at, pk, reverse, start=False):
+        """位置より後(reverseなら前)の記事を近い順に並べたクエリセット
+
+        区間ごとに1つずつ、読む順に返す。
+        """
+        segments = self._segments()
+        if reverse:
+            segments.reverse()
+        for undated, queryset in segments:
+            if not start:
+                # 位置と同じ区間までは読まない
+                if undated != (created_at is None):
+                    continue
+                queryset = queryset.filter(
+                    _beyond(created_at, pk, reverse)
+                )
+                start = True
+            ordering = ['created_at', 'pk'] if reverse else [
+                '-created_at', '-pk'
+            ]
+            if undated:
+                ordering = ordering[1:]
+            yield queryset.order_by(*ordering)
+
+    def _read(self, created_at, pk, reverse, start=False):
+        """位置より後(reverseなら前)の記事を近い順にper_page + 1件読む
+
+        1件多く読み、続きのページがあるかを調べる。
+        """
+        limit = self.per_page + 1
+        articles = []
+        for queryset in self.querysets(created_at, pk, reverse, start):
+            articles.extend(queryset[:limit - len(articles)])
+            if len(articles) == limit:
+                break
+        return articles
+
+    def _page(self, articles, reverse, has_previous):
+        has_more = len(articles) > self.per_page
+        articles = articles[:self.per_page]
+        if reverse:
+            articles.reverse()
+            return CursorPage(articles, True, has_more)
+        return CursorPage(articles, has_more, has_previous)
+
+
+def _beyond(created_at, pk, reverse):
+    """同じ区間で(created_at, pk)より後(reverseなら前)になる条件
+
+    先頭の条件でインデックスの範囲を絞れるよう、created_atの比較を
+    ORの外に出す。
+    """
+    if created_at is None:
+        return Q(pk__gt=pk) if reverse else Q(pk__lt=pk)
+    if reverse:
+        return Q(created_at__gte=created_at) & (
+            Q(created_at__gt=created_at) | Q(pk__gt=pk)
+        )
+    return Q(created_at__lte=created_at) & (
+        Q(created_at__lt=created_at) | Q(pk__lt=pk)
+    )
+
+
+def page_window(page, size=2):
+    """ページ番号のリンクを現在のページの前後size個に絞る
+
+    最初と最後のページは常に含め、間を省略した所にはNoneを入れる。
+    """
+    last = page.paginator.num_pages
+    start = max(page.number - size, 1)
+    end = min(page.number + size, last)
+    numbers = []
+    if start > 1:
+        numbers.append(1)
+        if start > 2:
+            numbers.append(None)
+    numbers.extend(range(start, end + 1))
+    if end < last:
+        if end < last - 1:
+            numbers.append(None)
+        numbers.append(last)
+    return numbers
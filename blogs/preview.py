@@ -0,0 +1,191 @@
+"""記事編集画面のプレビュー
+
+変換結果はセッションごとに本文のハッシュでキャッシュする。
+クライアントはサーバーが受け取った本文のハッシュと差分だけを
+送ることができる。差分の元として、編集画面ごとに最後に受け取った
+本文だけを保持する。
+"""
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from blogs.isolation import RenderFailed
+
+
+# プレビューの本文と変換結果を保持するキャッシュ
+PREVIEW_CACHE_ALIAS = getattr(
+    settings, 'MARKDOWN_PREVIEW_CACHE_ALIAS', 'default'
+)
+PREVIEW_CACHE_TIMEOUT = getattr(
+    settings, 'MARKDOWN_PREVIEW_CACHE_TIMEOUT', 60 * 5
+)
+# 通し番号を更新する間のロック。プロセスが止まっても残らないよう期限をつける
+SEQ_LOCK_TIMEOUT = 5
+SEQ_LOCK_ATTEMPTS = 50
+SEQ_LOCK_INTERVAL = 0.01
+
+# 編集画面ごとにクライアントが付けるid
+_EDITOR_PATTERN = re.compile(r'[\w-]{1,64}\Z', re.ASCII)
+
+
+class PreviewError(Exception):
+    """プレビューのリクエストを処理できない"""
+    status = 400
+    code = 'invalid'
+
+
+class StaleRequest(PreviewError):
+    """同じ編集画面からより新しいリクエストを受け取っている"""
+    status = 409
+    code = 'stale'
+
+
+class UnknownBase(PreviewError):
+    """差分の元になる本文がキャッシュに残っていない"""
+    status = 412
+    code = 'unknown-base'
+
+
+def make_digest(text):
+    """本文のハッシュ"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def apply_splice(base, start, end, insert):
+    """baseのstartからendまでをinsertに置き換える
+
+    位置はブラウザの文字列と同じくUTF-16の単位で数える。
+
+    Args:
+        base (str): 元の本文。
+        start (int): 置き換える範囲の先頭。
+        end (int): 置き換える範囲の末尾。
+        insert (str): 置き換える文字列。
+
+    Returns:
+        str: 置き換え後の本文。
+    """
+    data = base.encode('utf-16-le', 'surrogatepass')
+    if not 0 <= start <= end <= len(data) // 2:
+        raise PreviewError('out of range')
+    data = b''.join([
+        data[:start * 2],
+        insert.encode('utf-16-le', 'surrogatepass'),
+        data[end * 2:],
+    ])
+    try:
+        return data.decode('utf-16-le')
+    except UnicodeDecodeError:
+        # サロゲートペアの途中で区切られている
+        raise PreviewError('broken surrogate pair')
+
+
+class PreviewSession:
+    """セッションの1つの編集画面のプレビュー
+
+    Args:
+        session_key (str): セッションのキー。
+        editor (str): 編集画面ごとにクライアントが付けるid。
+    """
+    def __init__(self, session_key, editor):
+        if not session_key or not _EDITOR_PATTERN.match(editor):
+            raise PreviewError('invalid editor')
+        self.cache = caches[PREVIEW_CACHE_ALIAS]
+        self.prefix = 'markdown-preview:%s:' % session_key
+        self.seq_key = '%sseq:%s' % (self.prefix, editor)
+        self.base_key = '%sbase:%s' % (self.prefix, editor)
+
+    def start(self, seq):
+        """リクエストの通し番号を受け付ける
+
+        同じ編集画面で後から送られた番号を受け付けていれば、
+        StaleRequestを送出する。番号の確認と更新の間に同じ編集画面の
+        他のリクエストが入らないよう、cache.addでロックを取る。
+        """
+        lock_key = self.seq_key + ':lock'
+        for _ in range(SEQ_LOCK_ATTEMPTS):
+            if self.cache.add(lock_key, seq, SEQ_LOCK_TIMEOUT):
+                break
+            time.sleep(SEQ_LOCK_INTERVAL)
+        else:
+            raise StaleRequest('seq %d: lock is held' % seq)
+        try:
+            latest = self.cache.get(self.seq_key)
+            if latest is not None and seq <= latest:
+                raise StaleRequest('seq %d <= %d' % (seq, latest))
+            self.cache.set(self.seq_key, seq, PREVIEW_CACHE_TIMEOUT)
+        finally:
+            self.cache.delete(lock_key)
+
+    def check_latest(self, seq):
+        """変換中に新しいリクエストを受け付けていればStaleRequest"""
+        latest = self.cache.get(self.seq_key)
+        if latest is not None and seq < latest:
+            raise StaleRequest('superseded by seq %d' % latest)
+
+    def get_text(self, digest):
+        """ハッシュから、この編集画面で最後に受け取った本文を返す"""
+        entry = self.cache.get(self.base_key)
+        if entry is None or entry[0] != digest:
+            raise UnknownBase(digest)
+        return entry[1]
+
+    def render(self, text, render):
+        """本文を変換し、ハッシュと変換結果を返す
+
+        変換結果はハッシュをキーに保持する。一時的に変換できなかった
+        場合は保持せず、次のリクエストで変換し直す。
+        """
+        digest = make_digest(text)
+        html_key = '%shtml:%s' % (self.prefix, digest)
+        html = self.cache.get(html_key)
+        if html is None:
+            try:
+                html = render(text)
+                cacheable = True
+            except RenderFailed as e:
+                html = e.html
+                cacheable = not e.transient
+            if cacheable:
+                self.cache.set(html_key, html, PREVIEW_CACHE_TIMEOUT)
+        # 次の差分の元として保持する
+        self.cache.set(self.base_key, (digest, text), PREVIEW_CACHE_TIMEOUT)
+        return digest, html
+
+
+def build_preview(session_key, data, render):
+    """プレビューのリクエストを処理する
+
+    dataには編集画面のid(editor)と通し番号(seq)に加え、
+    本文(content)か、以前に受け取った本文のハッシュ(base)と
+    差分(start, end, insert)のどちらかを含める。
+
+    Args:
+        session_key (str): セッションのキー。
+        data (QueryDict): リクエストのパラメータ。
+        render (function): 本文をhtmlに変換する関数。
+
+    Returns:
+        dict: 通し番号、本文のハッシュ、変換結果。
+    """
+    try:
+        seq = int(data['seq'])
+        preview = PreviewSession(session_key, data['editor'])
+        preview.start(seq)
+        if 'content' in data:
+            text = data['content']
+        else:
+            text = apply_splice(
+                preview.get_text(data['base']),
+                int(data['start']),
+                int(data['end']),
+                data.get('insert', ''),
+            )
+    except (KeyError, ValueError) as e:
+        raise PreviewError(str(e))
+    digest, html = preview.render(text, render)
+    preview.check_latest(seq)
+    return {'seq': seq, 'hash': digest, 'html': html}
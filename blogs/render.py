@@ -0,0 +1,509 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import markdown
+from django.conf import settings
+from django.core.cache import caches
+from markdown.extensions import Extension
+from markdown.extensions.toc import unique
+from markdown.postprocessors import Postprocessor
+from markdown.util import BLOCK_LEVEL_ELEMENTS
+from markdownx.settings import (
+    MARKDOWNX_MARKDOWN_EXTENSIONS,
+    MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
+)
+
+
+logger = logging.getLogger(__name__)
+
+# 変換方法を変えた場合は上げる。保存済みのHTMLは変換し直される
+RENDERER_VERSION = 3
+# プロセス内のキャッシュに保持するhtmlの合計バイト数の上限
+RENDER_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# 共有キャッシュに保持する秒数
+RENDER_CACHE_TIMEOUT = 60 * 60 * 24
+# これより短い記事はブロックに分けずに変換する
+BLOCK_RENDER_MIN_LENGTH = 4 * 1024
+
+# fenced_codeの開始行と同じ条件
+_FENCE_PATTERN = re.compile(
+    r'(`{3,}|~{3,})[ ]*(?:\{?\.?[\w#.+-]*)?[ ]*'
+    r'(?:hl_lines=("|\').*?\2)?[ ]*\}?[ ]*$'
+)
+# リスト、引用、定義リストの行。3つまでの空白でインデントできる
+_LIST_ITEM_PATTERN = re.compile(r' {0,3}(?:[*+-]|\d+\.)[ \t]')
+_QUOTE_PATTERN = re.compile(r' {0,3}>')
+_DEFINITION_PATTERN = re.compile(r'^ {0,3}:', re.MULTILINE)
+_HTML_BLOCK_PATTERN = re.compile(r'<(?:([a-zA-Z][a-zA-Z0-9]*)|[!?@%])')
+# 記事全体に影響する記法。参照リンクの定義、脚注、略語、[TOC]、
+# attr_listのid指定、idを持つ生のhtmlの見出し、空白だけの先頭の行
+_DOCUMENT_WIDE_PATTERN = re.compile(
+    r'^ {0,3}\*?\[[^\]\n]+\]:|\[\^|^\[TOC\]|\{:?[ \t]*#'
+    r'|<h[1-6][^>]*\sid=|\A[ \t]+(?:\n|\Z)',
+    re.MULTILINE
+)
+_HEADING_ID_PATTERN = re.compile(r'(<h[1-6]\b[^>]*?\sid=")([^"]*)(")')
+
+
+class ConverterPool:
+    """Markdownのインスタンスをスレッドごとに使い回すプール
+
+    拡張機能の設定ごとに、スレッドにつき1つのインスタンスを作る。
+    インスタンスはスレッド間で共有しないため、gthreadのワーカーでも
+    ロックなしで使える。変換の後は毎回reset()する。
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @staticmethod
+    def _make_key(extensions, extension_configs):
+        return (
+            tuple(extensions),
+            repr(sorted(extension_configs.items())),
+        )
+
+    def get(self, extensions, extension_configs=None):
+        """このスレッド用のMarkdownのインスタンスを返す
+
+        Args:
+            extensions (list): 拡張機能の名前かExtensionのクラス。
+                クラスはスレッドごとにインスタンス化する。
+            extension_configs (dict): 拡張機能の設定。
+
+        Returns:
+            markdown.Markdown: 設定済みのインスタンス。
+        """
+        if extension_configs is None:
+            extension_configs = {}
+        converters = getattr(self._local, 'converters', None)
+        if converters is None:
+            converters = self._local.converters = {}
+        key = self._make_key(extensions, extension_configs)
+        converter = converters.get(key)
+        if converter is None:
+            converter = markdown.Markdown(
+                extensions=[
+                    extension() if isinstance(extension, type) else extension
+                    for extension in extensions
+                ],
+                extension_configs=extension_configs
+            )
+            converters[key] = converter
+        return converter
+
+    def convert(self, text, extensions, extension_configs=None):
+        """マークダウンをhtmlに変換する"""
+        converter = self.get(extensions, extension_configs)
+        try:
+            return converter.convert(text)
+        finally:
+            self.reset(converter)
+
+    @staticmethod
+    def reset(converter):
+        """次の変換のために状態を初期化する"""
+        converter.reset()
+        # md_in_htmlが使う値はreset()では戻らない
+        converter.htmlStash.tag_counter = 0
+        converter.htmlStash.tag_data = []
+        blockprocessors = converter.parser.blockprocessors
+        if hasattr(blockprocessors, 'tag_counter'):
+            blockprocessors.tag_counter = -1
+
+
+converter_pool = ConverterPool()
+
+
+class RawOutputPostprocessor(Postprocessor):
+    """strip()する前の変換結果をmd.raw_outputに保持する"""
+    def run(self, text):
+        self.md.raw_output = text
+        return text
+
+
+class RawOutput(Extension):
+    """ブロックごとの変換結果をつなげるために、前後の空白を残す拡張機能"""
+    def extendMarkdown(self, md):
+        md.postprocessors.register(
+            RawOutputPostprocessor(md), 'raw_output', -1)
+
+
+BLOCK_EXTENSIONS = MARKDOWNX_MARKDOWN_EXTENSIONS + [RawOutput]
+
+
+def _render_document(text):
+    return converter_pool.convert(
+        text,
+        MARKDOWNX_MARKDOWN_EXTENSIONS,
+        MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
+    )
+
+
+def render_markdown(text):
+    """マークダウンをhtmlに変換する
+
+    長い記事はブロックごとに変換し、変わっていないブロックは
+    キャッシュを使う。
+
+    Args:
+        text (str): エスケープ済みのマークダウン。
+
+    Returns:
+        str: 変換後のhtml。
+    """
+    if len(text) >= BLOCK_RENDER_MIN_LENGTH and can_render_blocks(text):
+        return render_blocks(text)
+    return _render_document(text)
+
+
+def can_render_blocks(text):
+    """ブロックごとに変換しても記事全体の変換と同じ結果になるか
+
+    記事全体に影響する記法を含む場合と、tocの設定を変えている場合は
+    ブロックに分けられない。
+    """
+    configs = MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
+    if 'markdown.extensions.toc' in configs or 'toc' in configs:
+        return False
+    return _DOCUMENT_WIDE_PATTERN.search(text) is None
+
+
+def split_blocks(text):
+    """マークダウンをトップレベルのブロックに分ける
+
+    空行で分け、コードブロックの中の空行では分けない。
+    リスト、引用、インデントされた行、htmlのように空行をまたいで
+    続く可能性があるブロックは、間の空行も含めて前のブロックとつなげる。
+
+    Args:
+        text (str): マークダウン。
+
+    Returns:
+        list: ブロックの文字列のリスト。
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n').expandtabs(4)
+    lines = text.split('\n')
+    # htmlを探すための行。コードブロックの行は空にする
+    html_lines = list(lines)
+    # (開始行, 終了行, 含む行の種類)
+    ranges = []
+    start = None
+    fence = None
+    for i, line in enumerate(lines):
+        if fence is not None:
+            html_lines[i] = ''
+            if line.rstrip(' ') == fence:
+                fence = None
+            continue
+        if not line.strip(' '):
+            if start is not None:
+                _append_range(ranges, lines, html_lines, start, i)
+                start = None
+            continue
+        if start is None:
+            start = i
+        match = _FENCE_PATTERN.match(line)
+        if match:
+            fence = match.group(1)
+            html_lines[i] = ''
+    if start is not None:
+        _append_range(ranges, lines, html_lines, start, len(lines))
+    if ranges and 'html' in ranges[-1][2]:
+        # htmlのブロックは最後の空行まで含む
+        ranges[-1] = (ranges[-1][0], len(lines), ranges[-1][2])
+    return ['\n'.join(lines[start:end]) for start, end, _ in ranges]
+
+
+def _append_range(ranges, lines, html_lines, start, end):
+    """rangesにブロックを追加するか、前のブロックとつなげる"""
+    block = '\n'.join(lines[start:end])
+    kinds = _line_kinds(lines, html_lines, start, end)
+    if ranges:
+        previous_start, _, previous_kinds = ranges[-1]
+        if _continues(previous_kinds, block, kinds):
+            ranges.pop()
+            start = previous_start
+            if ':' in kinds and ranges and ':' in ranges[-1][2]:
+                # 定義リストの後のブロックは、次の定義の語になりうる
+                before_start, _, before_kinds = ranges.pop()
+                kinds |= before_kinds
+                start = before_start
+            kinds |= previous_kinds
+    ranges.append((start, end, kinds))
+
+
+def _line_kinds(lines, html_lines, start, end):
+    """ブロックが含む行の種類を返す
+
+    html: htmlのブロックになりうる行、>: 引用、:: 定義リスト、
+    list: リストの項目、text: 空白以外の文字がある行
+    """
+    kinds = set()
+    for i in range(start, end):
+        line = lines[i]
+        if _is_html_block(html_lines[i]):
+            kinds.add('html')
+        if _QUOTE_PATTERN.match(line):
+            kinds.add('>')
+        elif _DEFINITION_PATTERN.match(line):
+            kinds.add(':')
+        elif _LIST_ITEM_PATTERN.match(line):
+            kinds.add('list')
+        if line.strip():
+            kinds.add('text')
+    return kinds
+
+
+def _is_html_block(line):
+    """htmlのブロックとして扱われる可能性がある行か
+
+    html_blockと同じく、ブロックレベルのタグとコメントなどを対象とする。
+    """
+    match = _HTML_BLOCK_PATTERN.match(line)
+    if match is None:
+        return False
+    tag = match.group(1)
+    return tag is None or tag.lower() in BLOCK_LEVEL_ELEMENTS
+
+
+def _continues(previous_kinds, block, kinds):
+    """blockが空行をはさんで前のブロックの続きになる可能性があるか"""
+    if 'html' in previous_kinds:
+        # htmlのブロックはどこまで続くか分からないため、最後までつなげる
+        return True
+    if 'text' not in kinds or 'text' not in previous_kinds:
+        # 空白だけのブロックは何も出力せず、前後のブロックをつなげる
+        return True
+    first = block[0]
+    if first in ' :':
+        # インデントされた行、定義リスト
+        return True
+    if _DEFINITION_PATTERN.search(block):
+        # 定義リストは前の要素によって変わる
+        return True
+    if block.lstrip()[:1] == '>':
+        # 空白だけの行に続く引用も前の引用につながる
+        return '>' in previous_kinds
+    if _LIST_ITEM_PATTERN.match(block):
+        return 'list' in previous_kinds
+    return False
+
+
+def render_blocks(text):
+    """ブロックごとに変換してつなげる
+
+    ブロックのhtmlはキャッシュし、内容が変わったブロックだけ変換する。
+    見出しのidはブロックごとに付けられるため、記事全体で重複しない
+    ように付け直す。
+
+    Args:
+        text (str): can_render_blocksがTrueになるマークダウン。
+
+    Returns:
+        str: 変換後のhtml。
+    """
+    blocks = split_blocks(text)
+    htmls = render_cache.get_many_or_render(
+        blocks, _render_block, namespace='block')
+
+    used_ids = set()
+
+    def replace_id(match):
+        return match.group(1) + unique(match.group(2), used_ids) + \
+            match.group(3)
+
+    results = []
+    for html in htmls:
+        if '<h' in html:
+            html = _HEADING_ID_PATTERN.sub(replace_id, html)
+        if html:
+            results.append(html)
+    return '\n'.join(results).strip()
+
+
+def _render_block(text):
+    """ブロックを変換し、strip()する前の結果を返す"""
+    converter = converter_pool.get(
+        BLOCK_EXTENSIONS, MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS)
+    # 空白だけの場合はpostprocessorが呼ばれない
+    converter.raw_output = ''
+    try:
+        converter.convert(text)
+        return converter.raw_output
+    finally:
+        converter_pool.reset(converter)
+
+
+class RenderCache:
+    """変換後のhtmlのキャッシュ
+
+    プロセス内のLRUを、設定されたDjangoのキャッシュの前に置く2段構成。
+    キーは本文と拡張機能の設定のハッシュ。共有キャッシュの障害は
+    キャッシュにない場合と同じに扱う。
+    """
+    def __init__(self, max_bytes=None, alias=None, timeout=None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'MARKDOWN_RENDER_CACHE_MAX_BYTES',
+                                RENDER_CACHE_MAX_BYTES)
+        if alias is None:
+            alias = getattr(settings, 'MARKDOWN_RENDER_CACHE_ALIAS',
+                            'default')
+        if timeout is None:
+            timeout = getattr(settings, 'MARKDOWN_RENDER_CACHE_TIMEOUT',
+                              RENDER_CACHE_TIMEOUT)
+        self._max_bytes = max_bytes
+        self._alias = alias
+        self._timeout = timeout
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def size(self):
+        return self._size
+
+    def reset_stats(self):
+        """カウンタを0に戻す"""
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """カウンタの値を返す"""
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._size,
+        }
+
+    def detach(self):
+        """共有キャッシュを使わず、プロセス内のキャッシュだけを使う"""
+        self._alias = None
+
+    def clear(self):
+        """プロセス内のキャッシュを空にする。共有キャッシュは消さない"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @staticmethod
+    def make_key(text, namespace=''):
+        """本文と拡張機能の設定からキーを作る"""
+        config = repr((
+            RENDERER_VERSION,
+            namespace,
+            MARKDOWNX_MARKDOWN_EXTENSIONS,
+            sorted(MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS.items()),
+        ))
+        digest = hashlib.sha256(config.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return 'markdown:' + digest.hexdigest()
+
+    def get_or_render(self, text, render, namespace=''):
+        """キャッシュにあればそのhtmlを、なければ変換して返す
+
+        Args:
+            text (str): マークダウン。
+            render (callable): textを受け取りhtmlを返す関数。
+            namespace (str): 変換方法ごとにキーを分ける文字列。
+
+        Returns:
+            str: 変換後のhtml。
+        """
+        key = self.make_key(text, namespace)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return entry[0]
+
+        html = self._shared_get_many([key]).get(key)
+        if html is not None:
+            self.shared_hits += 1
+        else:
+            self.misses += 1
+            html = render(text)
+            self._shared_set_many({key: html})
+        self._store(key, html)
+        return html
+
+    def get_many_or_render(self, texts, render, namespace=''):
+        """get_or_renderを複数のtextに対してまとめて行う
+
+        共有キャッシュへの問い合わせは1回にまとめる。
+
+        Returns:
+            list: textsと同じ順のhtml。
+        """
+        keys = [self.make_key(text, namespace) for text in texts]
+        results = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.local_hits += 1
+                    results[key] = entry[0]
+
+        missing = {
+            key: text for key, text in zip(keys, texts) if key not in results
+        }
+        if missing:
+            found = self._shared_get_many(list(missing))
+            self.shared_hits += len(found)
+            rendered = {}
+            for key, text in missing.items():
+                html = found.get(key)
+                if html is None:
+                    self.misses += 1
+                    html = rendered[key] = render(text)
+                results[key] = html
+                self._store(key, html)
+            if rendered:
+                self._shared_set_many(rendered)
+        return [results[key] for key in keys]
+
+    def _shared_get_many(self, keys):
+        if self._alias is None:
+            return {}
+        try:
+            return caches[self._alias].get_many(keys)
+        except Exception:
+            logger.warning('markdown render cache get failed', exc_info=True)
+            return {}
+
+    def _shared_set_many(self, mapping):
+        if self._alias is None:
+            return
+        try:
+            caches[self._alias].set_many(mapping, self._timeout)
+        except Exception:
+            logger.warning('markdown render cache set failed', exc_info=True)
+
+    def _store(self, key, html):
+        """プロセス内のキャッシュに追加し、上限を超えた分を古い順に捨てる"""
+        size = len(html.encode('utf-8'))
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (html, size)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+
+
+render_cache = RenderCache()
@@ -0,0 +1,127 @@
+"""画像の大きさと形式を変えた版(レンディション)
+
+ImageJobで画像を処理する時に、アップロードされた元の画像から
+IMAGE_RENDITION_WIDTHSの幅ごとに、IMAGE_RENDITION_FORMATSのうち
+Pillowが保存できる形式の画像を作る。作った画像の情報はモデルの
+<フィールド名>_renditionsにJSONで保存し、テンプレートではpictureタグの
+srcsetにする。
+"""
+import io
+import json
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+
+DEFAULT_WIDTHS = (150, 300, 500)
+# 先にあるものほどブラウザが優先して使う
+DEFAULT_FORMATS = ('avif', 'webp')
+
+PIL_FORMATS = {
+    'avif': 'AVIF',
+    'webp': 'WEBP',
+}
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+
+
+def renditions_field(field_name):
+    return '%s_renditions' % field_name
+
+
+def available_formats():
+    """設定された形式のうち、Pillowが保存できるもの"""
+    Image.init()
+    formats = getattr(settings, 'IMAGE_RENDITION_FORMATS', DEFAULT_FORMATS)
+    return [f for f in formats if PIL_FORMATS.get(f) in Image.SAVE]
+
+
+def _widths(source_width):
+    """元の画像より大きくしない幅。最小の幅は必ず含める"""
+    widths = sorted(getattr(settings, 'IMAGE_RENDITION_WIDTHS',
+                            DEFAULT_WIDTHS))
+    return [widths[0]] + [w for w in widths[1:] if w <= source_width]
+
+
+def _convert(image):
+    """WebPとAVIFで保存できるモードにする"""
+    has_alpha = (
+        image.mode in ('RGBA', 'LA', 'PA') or
+        'transparency' in image.info
+    )
+    mode = 'RGBA' if has_alpha else 'RGB'
+    return image if image.mode == mode else image.convert(mode)
+
+
+def make_renditions(source, size, field_file):
+    """sourceからレンディションを作ってストレージに保存する
+
+    Args:
+        source: 元の画像のファイル。
+        size (tuple): 表示する画像の(幅, 高さ)。縦横の比に使う。
+        field_file (FieldFile): 保存先のストレージと名前に使う画像。
+    Returns:
+        list: 作った画像の形式、幅、高さ、名前。
+    """
+    image = _convert(Image.open(source))
+    stem = os.path.splitext(os.path.basename(field_file.name))[0]
+    directory = os.path.join(field_file.field.upload_to, 'renditions')
+    renditions = []
+    for width in _widths(image.width):
+        height = max(1, round(width * size[1] / size[0]))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt in available_formats():
+            output = io.BytesIO()
+            resized.save(output, format=PIL_FORMATS[fmt])
+            name = field_file.storage.save(
+                '%s/%s-%d.%s' % (directory, stem, width, fmt),
+                ContentFile(output.getvalue())
+            )
+            renditions.append({
+                'format': fmt, 'width': width, 'height': height,
+                'name': name,
+            })
+    return renditions
+
+
+def dumps(renditions):
+    return json.dumps(renditions) if renditions else ''
+
+
+def loads(value):
+    """保存したレンディションの一覧。壊れていれば空にする"""
+    if not value:
+        return []
+    try:
+        renditions = json.loads(value)
+    except ValueError:
+        return []
+    return renditions if isinstance(renditions, list) else []
+
+
+def delete_renditions(storage, value):
+    """保存したレンディションの画像を削除する"""
+    for rendition in loads(value):
+        storage.delete(rendition['name'])
+
+
+def sources(field_file, value):
+    """pictureタグのsourceの形式とsrcsetの一覧。形式の優先順に並べる"""
+    by_format = {}
+    for rendition in loads(value):
+        by_format.setdefault(rendition['format'], []).append(rendition)
+    formats = getattr(settings, 'IMAGE_RENDITION_FORMATS', DEFAULT_FORMATS)
+    result = []
+    for fmt in formats:
+        if fmt not in by_format:
+            continue
+        srcset = ', '.join(
+            '%s %dw' % (field_file.storage.url(r['name']), r['width'])
+            for r in sorted(by_format[fmt], key=lambda r: r['width'])
+        )
+        result.append({'type': MIME_TYPES[fmt], 'srcset': srcset})
+    return result
@@ -0,0 +1,210 @@
+"""記事の変更に合わせて、カテゴリーの公開記事数の更新とページの
+キャッシュの削除をする
+
+QuerySet.updateのようにシグナルを送らない変更には追従しないため、
+その場合はreconcile_category_countsコマンドで数え直す。
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from blogs import page_cache
+from blogs.models import Article, Category, ImageJob
+from users.models import Profile
+
+
+def _add_count(category_ids, delta):
+    """カテゴリーの公開記事数にdeltaを足す"""
+    if not category_ids or not delta:
+        return
+    count = F('public_article_count') + delta
+    if delta < 0:
+        count = Greatest(count, 0)
+    Category.objects.filter(pk__in=category_ids).update(
+        public_article_count=count
+    )
+
+
+def _is_public_changed(update_fields):
+    return update_fields is None or 'is_public' in update_fields
+
+
+@receiver(pre_save, sender=Article)
+def remember_is_public(sender, instance, raw, update_fields, **kwargs):
+    """保存前の公開状態を覚えておく"""
+    if raw or not _is_public_changed(update_fields):
+        return
+    instance._was_public = Article.objects.filter(
+        pk=instance.pk
+    ).values_list('is_public', flat=True).first() or False
+
+
+def _purge(*groups):
+    """ページのキャッシュを外す
+
+    コミット前に他のリクエストが古い内容を保存した場合に備え、
+    コミット後にももう一度外す。
+    """
+    page_cache.purge(*groups)
+    transaction.on_commit(lambda: page_cache.purge(*groups))
+
+
+def _article_groups(article):
+    """記事の詳細と投稿者のプロフィールのグループ"""
+    names = Profile.objects.filter(
+        user_id=article.author_id
+    ).values_list('user_name', flat=True)
+    return ['article:%s' % article.pk] + [
+        'profile:%s' % name for name in names
+    ]
+
+
+def _listing_groups(article):
+    """記事が載る一覧のグループ"""
+    names = article.categories.values_list('name', flat=True)
+    return ['index'] + ['category:%s' % name for name in names]
+
+
+# count_on_saveが_was_publicを消す前に呼ばれるよう、先に登録する
+@receiver(post_save, sender=Article)
+def purge_on_save(sender, instance, raw, **kwargs):
+    """保存した記事が載るページのキャッシュを外す"""
+    if raw:
+        return
+    groups = _article_groups(instance)
+    was_public = instance.__dict__.get('_was_public', instance.is_public)
+    if instance.is_public != was_public:
+        # カテゴリーの記事数が変わるため、すべての一覧を外す
+        groups.append('listing')
+    elif instance.is_public:
+        groups.extend(_listing_groups(instance))
+    _purge(*groups)
+
+
+@receiver(post_save, sender=Article)
+def count_on_save(sender, instance, raw, update_fields, **kwargs):
+    """公開状態が変わった記事のカテゴリーの数を更新する"""
+    if raw or not _is_public_changed(update_fields):
+        return
+    was_public = instance.__dict__.pop('_was_public', False)
+    if instance.is_public == was_public:
+        return
+    category_ids = list(instance.categories.values_list('pk', flat=True))
+    _add_count(category_ids, 1 if instance.is_public else -1)
+
+
+@receiver(pre_delete, sender=Article)
+def count_on_delete(sender, instance, **kwargs):
+    """削除する公開記事のカテゴリーの数を減らす"""
+    if instance.is_public:
+        category_ids = list(instance.categories.values_list('pk', flat=True))
+        _add_count(category_ids, -1)
+
+
+@receiver(pre_delete, sender=Article)
+def purge_on_delete(sender, instance, **kwargs):
+    """削除する記事が載るページのキャッシュを外す"""
+    groups = _article_groups(instance)
+    if instance.is_public:
+        groups.append('listing')
+    _purge(*groups)
+
+
+def _linked_pks(instance, reverse, pk_set):
+    """instanceとつながっている相手のpkのうちpk_setに含まれるもの"""
+    if reverse:
+        queryset = instance.article_set.all()
+    else:
+        queryset = instance.categories.all()
+    if pk_set is not None:
+        queryset = queryset.filter(pk__in=pk_set)
+    return set(queryset.values_list('pk', flat=True))
+
+
+def _count_link(instance, reverse, pk_set, delta):
+    """つながりが増減した公開記事の数だけカテゴリーの数を更新する"""
+    if not pk_set:
+        return
+    if reverse:
+        # instanceはカテゴリー、pk_setは記事
+        count = Article.objects.filter(pk__in=pk_set, is_public=True).count()
+        _add_count([instance.pk], delta * count)
+    elif instance.is_public:
+        _add_count(pk_set, delta)
+
+
+@receiver(m2m_changed, sender=Article.categories.through)
+def count_on_categories_changed(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """記事とカテゴリーのつながりの増減に合わせて数を更新する
+
+    追加の場合pk_setは新たに追加されたものだけになるが、削除の場合は
+    つながっていないものも含むため、削除前につながっているものを
+    覚えておく。
+    """
+    if action in ('pre_remove', 'pre_clear'):
+        instance._unlinked_pks = _linked_pks(instance, reverse, pk_set)
+    elif action == 'post_add':
+        _count_link(instance, reverse, pk_set, 1)
+    elif action in ('post_remove', 'post_clear'):
+        unlinked_pks = instance.__dict__.pop('_unlinked_pks', None)
+        _count_link(instance, reverse, unlinked_pks, -1)
+
+
+@receiver(m2m_changed, sender=Article.categories.through)
+def purge_on_categories_changed(sender, instance, action, reverse,
+                                **kwargs):
+    """公開記事のカテゴリーが変わったら一覧のキャッシュを外す"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse or instance.is_public:
+        _purge('listing')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def purge_on_category_changed(sender, instance, **kwargs):
+    """カテゴリーの一覧が変わったら一覧のキャッシュを外す"""
+    if not kwargs.get('raw'):
+        _purge('listing')
+
+
+@receiver(pre_save, sender=Profile)
+def remember_user_name(sender, instance, raw, **kwargs):
+    """変更前のユーザー名を覚えておく"""
+    if raw:
+        return
+    instance._old_user_name = Profile.objects.filter(
+        pk=instance.pk
+    ).values_list('user_name', flat=True).first()
+
+
+@receiver(post_save, sender=Profile)
+def purge_on_profile_saved(sender, instance, raw, **kwargs):
+    """プロフィールと、投稿者として表示する記事の詳細のキャッシュを外す"""
+    if raw:
+        return
+    names = {instance.user_name, instance.__dict__.pop('_old_user_name', None)}
+    article_pks = Article.objects.filter(
+        author_id=instance.user_id
+    ).values_list('pk', flat=True)
+    _purge(
+        *['profile:%s' % name for name in names if name is not None],
+        *['article:%s' % pk for pk in article_pks]
+    )
+
+
+@receiver(post_delete, sender=Profile)
+def purge_on_profile_deleted(sender, instance, **kwargs):
+    _purge('profile:%s' % instance.user_name)
+
+
+@receiver(post_delete, sender=ImageJob)
+def delete_image_job_source(sender, instance, **kwargs):
+    """処理を終えたか取り消したジョブの元の画像を削除する"""
+    if instance.source:
+        instance.storage.delete(instance.source)
@@ -2,6 +2,8 @@ import re
 
 from django import forms, template
 
+from blogs.pagination import page_window
+
 
 register = template.Library()
 
@@ -21,3 +23,9 @@ def get_url_replace(request, field, value):
     url_dict = request.GET.copy()
     url_dict[field] = str(value)
     return url_dict.urlencode()
+
+
+@register.simple_tag
+def get_page_window(page):
+    """現在のページの前後だけのページ番号。省略した所はNone"""
+    return page_window(page)
@@ -0,0 +1,22 @@
+from django import template
+
+from blogs.renditions import sources
+
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/picture.html')
+def picture(image, renditions, sizes, css_class='', alt=''):
+    """レンディションがあればWebPなどをsourceに並べたpictureタグ
+
+    ブラウザが使えない形式や、レンディションのない古い画像の時は
+    imgの元の画像を表示する。
+    """
+    return {
+        'image': image,
+        'sources': sources(image, renditions),
+        'sizes': sizes,
+        'css_class': css_class,
+        'alt': alt,
+    }
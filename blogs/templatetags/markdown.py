@@ -1,22 +1,35 @@
+from functools import partial
 
 from django import template
 from django.utils.safestring import mark_safe
-import markdown
 from markdownx.settings import (
     MARKDOWNX_MARKDOWN_EXTENSIONS,
     MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
 )
-from markdownx.utils import markdownify
 from markdown.extensions import Extension
 
+from blogs.isolation import RenderFailed, isolated_renderer
+from blogs.render import converter_pool, render_cache, render_markdown
+
 
 register = template.Library()
 
 
 @register.filter
-def markdown_to_html(text):
-    """マークダウンをhtmlに変換する"""
-    return mark_safe(markdownify(text))
+def markdown_to_html(text, article_id=None):
+    """マークダウンをhtmlに変換する
+
+    変換は別プロセスでCPU時間の上限をつけて行う。article_idは上限を
+    超えた場合にログに記録する。変換できなかった場合はエスケープした
+    本文を返す。上限を超えた場合は変換し直さないよう、その結果も
+    キャッシュする。
+    """
+    render = partial(
+        _render_isolated, render_markdown, article_id=article_id)
+    try:
+        return mark_safe(render_cache.get_or_render(text, render))
+    except RenderFailed as e:
+        return mark_safe(e.html)
 
 
 class EscapeHtml(Extension):
@@ -25,17 +38,42 @@ class EscapeHtml(Extension):
         md.inlinePatterns.deregister('html')
 
 
+ESCAPE_EXTENSIONS = MARKDOWNX_MARKDOWN_EXTENSIONS + [EscapeHtml]
+
+
 @register.filter
-def markdown_to_html_with_escape(text):
+def markdown_to_html_with_escape(text, article_id=None):
     """マークダウンをhtmlに変換する
 
     生のhtmlやJavaScriptなどをエスケープした上で、htmlに変換する
 
     """
-    extentions = MARKDOWNX_MARKDOWN_EXTENSIONS + [EscapeHtml]
-    html = markdown.markdown(
+    render = partial(
+        _render_isolated, _render_with_escape, article_id=article_id)
+    try:
+        html = render_cache.get_or_render(
+            text, render, namespace='escape-html')
+    except RenderFailed as e:
+        html = e.html
+    return mark_safe(html)
+
+
+def _render_isolated(render, text, article_id=None):
+    """別プロセスで変換する。上限を超えた場合はエスケープした本文を返す
+
+    一時的な失敗の場合はRenderFailedを送出し、キャッシュさせない。
+    """
+    try:
+        return isolated_renderer.render(render, text, article_id=article_id)
+    except RenderFailed as e:
+        if e.transient:
+            raise
+        return e.html
+
+
+def _render_with_escape(text):
+    return converter_pool.convert(
         text,
-        extentions=extentions,
-        extension_configs=MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
+        ESCAPE_EXTENSIONS,
+        MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS
     )
-    return mark_safe(html)
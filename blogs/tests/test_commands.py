@@ -0,0 +1,217 @@
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from blogs.escape import escape_markdown
+from blogs.models import Article, Category
+
+
+class ResanitizeArticlesTest(TestCase):
+    """記事をエスケープし直すコマンドのテスト"""
+    def setUp(self):
+        self.raw_text = '<b>bold</b><u>under</u>&<script>x</script>'
+        # <u>を許容していた時にエスケープした記事
+        self.old_text = escape_markdown(self.raw_text, ['b', 'u'])
+        self.new_text = escape_markdown(self.raw_text, ['b'])
+        for i in range(5):
+            Article.objects.create(title='title%d' % i, text=self.old_text)
+        Article.objects.create(title='unchanged', text=self.new_text)
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint = os.path.join(tmp_dir.name, 'checkpoint')
+
+    def _call(self, *args):
+        out = io.StringIO()
+        with mock.patch('blogs.management.commands.resanitize_articles.'
+                        'ACCEPT_TAGS', ['b']):
+            call_command('resanitize_articles', '--workers', '1',
+                         '--checkpoint', self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def test_resanitize(self):
+        """全ての記事がエスケープし直されることの確認"""
+        output = self._call('--batch-size', '2', '--chunk-size', '1')
+
+        for article in Article.objects.all():
+            self.assertEqual(article.text, self.new_text)
+        self.assertIn('checked 6 articles, updated 5', output)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_idempotent(self):
+        """エスケープし直した記事は変わらないことの確認"""
+        self._call()
+        output = self._call()
+        self.assertIn('updated 0', output)
+
+    def test_mark_html_stale(self):
+        """更新した記事の保存済みhtmlが古いものとして扱われることの確認"""
+        Article.objects.update(html_version=1)
+
+        self._call()
+
+        self.assertEqual(
+            Article.objects.filter(html_version=0).count(), 5)
+        article = Article.objects.get(title='unchanged')
+        self.assertEqual(article.html_version, 1)
+
+    def test_purge_page_cache(self):
+        """更新した記事の詳細ページのキャッシュを外すことの確認"""
+        with mock.patch('blogs.page_cache.purge') as purge:
+            self._call('--chunk-size', '2')
+
+        purged = [group for call in purge.call_args_list for group in call[0]]
+        self.assertEqual(purge.call_count, 3)
+        self.assertCountEqual(purged, [
+            'article:%s' % article.pk
+            for article in Article.objects.exclude(title='unchanged')
+        ])
+
+    def test_dry_run(self):
+        """dry-runでは更新せずに差分を表示することの確認"""
+        output = self._call('--dry-run')
+
+        self.assertEqual(
+            Article.objects.filter(text=self.old_text).count(), 5)
+        self.assertIn('-' + self.old_text, output)
+        self.assertIn('+' + self.new_text, output)
+        self.assertIn('would update 5', output)
+
+    def test_resume(self):
+        """checkpointの続きから再開することの確認"""
+        articles = list(Article.objects.order_by('pk'))
+        with open(self.checkpoint, 'w') as f:
+            f.write(str(articles[2].pk))
+
+        self._call('--resume')
+
+        for article in Article.objects.filter(pk__lte=articles[2].pk):
+            if article.title != 'unchanged':
+                self.assertEqual(article.text, self.old_text)
+        for article in Article.objects.filter(pk__gt=articles[2].pk):
+            self.assertEqual(article.text, self.new_text)
+
+    def test_process_pool(self):
+        """プロセスプールを使った場合の確認"""
+        out = io.StringIO()
+        with mock.patch('blogs.management.commands.resanitize_articles.'
+                        'ACCEPT_TAGS', ['b']):
+            call_command('resanitize_articles', '--workers', '2',
+                         '--checkpoint', self.checkpoint, stdout=out)
+        for article in Article.objects.all():
+            self.assertEqual(article.text, self.new_text)
+
+
+class RenderArticlesTest(TestCase):
+    """保存済みのhtmlを変換し直すコマンドのテスト"""
+    def setUp(self):
+        from blogs.render import RENDERER_VERSION
+
+        # saveを通さず、変換していない記事を作る
+        Article.objects.bulk_create([
+            Article(title='title%d' % i, text='**%d**' % i) for i in range(5)
+        ] + [
+            Article(title='rendered', text='text', html='<p>stored</p>',
+                    html_version=RENDERER_VERSION),
+        ])
+
+    def _call(self, *args):
+        out = io.StringIO()
+        call_command('render_articles', *args, stdout=out)
+        return out.getvalue()
+
+    def test_render(self):
+        """変換方法が古い記事だけ変換されることの確認"""
+        from blogs.render import RENDERER_VERSION
+
+        output = self._call('--batch-size', '2', '--chunk-size', '1')
+
+        self.assertIn('rendered 5 articles', output)
+        for article in Article.objects.exclude(title='rendered'):
+            self.assertIn('<strong>', article.html)
+            self.assertEqual(article.html_version, RENDERER_VERSION)
+        article = Article.objects.get(title='rendered')
+        self.assertEqual(article.html, '<p>stored</p>')
+
+    def test_purge_page_cache(self):
+        """変換し直した記事の詳細ページのキャッシュを外すことの確認"""
+        with mock.patch('blogs.page_cache.purge') as purge:
+            self._call('--chunk-size', '2')
+
+        purged = [group for call in purge.call_args_list for group in call[0]]
+        self.assertEqual(purge.call_count, 3)
+        self.assertCountEqual(purged, [
+            'article:%s' % article.pk
+            for article in Article.objects.exclude(title='rendered')
+        ])
+
+    def test_render_all(self):
+        """--allで全ての記事が変換されることの確認"""
+        output = self._call('--all')
+
+        self.assertIn('rendered 6 articles', output)
+        article = Article.objects.get(title='rendered')
+        self.assertEqual(article.html, '<p>text</p>')
+
+    def test_render_failed(self):
+        """変換できなかった記事は保存済みのhtmlを残すことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import RENDERER_VERSION
+
+        failed = RenderFailed('<pre>text</pre>')
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed):
+            output = self._call('--all')
+
+        self.assertIn('rendered 0 articles', output)
+        self.assertIn('failed to render 6 articles', output)
+        article = Article.objects.get(title='rendered')
+        self.assertEqual(article.html, '<p>stored</p>')
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+    def test_render_budget_exceeded(self):
+        """上限を超えた記事はエスケープした本文を保存することの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import RENDERER_VERSION
+
+        failed = RenderFailed('<pre>text</pre>', transient=False)
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed):
+            output = self._call()
+
+        self.assertIn('failed to render 5 articles', output)
+        for article in Article.objects.exclude(title='rendered'):
+            self.assertEqual(article.html, '<pre>text</pre>')
+            self.assertTrue(article.html_failed)
+            self.assertEqual(article.html_version, RENDERER_VERSION)
+        # 保存した記事は次から変換し直さない
+        self.assertIn('rendered 0 articles', self._call())
+
+
+class ReconcileCategoryCountsTest(TestCase):
+    """カテゴリーの公開記事数を数え直すコマンドのテスト"""
+    def test_reconcile(self):
+        """シグナルを送らない更新でずれた数が直ることの確認"""
+        python = Category.objects.create(name='python')
+        django = Category.objects.create(name='django')
+        for i in range(3):
+            article = Article.objects.create(title='title%d' % i, text='text')
+            article.categories.add(python)
+        Article.objects.filter(title='title0').update(is_public=False)
+
+        out = io.StringIO()
+        call_command('reconcile_category_counts', stdout=out)
+
+        self.assertIn('fixed 1 categories', out.getvalue())
+        python.refresh_from_db()
+        django.refresh_from_db()
+        self.assertEqual(python.public_article_count, 2)
+        self.assertEqual(django.public_article_count, 0)
@@ -90,6 +90,68 @@ class SentenceTest(TestCase):
         self.assertEqual(str(sentence), result_str)
 
 
+class SentenceSpanTest(TestCase):
+    """語句を元の文字列の位置で持つ機能のテスト"""
+    def test_add_span(self):
+        """元の文字列の一部を語句として追加できることの確認"""
+        from blogs.escape import Sentence
+
+        sentence = Sentence('abc```def')
+        sentence.add_span(0, 3, False)
+        sentence.add_span(3, 6, True)
+
+        self.assertEqual(len(sentence.phrases), 2)
+        self.assertEqual(sentence.get_text(1), ('```', True))
+        self.assertEqual(list(sentence.texts()),
+                         [('abc', False), ('```', True)])
+
+    def test_phrase_view(self):
+        """語句をPhraseとして取り出せることの確認"""
+        from blogs.escape import Phrase, Sentence
+
+        sentence = Sentence()
+        sentence.set_phrase('phrase1')
+        sentence.set_phrase('phrase2')
+
+        self.assertTrue(isinstance(sentence.phrases[0], Phrase))
+        self.assertEqual(sentence.phrases[-1].text, 'phrase2')
+        self.assertEqual([p.text for p in sentence.phrases],
+                         ['phrase1', 'phrase2'])
+        with self.assertRaises(IndexError):
+            sentence.phrases[2]
+
+    def test_set_phrase_after_read(self):
+        """読み出した後に追加した語句も正しく参照できることの確認"""
+        from blogs.escape import Sentence
+
+        sentence = Sentence('abc')
+        sentence.add_span(0, 3, False)
+        sentence.set_phrase('def')
+        self.assertEqual(sentence.get_text(1), ('def', False))
+        for i in range(1000):
+            sentence.set_phrase(str(i))
+        sentence.set_phrase('ghi')
+
+        self.assertEqual(sentence.get_text(0), ('abc', False))
+        self.assertEqual(sentence.get_text(2), ('0', False))
+        self.assertEqual(sentence.get_text(1001), ('999', False))
+        self.assertEqual(sentence.get_text(1002), ('ghi', False))
+        self.assertEqual(len(list(sentence.texts())), 1003)
+
+    def test_not_shared_phrase(self):
+        """create_sentenceの```が元の文字列の位置を指すことの確認"""
+        from blogs.escape import create_sentence
+
+        sentence = create_sentence('a```b```c')
+        self.assertEqual(sentence._spans.tolist(), [
+            0, 1, 0,
+            1, 4, 1,
+            4, 5, 1,
+            5, 8, 1,
+            8, 9, 0,
+        ])
+
+
 class CreateSentenceTest(TestCase):
     """textからphraseで区切ったsentenceを作る関数のテスト"""
     def setUp(self):
@@ -663,3 +725,430 @@ class EscapeMarkdownTest(TestCase):
         accept_texts = ['br']
         result_text = escape_markdown(test_text, *accept_texts)
         self.assertEquals(result_text, confirm_text)
+
+
+class EscapeFilterTest(TestCase):
+    """エスケープとアンエスケープを1回の走査で行うメソッドのテスト"""
+    def setUp(self):
+        self.test_texts = [
+            '',
+            'エスケープする文字がない場合のテストです。',
+            '<br><b>bold</b> & "quot" \'single\' <script>x</script>',
+            '<<br>> &lt;br&gt; <br <b/> </ul>',
+            '```\n<br>\n```\n<br>\n```\n<li>\n```<li>',
+            '```` <br> `` <li> ```` ``` <b>',
+            '閉じられていない```<br>\n<li>',
+            '``````<br>',
+            '<ol start="42">list</ol>',
+        ]
+
+    def _legacy_escape(self, text, *accept_texts):
+        from blogs.escape import HtmlAccepter, escape_html_filter
+
+        acceptation = HtmlAccepter()
+        acceptation.accepts(*accept_texts)
+        return acceptation.unescape_html_filter(escape_html_filter(text))
+
+    def test_same_as_filters(self):
+        """escape_html_filterとunescape_html_filterを
+        順に適用した場合と同じ結果になることの確認
+        """
+        from blogs.escape import HtmlAccepter
+
+        accept_texts = ['br', 'b', 'li', 'ul', 'ol', 'ol start="42"']
+        acceptation = HtmlAccepter()
+        acceptation.accepts(accept_texts)
+        for test_text in self.test_texts:
+            result = acceptation.escape_filter(test_text)
+            confirm_text = self._legacy_escape(test_text, accept_texts)
+            self.assertEqual(result, confirm_text)
+
+    def test_no_accept_text(self):
+        """許容タグがない場合はescape_html_filterと同じ結果になることの確認"""
+        from blogs.escape import HtmlAccepter, escape_html_filter
+
+        acceptation = HtmlAccepter()
+        for test_text in self.test_texts:
+            result = acceptation.escape_filter(test_text)
+            self.assertEqual(result, escape_html_filter(test_text))
+
+    def test_special_tag_name(self):
+        """タグ名に特殊文字を含む場合も同じ結果になることの確認"""
+        from blogs.escape import HtmlAccepter
+
+        test_text = '<a&b> <a&amp;b> <x<y> <br>'
+        for accept_texts in (['a&amp;b', 'br'], ['x<y'], ['a&b']):
+            acceptation = HtmlAccepter()
+            acceptation.accepts(accept_texts)
+            result = acceptation.escape_filter(test_text)
+            confirm_text = self._legacy_escape(test_text, accept_texts)
+            self.assertEqual(result, confirm_text)
+
+
+class GetAccepterTest(TestCase):
+    """コンパイル済みHtmlAccepterを返す関数のテスト"""
+    def test_same_instance(self):
+        """タグの順番や重複が違っても同じインスタンスを返すことの確認"""
+        from blogs.escape import get_accepter
+
+        accepter = get_accepter(['br', 'li', 'ul'])
+        self.assertIs(get_accepter('ul', 'br', 'li', 'br'), accepter)
+        self.assertIsNot(get_accepter('br'), accepter)
+
+    def test_no_accept_text(self):
+        """タグを渡さない場合は空のリストと同じインスタンスを返すことの確認"""
+        from blogs.escape import get_accepter
+
+        accepter = get_accepter()
+        self.assertIs(get_accepter([]), accepter)
+        self.assertEqual(accepter.group, {})
+
+    def test_compiled(self):
+        """正規表現を作成済みであることの確認"""
+        from blogs.escape import get_accepter
+
+        accepter = get_accepter('br')
+        self.assertTrue(accepter._is_compiled)
+        self.assertEqual(accepter.escape_filter('<br><li>'), '<br>&lt;li&gt;')
+
+    def test_not_string(self):
+        """str型でない引数を渡した場合"""
+        from blogs.escape import get_accepter
+
+        with self.assertRaises(ValueError) as error:
+            get_accepter(100)
+        error_message = 'input string type'
+        self.assertEquals(error.exception.args[0], error_message)
+
+    def test_eviction(self):
+        """キャッシュの上限を超えた場合に古いものから破棄されることの確認"""
+        from blogs.escape import ACCEPTER_CACHE_SIZE, get_accepter
+
+        first = get_accepter('eviction0')
+        for i in range(1, ACCEPTER_CACHE_SIZE + 1):
+            get_accepter('eviction%d' % i)
+        self.assertIsNot(get_accepter('eviction0'), first)
+
+
+class HtmlAccepterCompileTest(TestCase):
+    """escape_filterで使う正規表現を作成するメソッドのテスト"""
+    def test_recompile_after_accepts(self):
+        """タグを追加した場合は正規表現を作り直すことの確認"""
+        from blogs.escape import HtmlAccepter
+
+        acceptation = HtmlAccepter()
+        acceptation.accepts('br')
+        self.assertEqual(acceptation.escape_filter('<br><li>'),
+                         '<br>&lt;li&gt;')
+
+        acceptation.accepts('li')
+        self.assertFalse(acceptation._is_compiled)
+        self.assertEqual(acceptation.escape_filter('<br><li>'), '<br><li>')
+
+
+class AhoCorasickTest(TestCase):
+    """複数の文字列を1回の走査で置換するクラスのテスト"""
+    def test_no_change(self):
+        """変換対象がない場合"""
+        from blogs.escape import AhoCorasick
+
+        d = {'&lt;': '<', '&gt;': '>'}
+        text = 'これはテストです、<と>は変換されません。'
+        self.assertEqual(AhoCorasick(d).translate(text), text)
+
+    def test_with_change_data(self):
+        """変換対象がある場合"""
+        from blogs.escape import AhoCorasick
+
+        d = {'&lt;br&gt;': '<br>', '&lt;/br&gt;': '</br>'}
+        text = 'これは&lt;br&gt;&lt;/br&gt;&lt;li&gt;のテストです。'
+        result_text = 'これは<br></br>&lt;li&gt;のテストです。'
+        self.assertEqual(AhoCorasick(d).translate(text), result_text)
+
+    def test_leftmost(self):
+        """重なる場合は左から始まるものを優先することの確認"""
+        from blogs.escape import AhoCorasick
+
+        d = {'bcd': 'X', 'abc': 'Y', 'cdef': 'Z'}
+        self.assertEqual(AhoCorasick(d).translate('abcdef'), 'Ydef')
+
+    def test_longest(self):
+        """同じ位置から始まる場合は長いものを優先することの確認"""
+        from blogs.escape import AhoCorasick
+
+        d = {'ab': 'X', 'abcd': 'Y', 'bc': 'Z'}
+        self.assertEqual(AhoCorasick(d).translate('abcabcd'), 'XcY')
+
+    def test_empty_key(self):
+        """空文字列のkeyを渡した場合"""
+        from blogs.escape import AhoCorasick
+
+        with self.assertRaises(ValueError) as error:
+            AhoCorasick({'': 'x'})
+        self.assertEqual(error.exception.args[0], 'key must not be empty')
+
+
+class TranslaterStrategyTest(TestCase):
+    """置換の方法を選ぶ機能のテスト"""
+    def setUp(self):
+        self.test_text = 'これは&lt;br&gt;と&lt;li&gt;と&lt;b&gt;のテストです。'
+        self.confirm_text = 'これは<br>と<li>と&lt;b&gt;のテストです。'
+
+    def test_strategies(self):
+        """どの方法でも同じ結果になることの確認"""
+        from blogs.escape import Translater
+
+        for strategy in ('auto', 'replace', 'automaton'):
+            translater = Translater(strategy)
+            translater.setgroup('&lt;br&gt;', '<br>')
+            translater.setgroup('&lt;li&gt;', '<li>')
+            result = translater.translate(self.test_text)
+            self.assertEqual(result, self.confirm_text)
+
+    def test_str_strategy(self):
+        """'str'の場合はstr_transと同じ結果になることの確認"""
+        from blogs.escape import Translater, str_trans
+
+        d = {'<': '&lt;', '>': '&gt;'}
+        translater = Translater('str')
+        for k, v in d.items():
+            translater.setgroup(k, v)
+        text = 'これはテストです、<<<<は全て変換されます。'
+        self.assertEqual(translater.translate(text), str_trans(text, d))
+
+    def test_str_strategy_error(self):
+        """'str'で2文字以上のkeyがある場合"""
+        from blogs.escape import Translater
+
+        translater = Translater('str')
+        translater.setgroup('&lt;', '<')
+        with self.assertRaises(ValueError) as error:
+            translater.translate(self.test_text)
+        self.assertEqual(error.exception.args[0], 'key mast be one size')
+
+    def test_unknown_strategy(self):
+        """存在しない方法を渡した場合"""
+        from blogs.escape import Translater
+
+        with self.assertRaises(ValueError):
+            Translater('regex')
+
+    def test_auto_select(self):
+        """'auto'が置換群の大きさで方法を選ぶことの確認"""
+        from blogs.escape import AUTOMATON_THRESHOLD, Translater
+
+        translater = Translater()
+        translater.setgroup('<', '&lt;')
+        self.assertEqual(translater._select_strategy(), 'str')
+
+        translater = Translater()
+        translater.setgroup('&lt;br&gt;', '<br>')
+        self.assertEqual(translater._select_strategy(), 'replace')
+
+        for i in range(AUTOMATON_THRESHOLD):
+            translater.setgroup('&lt;tag%d&gt;' % i, '<tag%d>' % i)
+        self.assertEqual(translater._select_strategy(), 'automaton')
+
+    def test_auto_overlap(self):
+        """重なり得るkeyは置換群の大きさによらず最左最長で置換されることの確認"""
+        from blogs.escape import AUTOMATON_THRESHOLD, Translater
+
+        text = 'abc abcd bcd b'
+        for size in (2, AUTOMATON_THRESHOLD, AUTOMATON_THRESHOLD + 1):
+            translater = Translater()
+            translater.setgroup('bc', 'X')
+            translater.setgroup('abcd', 'Y')
+            translater.setgroup('b', 'Z')
+            for i in range(size - 3):
+                translater.setgroup('&lt;tag%d&gt;' % i, '<tag%d>' % i)
+            self.assertEqual(translater._select_strategy(), 'automaton')
+            self.assertEqual(translater.translate(text), 'aX Y Xd Z')
+
+    def test_auto_value_contains_key(self):
+        """置換後の文字列がkeyを含む場合も置換し直さないことの確認"""
+        from blogs.escape import Translater
+
+        translater = Translater()
+        translater.setgroup('&lt;', '<')
+        translater.setgroup('<', '&lt;')
+        self.assertEqual(translater._select_strategy(), 'automaton')
+        self.assertEqual(translater.translate('&lt;<'), '<&lt;')
+
+        translater = Translater()
+        translater.setgroup('xx', 'yy')
+        translater.setgroup('yy', 'xx')
+        self.assertEqual(translater._select_strategy(), 'automaton')
+        self.assertEqual(translater.translate('xxyy'), 'yyxx')
+
+    def test_setgroup_after_translate(self):
+        """置換後にsetgroupした場合も新しいkeyで置換されることの確認"""
+        from blogs.escape import Translater
+
+        translater = Translater('automaton')
+        translater.setgroup('&lt;br&gt;', '<br>')
+        translater.translate(self.test_text)
+        translater.setgroup('&lt;li&gt;', '<li>')
+        result = translater.translate(self.test_text)
+        self.assertEqual(result, self.confirm_text)
+
+
+class EscapeMarkdownIterTest(TestCase):
+    """分割された文字列を順にエスケープする関数のテスト"""
+    def setUp(self):
+        self.test_text = '''
+        Here is Sentence1.<br><script>alert('xss')</script>
+        ```
+            Here is Sentence2.
+            In the quot block.<br>
+        ```
+        Here is Sentence3.<blockquote>quote</blockquote> a < b && c > d
+        ``` unclosed <br> & <li>
+        '''
+        self.accept_texts = ['br', 'blockquote', 'li']
+
+    def test_one_chunk(self):
+        """文字列を1つ渡した場合はescape_markdownと同じ結果になることの確認"""
+        from blogs.escape import escape_markdown, escape_markdown_iter
+
+        result = ''.join(
+            escape_markdown_iter(self.test_text, self.accept_texts))
+        confirm_text = escape_markdown(self.test_text, self.accept_texts)
+        self.assertEqual(result, confirm_text)
+
+    def test_split_chunks(self):
+        """```やタグの途中で分割してもescape_markdownと
+        同じ結果になることの確認
+        """
+        from blogs.escape import escape_markdown, escape_markdown_iter
+
+        confirm_text = escape_markdown(self.test_text, self.accept_texts)
+        for size in range(1, 12):
+            chunks = (
+                self.test_text[i:i + size]
+                for i in range(0, len(self.test_text), size)
+            )
+            result = ''.join(escape_markdown_iter(chunks, self.accept_texts))
+            self.assertEqual(result, confirm_text)
+
+    def test_file_object(self):
+        """ファイルオブジェクトを渡した場合の確認"""
+        import io
+        from unittest import mock
+        from blogs.escape import escape_markdown, escape_markdown_iter
+
+        with mock.patch('blogs.escape.STREAM_CHUNK_SIZE', 5):
+            result = ''.join(escape_markdown_iter(
+                io.StringIO(self.test_text), *self.accept_texts))
+        confirm_text = escape_markdown(self.test_text, *self.accept_texts)
+        self.assertEqual(result, confirm_text)
+
+    def test_yield_before_end(self):
+        """全て読み込む前にエスケープ済みの文字列を返すことの確認"""
+        from blogs.escape import escape_markdown_iter
+
+        def chunks():
+            yield '<br>'
+            yield '<li>'
+            raise AssertionError('not lazy')
+
+        result = escape_markdown_iter(chunks(), 'br')
+        self.assertEqual(next(result), '<br>')
+
+
+class UnescapeMarkdownTest(TestCase):
+    """escape_markdownでエスケープした文字列を元に戻す関数のテスト"""
+    def test_restore(self):
+        """元の文字列に戻ることの確認"""
+        from blogs.escape import escape_markdown, unescape_markdown
+
+        test_text = '''<br>&amp; "quot" <li>
+        ```
+        &lt;br&gt; <br>
+        ```
+        <script>&lt;</script> ``` <b>
+        '''
+        escaped_text = escape_markdown(test_text, 'br', 'b')
+        self.assertEqual(unescape_markdown(escaped_text), test_text)
+
+    def test_resanitize(self):
+        """許容タグを変えてエスケープし直せることの確認"""
+        from blogs.escape import escape_markdown, resanitize_markdown
+
+        test_text = '<br><li>&lt;'
+        escaped_text = escape_markdown(test_text, 'br')
+        result = resanitize_markdown(escaped_text, 'li')
+        self.assertEqual(result, escape_markdown(test_text, 'li'))
+
+
+class AttributeTagTest(TestCase):
+    """属性を許可するタグのテスト"""
+    def setUp(self):
+        self.accept_texts = ['ol[start]', 'a[href][title]', 'li']
+
+    def test_accepts(self):
+        """属性のないタグも登録されることの確認"""
+        from blogs.escape import HtmlAccepter
+        acceptation = HtmlAccepter()
+
+        result = acceptation.accepts('ol[start]')
+        confirm_result = {
+            '&lt;ol&gt;': '<ol>',
+            '&lt;/ol&gt;': '</ol>',
+        }
+        self.assertEquals(result, confirm_result)
+
+    def test_allowed_attribute(self):
+        """許可した属性を持つタグがエスケープされないことの確認"""
+        from blogs.escape import escape_markdown
+
+        test_text = ('<ol start="42"><li>one</li></ol>'
+                     '<a href="https://example.com" title="t">link</a>')
+        result = escape_markdown(test_text, self.accept_texts)
+        self.assertEqual(result, test_text)
+
+    def test_not_allowed_attribute(self):
+        """許可していない属性や値を持つタグがエスケープされることの確認"""
+        from blogs.escape import escape_markdown
+
+        test_texts = [
+            '<ol onclick="alert(1)">',
+            '<ol start="1" onclick="alert(1)">',
+            '<ol start="a"b">',
+            '<ol start=\'1\'>',
+            '<ol start="&lt;">',
+            '<ol start="1" start="2">',
+            '<li start="1">',
+        ]
+        for test_text in test_texts:
+            result = escape_markdown(test_text, self.accept_texts)
+            self.assertTrue(result.startswith('&lt;'), result)
+
+    def test_same_as_filters(self):
+        """escape_html_filterとunescape_html_filterを
+        順に適用した場合と同じ結果になることの確認
+        """
+        from blogs.escape import HtmlAccepter, escape_html_filter
+
+        test_text = '''<ol start="42">
+        ```
+        <ol start="1">
+        ```
+        <a href="x" title="y"></a><a title="y" href="x"><a href="x" x="y">
+        '''
+        acceptation = HtmlAccepter()
+        acceptation.accepts(self.accept_texts)
+        result = acceptation.escape_filter(test_text)
+        confirm_text = acceptation.unescape_html_filter(
+            escape_html_filter(test_text))
+        self.assertEqual(result, confirm_text)
+
+    def test_value_length(self):
+        """属性の値が長すぎる場合はエスケープされることの確認"""
+        from blogs.escape import MAX_ATTRIBUTE_VALUE_LENGTH, escape_markdown
+
+        value = '1' * MAX_ATTRIBUTE_VALUE_LENGTH
+        test_text = '<ol start="%s">' % value
+        self.assertEqual(escape_markdown(test_text, 'ol[start]'), test_text)
+        test_text = '<ol start="%s1">' % value
+        result = escape_markdown(test_text, 'ol[start]')
+        self.assertTrue(result.startswith('&lt;'))
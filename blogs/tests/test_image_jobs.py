@@ -0,0 +1,204 @@
+import datetime
+import io
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from blogs.models import Article, ImageJob
+from users.models import Profile
+
+
+User = get_user_model()
+
+
+def _upload(name='thumbnail.png', size=(480, 480)):
+    data = io.BytesIO()
+    Image.new('RGB', size=size, color=(255, 0, 0)).save(data, format='PNG')
+    return SimpleUploadedFile(name, data.getvalue(), 'image/png')
+
+
+class ImageJobTest(TestCase):
+    """アップロードされた画像をジョブで処理するテスト"""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.user = User.objects.create_user(
+            email='test@test.com', password='password')
+        Profile.objects.create(user=self.user, user_name='testname')
+        self.article = Article.objects.create(
+            title='title', text='text', author=self.user)
+        self.client.login(email='test@test.com', password='password')
+        self.url = reverse('blogs:article_edit', args=(self.article.pk, ))
+
+    def _post(self, **data):
+        data.setdefault('title', 'title')
+        data.setdefault('text', 'text')
+        data.setdefault('is_public', 'on')
+        return self.client.post(self.url, data=data)
+
+    def test_deferred(self):
+        """リクエスト中は画像を保存せず、代わりの画像を表示することの確認"""
+        self._post(thumbnail=_upload())
+
+        article = Article.objects.get(pk=self.article.pk)
+        self.assertEqual(article.thumbnail.name, '')
+        self.assertTrue(article.thumbnail_pending)
+        self.assertEqual(ImageJob.objects.count(), 1)
+        self.client.logout()
+        response = self.client.get(reverse('blogs:index'))
+        self.assertContains(response, 'blogs/img/image_processing.svg')
+
+    def test_source(self):
+        """元の画像はデータベースではなくストレージに置くことの確認"""
+        from blogs.image_jobs import process_jobs
+
+        upload = _upload()
+        self._post(thumbnail=upload)
+
+        job = ImageJob.objects.get()
+        self.assertTrue(job.source.startswith('image_jobs/'))
+        upload.seek(0)
+        with job.storage.open(job.source) as source:
+            self.assertEqual(source.read(), upload.read())
+
+        process_jobs()
+        self.assertFalse(job.storage.exists(job.source))
+
+    def test_process(self):
+        """ジョブで縮小した画像に差し替えることの確認"""
+        from blogs.image_jobs import process_jobs
+
+        self._post(thumbnail=_upload('first.png'))
+        self.assertEqual(process_jobs(), 1)
+        first = Article.objects.get(pk=self.article.pk).thumbnail
+        self._post(thumbnail=_upload('second.png'))
+        self.assertEqual(process_jobs(), 1)
+
+        article = Article.objects.get(pk=self.article.pk)
+        self.assertEqual(article.thumbnail.name, 'thumbnail/second.png')
+        self.assertFalse(article.thumbnail_pending)
+        self.assertEqual(Image.open(article.thumbnail).size, (150, 150))
+        # 変更前の画像は削除する
+        self.assertFalse(first.storage.exists(first.name))
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_stale_form(self):
+        """表示した時の古い画像の列で処理結果を上書きしないことの確認"""
+        from blogs.forms import ArticleForm
+        from blogs.image_jobs import process_jobs, save_form
+
+        self._post(thumbnail=_upload())
+        # ジョブの処理中に編集画面を表示した
+        stale = Article.objects.get(pk=self.article.pk)
+        process_jobs()
+
+        form = ArticleForm(instance=stale, data={
+            'title': 'changed', 'text': 'text', 'is_public': 'on',
+        })
+        self.assertTrue(form.is_valid())
+        save_form(form, 'thumbnail')
+
+        article = Article.objects.get(pk=self.article.pk)
+        self.assertEqual(article.title, 'changed')
+        self.assertEqual(article.thumbnail.name, 'thumbnail/thumbnail.png')
+        self.assertFalse(article.thumbnail_pending)
+        self.assertNotEqual(article.thumbnail_renditions, '')
+
+    def test_replace_pending(self):
+        """処理前に画像を変えた場合は新しい画像だけを処理することの確認"""
+        from blogs.image_jobs import process_jobs
+
+        self._post(thumbnail=_upload('first.png'))
+        first = ImageJob.objects.get()
+        self._post(thumbnail=_upload('second.png'))
+
+        # 置き換えたジョブの元の画像は削除する
+        self.assertFalse(first.storage.exists(first.source))
+        self.assertEqual(process_jobs(), 1)
+        article = Article.objects.get(pk=self.article.pk)
+        self.assertEqual(article.thumbnail.name, 'thumbnail/second.png')
+
+    def test_claim(self):
+        """処理中のジョブは止まったものだけを取り出し直すことの確認"""
+        from blogs.image_jobs import claim_next
+
+        self._post(thumbnail=_upload())
+
+        job = claim_next()
+        self.assertEqual(job.status, ImageJob.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_next())
+
+        ImageJob.objects.filter(pk=job.pk).update(
+            started_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(claim_next().attempts, 2)
+
+    @override_settings(IMAGE_JOB_MAX_ATTEMPTS=2)
+    def test_failed(self):
+        """読めない画像は回数を超えたら失敗にすることの確認"""
+        from blogs.image_jobs import process_jobs
+
+        self._post(thumbnail=_upload())
+        job = ImageJob.objects.get()
+        job.storage.delete(job.source)
+        job.storage.save(job.source, io.BytesIO(b'broken'))
+
+        with self.assertLogs('blogs.image_jobs', 'ERROR'):
+            self.assertEqual(process_jobs(), 2)
+
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertIn('Traceback', job.error)
+        self.assertFalse(
+            Article.objects.get(pk=self.article.pk).thumbnail_pending)
+
+    def test_delete_failed(self):
+        """残す期間を過ぎた失敗したジョブを元の画像と一緒に削除することの確認"""
+        from django.core.management import call_command
+
+        from blogs.image_jobs import delete_failed_jobs
+
+        self._post(thumbnail=_upload())
+        job = ImageJob.objects.get()
+        job.status = ImageJob.FAILED
+        job.save()
+        self.assertEqual(delete_failed_jobs(), 0)
+
+        ImageJob.objects.filter(pk=job.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=8))
+        out = io.StringIO()
+        call_command('process_image_jobs', '--once', stdout=out)
+
+        self.assertIn('deleted 1 failed jobs', out.getvalue())
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertFalse(job.storage.exists(job.source))
+
+    def test_profile_image(self):
+        """プロフィール画像もジョブで処理することの確認"""
+        from django.core.management import call_command
+
+        url = reverse('users:profile_image_edit',
+                      kwargs={'name': 'testname'})
+        self.client.post(url, data={'image': _upload('profile.png')})
+        self.assertTrue(Profile.objects.get(user=self.user).image_pending)
+
+        out = io.StringIO()
+        call_command('process_image_jobs', '--once', stdout=out)
+
+        self.assertIn('processed 1 images', out.getvalue())
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.image.name, 'profile/profile.png')
+        self.assertFalse(profile.image_pending)
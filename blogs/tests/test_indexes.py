@@ -0,0 +1,128 @@
+import datetime
+import json
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from blogs.models import Article, Category
+from blogs.pagination import CursorPaginator
+
+
+User = get_user_model()
+
+
+def _sqlite_problems(rows):
+    """EXPLAIN QUERY PLANの全件走査と一時的なソート"""
+    details = [row[-1] for row in rows]
+    return [
+        detail for detail in details
+        if detail.startswith('SCAN') or 'TEMP B-TREE' in detail
+    ]
+
+
+def _mysql_problems(plan):
+    """EXPLAIN FORMAT=JSONの全件走査とファイルソート"""
+    problems = []
+    if isinstance(plan, dict):
+        if plan.get('access_type') in ('ALL', 'index'):
+            problems.append('%s: %s' % (plan.get('table_name'),
+                                        plan['access_type']))
+        if plan.get('using_filesort'):
+            problems.append('using_filesort')
+        if plan.get('using_temporary_table'):
+            problems.append('using_temporary_table')
+        children = plan.values()
+    elif isinstance(plan, list):
+        children = plan
+    else:
+        return problems
+    for child in children:
+        problems.extend(_mysql_problems(child))
+    return problems
+
+
+def plan_problems(queryset):
+    """クエリセットの実行計画から全件走査とソートを探す"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN FORMAT=JSON ' + sql, params)
+            return _mysql_problems(json.loads(cursor.fetchone()[0]))
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return _sqlite_problems(cursor.fetchall())
+
+
+@skipUnless(connection.vendor in ('sqlite', 'mysql'),
+            'EXPLAINの結果の形式がSQLiteとMySQLのものとは異なる')
+class QueryPlanTest(TestCase):
+    """記事一覧のクエリがインデックスを使うことの確認"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email='test%d@test.com' % i,
+                                     password='testpass')
+            for i in range(3)
+        ]
+        cls.categories = [
+            Category.objects.create(name='category%d' % i) for i in range(5)
+        ]
+        now = timezone.now()
+        for i in range(60):
+            article = Article.objects.create(
+                title='title%d' % i,
+                text='text',
+                author=cls.users[i % 3],
+                is_public=bool(i % 4)
+            )
+            article.categories.add(cls.categories[i % 5])
+            Article.objects.filter(pk=article.pk).update(
+                created_at=now - datetime.timedelta(hours=i)
+            )
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'ANALYZE TABLE blogs_article, blogs_article_categories'
+                )
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(plan_problems(queryset), [], str(queryset.query))
+
+    def test_public_articles(self):
+        """公開記事の一覧"""
+        self.assertIndexed(
+            Article.objects.filter(is_public=True).order_by('-created_at')
+        )
+
+    def test_category(self):
+        """カテゴリーで絞り込んだ公開記事の一覧"""
+        self.assertIndexed(
+            Article.objects.filter(
+                is_public=True, categories=self.categories[0]
+            ).order_by('-created_at')
+        )
+
+    def test_author(self):
+        """プロフィールの記事一覧"""
+        self.assertIndexed(
+            Article.objects.filter(author=self.users[0]).order_by(
+                '-created_at'
+            )
+        )
+
+    def test_cursor(self):
+        """カーソルによるページ分割の各ページ"""
+        paginator = CursorPaginator(Article.objects.filter(is_public=True), 12)
+        article = Article.objects.filter(is_public=True)[20]
+        positions = [
+            (None, None, False, True),
+            (article.created_at, article.pk, False, False),
+            (article.created_at, article.pk, True, False),
+            (None, article.pk, False, False),
+        ]
+        for position in positions:
+            for queryset in paginator.querysets(*position):
+                with self.subTest(position=position):
+                    self.assertIndexed(queryset[:13])
@@ -0,0 +1,149 @@
+import time
+
+from django.test import TestCase
+
+
+def _spin(text):
+    """CPU時間を使い続ける変換"""
+    while True:
+        pass
+
+
+def _sleep(text):
+    """CPU時間を使わずに止まる変換"""
+    time.sleep(60)
+
+
+def _fail(text):
+    raise RecursionError('maximum recursion depth exceeded')
+
+
+def _shared_cache_alias(text):
+    """変換用のプロセスでのブロックのキャッシュの共有キャッシュ"""
+    from blogs.render import render_cache
+
+    return repr(render_cache._alias)
+
+
+class IsolatedRendererTest(TestCase):
+    """別プロセスでの変換のテスト"""
+    def setUp(self):
+        from blogs.isolation import IsolatedRenderer
+
+        self.renderer = IsolatedRenderer(budget=0.2)
+        self.addCleanup(self.renderer.stop)
+
+    def test_render(self):
+        """別プロセスで変換した結果を返すことの確認"""
+        from blogs.render import render_markdown
+
+        html = self.renderer.render(render_markdown, '# head')
+
+        self.assertEqual(html, '<h1 id="head">head</h1>')
+        self.assertEqual(self.renderer.renders, 1)
+
+    def test_budget_exceeded(self):
+        """CPU時間の上限を超えた場合にエスケープした本文を送出することの確認"""
+        from blogs.isolation import RenderFailed
+        from blogs.render import render_markdown
+
+        with self.assertLogs('blogs.isolation', 'WARNING') as logs:
+            with self.assertRaises(RenderFailed) as cm:
+                self.renderer.render(_spin, '<b>x</b>', article_id=42)
+
+        self.assertEqual(cm.exception.html, '<pre>&lt;b&gt;x&lt;/b&gt;</pre>')
+        # 何度変換しても同じなので一時的な失敗ではない
+        self.assertFalse(cm.exception.transient)
+        self.assertIn('(article 42)', logs.output[0])
+        self.assertEqual(self.renderer.budget_exceeded, 1)
+        # シグナルで止められた場合はプロセスを使い回す
+        self.assertEqual(self.renderer.restarts, 0)
+        html = self.renderer.render(render_markdown, 'a')
+        self.assertEqual(html, '<p>a</p>')
+
+    def test_wall_timeout(self):
+        """CPU時間を使わずに止まった場合はプロセスを止めることの確認"""
+        from blogs.isolation import RenderFailed
+        from blogs.render import render_markdown
+
+        with self.assertLogs('blogs.isolation', 'WARNING'):
+            with self.assertRaises(RenderFailed) as cm:
+                self.renderer.render(_sleep, 'text')
+
+        self.assertEqual(cm.exception.html, '<pre>text</pre>')
+        self.assertFalse(cm.exception.transient)
+        self.assertEqual(self.renderer.budget_exceeded, 1)
+        self.assertEqual(self.renderer.restarts, 1)
+        html = self.renderer.render(render_markdown, 'a')
+        self.assertEqual(html, '<p>a</p>')
+
+    def test_error(self):
+        """変換に失敗した場合にエスケープした本文を送出することの確認"""
+        from blogs.isolation import RenderFailed
+
+        with self.assertLogs('blogs.isolation', 'WARNING') as logs:
+            with self.assertRaises(RenderFailed) as cm:
+                self.renderer.render(_fail, 'text', article_id=1)
+
+        self.assertEqual(cm.exception.html, '<pre>text</pre>')
+        self.assertTrue(cm.exception.transient)
+        self.assertIn('RecursionError', logs.output[0])
+        self.assertEqual(self.renderer.errors, 1)
+
+    def test_no_budget(self):
+        """上限がなければ同じプロセスで変換することの確認"""
+        from blogs.isolation import IsolatedRenderer
+
+        renderer = IsolatedRenderer(budget=0)
+        calls = []
+
+        html = renderer.render(lambda text: calls.append(text) or 'html', 'a')
+
+        self.assertEqual(html, 'html')
+        self.assertEqual(calls, ['a'])
+
+    def test_worker_killed(self):
+        """変換中にプロセスが終了した場合も送出し、次は起動し直すことの確認"""
+        import os
+        import signal
+        import threading
+
+        from blogs.isolation import RenderFailed
+        from blogs.render import render_markdown
+
+        self.renderer.render(render_markdown, 'a')
+        process = self.renderer._local.worker[0]
+        timer = threading.Timer(0.1, os.kill, (process.pid, signal.SIGKILL))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        with self.assertLogs('blogs.isolation', 'WARNING'):
+            with self.assertRaises(RenderFailed) as cm:
+                self.renderer.render(_sleep, 'a')
+        self.assertTrue(cm.exception.transient)
+        self.assertEqual(self.renderer.errors, 1)
+        self.assertEqual(self.renderer.restarts, 1)
+        html = self.renderer.render(render_markdown, 'a')
+        self.assertEqual(html, '<p>a</p>')
+
+    def test_start_method(self):
+        """変換用のプロセスをforkで起動しないことの確認"""
+        from blogs.render import render_markdown
+
+        self.renderer.render(render_markdown, 'a')
+
+        process = self.renderer._local.worker[0]
+        self.assertEqual(process._start_method, 'forkserver')
+
+    def test_local_block_cache(self):
+        """変換用のプロセスではブロックのキャッシュを共有しないことの確認"""
+        self.assertEqual(self.renderer.render(_shared_cache_alias, ''), 'None')
+
+    def test_override_settings(self):
+        """設定を上書きしたテストの中でもプロセスを起動できることの確認"""
+        from blogs.render import render_markdown
+
+        with self.settings(PAGE_CACHE_TIMEOUT=0):
+            html = self.renderer.render(render_markdown, 'a')
+
+        self.assertEqual(html, '<p>a</p>')
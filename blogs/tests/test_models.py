@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.urls import reverse
 
-from blogs.models import Article
+from blogs.models import Article, Category
 
 
 class ArticleTest(TestCase):
@@ -32,3 +32,270 @@ class ArticleTest(TestCase):
                 kwargs={'pk': article.pk}
             )
             self.assertEqual(article.get_absolute_url(), confirm_url)
+
+
+class ArticleHtmlTest(TestCase):
+    """記事の変換済みhtmlのテスト"""
+    def test_render_html(self):
+        """本文がhtmlに変換されることの確認"""
+        from blogs.render import RENDERER_VERSION
+
+        article = Article(title='Test', text='# head')
+        article.render_html()
+
+        self.assertIn('<h1', article.html)
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+    def test_render_html_highlight(self):
+        """コードブロックがハイライトされることの確認"""
+        article = Article(
+            title='Test', text='```python\nimport os\n```\n\n```\nplain\n```'
+        )
+        article.render_html()
+
+        self.assertEqual(article.html.count('<div class="highlight">'), 2)
+        self.assertIn('<span class="kn">import</span>', article.html)
+        # 言語の指定がなければ推測しない
+        self.assertRegex(article.html, r'<pre>(<[^>]*>)*plain')
+
+    def test_get_html_rerender(self):
+        """変換方法が古い場合に変換し直して保存することの確認"""
+        from blogs.render import RENDERER_VERSION
+
+        article = Article.objects.create(title='Test', text='**bold**')
+        Article.objects.filter(pk=article.pk).update(html_version=0)
+        article = Article.objects.get(pk=article.pk)
+
+        html = article.get_html()
+
+        self.assertIn('<strong>bold</strong>', html)
+        article.refresh_from_db()
+        self.assertEqual(article.html, html)
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+    def test_get_html_stored(self):
+        """変換方法が新しい場合は保存済みのhtmlを返すことの確認"""
+        from blogs.render import RENDERER_VERSION
+
+        article = Article.objects.create(title='Test', text='text')
+        Article.objects.filter(pk=article.pk).update(
+            html='<p>stored</p>', html_version=RENDERER_VERSION)
+        article = Article.objects.get(pk=article.pk)
+
+        self.assertEqual(article.get_html(), '<p>stored</p>')
+
+    def test_save_renders(self):
+        """本文を変えて保存するとhtmlも変換し直すことの確認"""
+        from blogs.render import RENDERER_VERSION
+
+        article = Article.objects.create(title='Test', text='**old**')
+        self.assertIn('<strong>old</strong>', article.html)
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+        # 管理画面などで本文だけを変えた場合
+        article = Article.objects.get(pk=article.pk)
+        article.text = '**new**'
+        article.save()
+
+        article = Article.objects.get(pk=article.pk)
+        self.assertIn('<strong>new</strong>', article.html)
+        self.assertEqual(article.get_html(), article.html)
+
+    def test_save_update_fields(self):
+        """update_fieldsに本文を含む場合はhtmlも保存することの確認"""
+        article = Article.objects.create(title='Test', text='**old**')
+        article.text = '**new**'
+        article.save(update_fields=['text'])
+
+        article = Article.objects.get(pk=article.pk)
+        self.assertIn('<strong>new</strong>', article.html)
+
+    def test_save_unchanged(self):
+        """本文が変わっていなければ変換しないことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import isolated_renderer
+
+        article = Article.objects.create(title='Test', text='text')
+        article = Article.objects.get(pk=article.pk)
+        with mock.patch.object(isolated_renderer, 'render') as render:
+            article.title = 'changed'
+            article.save()
+            Article.objects.for_list().get(pk=article.pk).save()
+
+        render.assert_not_called()
+
+    def test_render_failed(self):
+        """変換できなかった場合は保存せず、次に表示する時に変換し直すことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import RENDERER_VERSION
+
+        failed = RenderFailed('<pre>**bold**</pre>')
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed):
+            article = Article.objects.create(title='Test', text='**bold**')
+            self.assertEqual(article.html, '<pre>**bold**</pre>')
+            self.assertFalse(article.render_html())
+            self.assertEqual(article.html_version, 0)
+            self.assertEqual(article.get_html(), '<pre>**bold**</pre>')
+
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(article.html_version, 0)
+        self.assertIn('<strong>bold</strong>', article.get_html())
+        article.refresh_from_db()
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+    def test_render_budget_exceeded(self):
+        """上限を超えた場合は保存し、変換方法が変わるまで変換し直さないことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import RENDERER_VERSION
+
+        failed = RenderFailed('<pre>**bold**</pre>', transient=False)
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed) as render:
+            article = Article.objects.create(title='Test', text='**bold**')
+            article = Article.objects.get(pk=article.pk)
+            self.assertEqual(article.get_html(), '<pre>**bold**</pre>')
+            self.assertEqual(render.call_count, 1)
+        self.assertTrue(article.html_failed)
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+        Article.objects.filter(pk=article.pk).update(
+            html_version=RENDERER_VERSION - 1)
+        article = Article.objects.get(pk=article.pk)
+        self.assertIn('<strong>bold</strong>', article.get_html())
+        article.refresh_from_db()
+        self.assertFalse(article.html_failed)
+        self.assertEqual(article.html_version, RENDERER_VERSION)
+
+
+class CategoryCountTest(TestCase):
+    """カテゴリーの公開記事数のテスト"""
+    def setUp(self):
+        self.python = Category.objects.create(name='python')
+        self.django = Category.objects.create(name='django')
+
+    def assertCounts(self, python, django):
+        self.python.refresh_from_db()
+        self.django.refresh_from_db()
+        self.assertEqual(self.python.public_article_count, python)
+        self.assertEqual(self.django.public_article_count, django)
+
+    def test_add(self):
+        """カテゴリーを追加した公開記事だけ数えることの確認"""
+        article = Article.objects.create(title='public', text='text')
+        article.categories.add(self.python, self.django)
+        # 追加済みのカテゴリーは数えない
+        article.categories.add(self.python)
+        private = Article.objects.create(
+            title='private', text='text', is_public=False)
+        private.categories.add(self.python)
+
+        self.assertCounts(1, 1)
+
+    def test_remove(self):
+        """カテゴリーを外すと数が減ることの確認"""
+        article = Article.objects.create(title='public', text='text')
+        article.categories.add(self.python)
+        # つながっていないカテゴリーは減らさない
+        article.categories.remove(self.python, self.django)
+        self.assertCounts(0, 0)
+
+        article.categories.set([self.python, self.django])
+        article.categories.set([self.django])
+        self.assertCounts(0, 1)
+
+        article.categories.clear()
+        self.assertCounts(0, 0)
+
+    def test_reverse(self):
+        """カテゴリー側から記事を追加、削除した場合のテスト"""
+        public = Article.objects.create(title='public', text='text')
+        private = Article.objects.create(
+            title='private', text='text', is_public=False)
+
+        self.python.article_set.add(public, private)
+        self.assertCounts(1, 0)
+        self.python.article_set.remove(private)
+        self.assertCounts(1, 0)
+        self.python.article_set.clear()
+        self.assertCounts(0, 0)
+
+    def test_is_public(self):
+        """公開状態を変えると数が変わることの確認"""
+        article = Article.objects.create(title='public', text='text')
+        article.categories.add(self.python)
+
+        article.is_public = False
+        article.save()
+        self.assertCounts(0, 0)
+        # 公開状態を変えない保存では変わらない
+        article.save()
+        article.title = 'title'
+        article.save(update_fields=['title'])
+        self.assertCounts(0, 0)
+
+        article = Article.objects.get(pk=article.pk)
+        article.is_public = True
+        article.save()
+        self.assertCounts(1, 0)
+
+    def test_delete(self):
+        """公開記事を削除すると数が減ることの確認"""
+        article = Article.objects.create(title='public', text='text')
+        article.categories.add(self.python, self.django)
+        private = Article.objects.create(
+            title='private', text='text', is_public=False)
+        private.categories.add(self.python)
+
+        article.delete()
+        private.delete()
+
+        self.assertCounts(0, 0)
+
+
+class ArticleListProjectionTest(TestCase):
+    """一覧用に列を絞ったクエリセットのテスト"""
+    def setUp(self):
+        Article.objects.create(title='title', text='text', html='<p>text</p>')
+
+    def test_for_list(self):
+        """本文とhtmlを読み込まないことの確認"""
+        article = Article.objects.for_list().get()
+
+        self.assertIn('text', article.get_deferred_fields())
+        self.assertIn('html', article.get_deferred_fields())
+        self.assertNotIn('title', article.get_deferred_fields())
+
+    def test_index_loads_no_deferred_fields(self):
+        """記事一覧の表示で読み込んでいない列を読まないことの確認"""
+        from unittest import mock
+
+        with mock.patch.object(Article, 'refresh_from_db') as refresh:
+            response = self.client.get(reverse('blogs:index'))
+
+        self.assertContains(response, 'title')
+        refresh.assert_not_called()
+
+    def test_deferred_load_warning(self):
+        """DEBUGの場合、読み込んでいない列へのアクセスを警告することの確認"""
+        from unittest import mock
+
+        from django.test import override_settings
+
+        article = Article.objects.for_list().get()
+        with override_settings(DEBUG=True):
+            with self.assertLogs('blogs.models', 'WARNING') as logs:
+                self.assertEqual(article.text, 'text')
+
+        self.assertIn('text', logs.output[0])
+        # 一覧用でない記事では警告しない
+        article = Article.objects.only('title').get()
+        with override_settings(DEBUG=True):
+            with mock.patch('blogs.models.logger') as logger:
+                self.assertEqual(article.text, 'text')
+        logger.warning.assert_not_called()
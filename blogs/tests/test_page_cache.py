@@ -0,0 +1,212 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from blogs.models import Article, Category
+from users.models import Profile
+
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django_redis.cache.RedisCache'},
+}
+
+
+class NormalizeQueryTest(TestCase):
+    """キャッシュのキーのクエリパラメーターのテスト"""
+    def test_normalize(self):
+        """順番、ページ番号の表記、他のパラメーターをそろえることの確認"""
+        from django.http import QueryDict
+
+        from blogs.page_cache import normalize_query
+
+        params = ('category', 'page')
+
+        self.assertEqual(
+            normalize_query(QueryDict('page=02&category=python'), params),
+            normalize_query(QueryDict('category=python&page=2&utm=x'),
+                            params)
+        )
+        self.assertEqual(normalize_query(QueryDict('page=1'), params), '')
+        self.assertEqual(
+            normalize_query(QueryDict('page=last'), params), 'page=last')
+
+
+class CacheAnonymousPageTest(TestCase):
+    """ページをキャッシュするデコレーターのテスト"""
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = RequestFactory()
+
+    def _view(self, calls, csrf=False):
+        from django.http import HttpResponse
+        from django.middleware.csrf import get_token
+
+        from blogs.page_cache import cache_anonymous_page
+
+        @cache_anonymous_page(lambda request: ['test'])
+        def view(request):
+            calls.append(request)
+            if csrf:
+                get_token(request)
+            return HttpResponse('ok')
+        return view
+
+    def test_cached(self):
+        """2回目はviewを呼ばないことの確認"""
+        from blogs.page_cache import purge
+
+        calls = []
+        view = self._view(calls)
+
+        view(self.factory.get('/'))
+        response = view(self.factory.get('/'))
+
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(len(calls), 1)
+        self.assertIn('Cookie', response['Vary'])
+        purge('test')
+        view(self.factory.get('/'))
+        self.assertEqual(len(calls), 2)
+
+    def test_session_and_csrf(self):
+        """セッションのCookieがある場合とCSRFのトークンを使う場合の確認"""
+        from django.conf import settings
+
+        calls = []
+        view = self._view(calls)
+        request = self.factory.get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'session'
+        view(request)
+        view(request)
+        self.assertEqual(len(calls), 2)
+
+        calls = []
+        view = self._view(calls, csrf=True)
+        view(self.factory.get('/'))
+        view(self.factory.get('/'))
+        self.assertEqual(len(calls), 2)
+
+
+class SharedCacheCheckTest(TestCase):
+    """キャッシュの設定の確認のテスト"""
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_shared(self):
+        """共有のキャッシュなら警告しないことの確認"""
+        from blogs.page_cache import check_shared_cache
+
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_process_local(self):
+        """プロセスごとのキャッシュなら警告することの確認"""
+        from blogs.page_cache import check_shared_cache
+
+        self.assertEqual(
+            [w.id for w in check_shared_cache(None)], ['blogs.W001'])
+        with self.settings(PAGE_CACHE_TIMEOUT=0):
+            self.assertEqual(check_shared_cache(None), [])
+        # 開発用のサーバーでは警告しない
+        with self.settings(DEBUG=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+# キャッシュに載ったページはクエリを使わないことで確かめるため、
+# キャッシュの読み書きをクエリに含めない
+@override_settings(CACHES=LOCMEM_CACHES)
+class PageCachePurgeTest(TestCase):
+    """記事の変更でキャッシュを外すページのテスト"""
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email='test@test.com', password='password')
+        Profile.objects.create(user=self.user, user_name='author')
+        other = User.objects.create_user(
+            email='other@test.com', password='password')
+        Profile.objects.create(user=other, user_name='other')
+        self.python = Category.objects.create(name='python')
+        self.django = Category.objects.create(name='django')
+        self.article = Article.objects.create(
+            title='python article', text='text', author=self.user)
+        self.article.categories.add(self.python)
+        self.other_article = Article.objects.create(
+            title='django article', text='text', author=other)
+        self.other_article.categories.add(self.django)
+
+        self.urls = {
+            'index': reverse('blogs:index'),
+            'python': reverse('blogs:index') + '?category=python',
+            'django': reverse('blogs:index') + '?category=django',
+            'detail': reverse('blogs:article_detail',
+                              kwargs={'pk': self.article.pk}),
+            'other_detail': reverse('blogs:article_detail',
+                                    kwargs={'pk': self.other_article.pk}),
+            'profile': reverse('users:profile', kwargs={'name': 'author'}),
+            'other_profile': reverse('users:profile',
+                                     kwargs={'name': 'other'}),
+        }
+        for url in self.urls.values():
+            self.client.get(url)
+
+    def assertCached(self, *names):
+        """namesのページだけがキャッシュに残っていることの確認"""
+        for name, url in self.urls.items():
+            with self.subTest(name=name):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url)
+                self.assertEqual(len(queries) == 0, name in names)
+
+    def test_cached(self):
+        """2回目の表示はデータベースを使わないことの確認"""
+        with self.assertNumQueries(0):
+            response = self.client.get(self.urls['index'] + '?page=1')
+        self.assertContains(response, 'python article')
+
+    def test_edit(self):
+        """記事の編集で関係するページだけを外すことの確認"""
+        self.article.title = 'edited'
+        self.article.save()
+
+        self.assertCached('django', 'other_detail', 'other_profile')
+        self.assertContains(self.client.get(self.urls['detail']), 'edited')
+        self.assertContains(self.client.get(self.urls['index']), 'edited')
+
+    def test_unpublish(self):
+        """公開状態を変えるとカテゴリーの記事数のため一覧をすべて外す"""
+        self.article.is_public = False
+        self.article.save()
+
+        self.assertCached('other_detail', 'other_profile')
+        self.assertNotContains(
+            self.client.get(self.urls['index']), 'python article')
+
+    def test_profile(self):
+        """プロフィールの変更で投稿者の記事の詳細も外すことの確認"""
+        profile = Profile.objects.get(user=self.user)
+        profile.user_name = 'renamed'
+        profile.save()
+
+        # 変更前のユーザー名のプロフィールは存在しない
+        response = self.client.get(self.urls.pop('profile'))
+        self.assertEqual(response.status_code, 404)
+        self.assertCached('index', 'python', 'django', 'other_detail',
+                          'other_profile')
+        self.assertContains(self.client.get(self.urls['detail']), 'renamed')
+
+    def test_logged_in(self):
+        """ログインしている場合はキャッシュを使わないことの確認"""
+        self.client.login(email='test@test.com', password='password')
+
+        response = self.client.get(self.urls['index'])
+
+        self.assertContains(response, 'author')
@@ -0,0 +1,154 @@
+import datetime
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blogs.models import Article, Category
+from blogs.views import ArticleListView
+
+
+class CursorTest(TestCase):
+    """トークンのテスト"""
+    def test_round_trip(self):
+        """記事の位置をトークンから取り出せることの確認"""
+        from blogs.pagination import decode_cursor, encode_cursor
+
+        article = Article(created_at=timezone.now())
+        token = encode_cursor('next', article)
+
+        self.assertNotIn('=', token)
+        self.assertEqual(
+            decode_cursor(token), ('next', article.created_at, article.pk)
+        )
+
+    def test_invalid(self):
+        """読み取れないトークンのテスト"""
+        from blogs.pagination import InvalidCursor, decode_cursor
+
+        for token in ['x', 'WyJ4Il0', 'WyJ1cCIsIG51bGwsICIxIl0']:
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(token)
+
+
+class CursorPaginatorTest(TestCase):
+    """(created_at, id)の位置でページを分けるクラスのテスト"""
+    def setUp(self):
+        base = timezone.now()
+        for i in range(7):
+            article = Article.objects.create(title='title%d' % i, text='text')
+            # 2件ずつ同じ日時にする
+            created_at = base - datetime.timedelta(days=i // 2)
+            Article.objects.filter(pk=article.pk).update(created_at=created_at)
+        article = Article.objects.create(title='null', text='text')
+        Article.objects.filter(pk=article.pk).update(created_at=None)
+
+    def _expected(self):
+        articles = sorted(
+            Article.objects.exclude(created_at=None),
+            key=lambda article: (article.created_at, article.pk),
+            reverse=True
+        )
+        return articles + list(Article.objects.filter(created_at=None))
+
+    def test_forward_and_backward(self):
+        """次のページ、前のページを順にたどれることの確認"""
+        from blogs.pagination import CursorPaginator
+
+        paginator = CursorPaginator(Article.objects.all(), 3)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+
+        articles = [article for page in pages for article in page]
+        self.assertEqual(articles, self._expected())
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[-1].has_previous())
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(list(page), list(expected))
+            self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+
+class PageWindowTest(TestCase):
+    """ページ番号を絞る関数のテスト"""
+    def test_page_window(self):
+        """前後2ページと最初、最後のページだけになることの確認"""
+        from django.core.paginator import Paginator
+
+        from blogs.pagination import page_window
+
+        paginator = Paginator(range(100), 1)
+
+        self.assertEqual(page_window(paginator.page(1)), [1, 2, 3, None, 100])
+        self.assertEqual(
+            page_window(paginator.page(50)),
+            [1, None, 48, 49, 50, 51, 52, None, 100]
+        )
+        self.assertEqual(page_window(paginator.page(4)), [1, 2, 3, 4, 5, 6,
+                                                          None, 100])
+        self.assertEqual(page_window(Paginator(range(2), 1).page(2)), [1, 2])
+
+
+@mock.patch.object(ArticleListView, 'cursor_pagination', True)
+class ArticleListCursorTest(TestCase):
+    """記事一覧のカーソルによるページ分割のテスト"""
+    def setUp(self):
+        self.category = Category.objects.create(name='python')
+        for i in range(30):
+            article = Article.objects.create(title='title%d' % i, text='text')
+            if i % 2:
+                article.categories.add(self.category)
+        self.url = reverse('blogs:index')
+
+    # DatabaseCacheの件数の確認をクエリに含めない
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    })
+    def test_pages(self):
+        """トークンで次のページを表示できることの確認"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        # 記事の数を数えない
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 12)
+        self.assertContains(response, '?cursor=' + page.next_cursor)
+
+        response = self.client.get(self.url, {'cursor': page.next_cursor})
+        second = response.context['page_obj']
+        self.assertEqual(len(second), 12)
+        self.assertTrue(second.has_previous())
+        self.assertTrue(set(page).isdisjoint(second))
+
+    def test_category(self):
+        """カテゴリーで絞り込んだままページを移れることの確認"""
+        response = self.client.get(self.url, {'category': 'python'})
+        page = response.context['page_obj']
+        self.assertContains(
+            response, '?category=python&amp;cursor=' + page.next_cursor)
+
+        response = self.client.get(
+            self.url, {'category': 'python', 'cursor': page.next_cursor})
+        articles = list(response.context['page_obj'])
+        self.assertEqual(len(articles), 3)
+        for article in articles:
+            self.assertIn(self.category, article.categories.all())
+
+    def test_invalid_cursor(self):
+        """読み取れないトークンは404を返すことの確認"""
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,235 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+
+from users.models import Profile
+
+
+User = get_user_model()
+
+
+class ApplySpliceTest(TestCase):
+    """差分を適用する関数のテスト"""
+    def test_splice(self):
+        """指定の範囲を置き換えることの確認"""
+        from blogs.preview import apply_splice
+
+        self.assertEqual(apply_splice('abc', 1, 2, 'XY'), 'aXYc')
+        self.assertEqual(apply_splice('abc', 3, 3, 'd'), 'abcd')
+        self.assertEqual(apply_splice('abc', 0, 3, ''), '')
+
+    def test_utf16(self):
+        """位置をUTF-16の単位で数えることの確認"""
+        from blogs.preview import apply_splice
+
+        self.assertEqual(apply_splice('a😀b', 1, 3, '😁'), 'a😁b')
+        self.assertEqual(apply_splice('😀あ', 2, 3, 'い'), '😀い')
+
+    def test_invalid(self):
+        """範囲外やサロゲートペアの途中の場合のテスト"""
+        from blogs.preview import PreviewError, apply_splice
+
+        with self.assertRaises(PreviewError):
+            apply_splice('abc', 2, 4, '')
+        with self.assertRaises(PreviewError):
+            apply_splice('abc', 2, 1, '')
+        with self.assertRaises(PreviewError):
+            apply_splice('a😀b', 2, 3, '')
+
+
+class ArticlePreviewViewTest(TestCase):
+    """プレビューのviewのテスト"""
+    def setUp(self):
+        from unittest import mock
+
+        from blogs.isolation import isolated_renderer
+        from blogs.preview import PREVIEW_CACHE_ALIAS
+
+        caches[PREVIEW_CACHE_ALIAS].clear()
+        # 変換の関数を差し替えるため、別プロセスを使わない
+        patcher = mock.patch.object(isolated_renderer, 'budget', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user(
+            email='test@test.com',
+            password='testpass'
+        )
+        Profile.objects.create(user=user, user_name='test name')
+        self.client.login(email='test@test.com', password='testpass')
+        self.url = reverse('blogs:article_preview')
+
+    def post(self, seq, **data):
+        data.update(editor='editor1', seq=seq)
+        return self.client.post(self.url, data)
+
+    def test_content(self):
+        """全文を送った場合のテスト"""
+        from blogs.preview import make_digest
+
+        response = self.post(1, content='# head\n\n<script>')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'seq': 1,
+            'hash': make_digest('# head\n\n<script>'),
+            'html': '<h1 id="head">head</h1>\n<p>&lt;script&gt;</p>',
+        })
+
+    def test_diff(self):
+        """ハッシュと差分を送った場合のテスト"""
+        from blogs.preview import make_digest
+
+        base = self.post(1, content='para one\n\npara two').json()['hash']
+        response = self.post(2, base=base, start=15, end=18, insert='three')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['hash'], make_digest('para one\n\npara three')
+        )
+        self.assertEqual(
+            response.json()['html'], '<p>para one</p>\n<p>para three</p>'
+        )
+
+    def test_cache(self):
+        """同じ本文は変換し直さないことの確認"""
+        from unittest import mock
+
+        self.post(1, content='text')
+        with mock.patch('blogs.views._render_preview') as render:
+            response = self.post(2, content='text')
+
+        render.assert_not_called()
+        self.assertEqual(response.json()['html'], '<p>text</p>')
+
+    def test_unknown_base(self):
+        """元の本文がない場合は412を返すことの確認"""
+        response = self.post(1, base='0' * 64, start=0, end=0, insert='a')
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.json(), {'error': 'unknown-base'})
+
+    def test_latest_base_only(self):
+        """差分の元には最後に受け取った本文だけを使えることの確認"""
+        first = self.post(1, content='first').json()['hash']
+        self.post(2, content='second')
+
+        response = self.post(3, base=first, start=0, end=0, insert='a')
+
+        self.assertEqual(response.status_code, 412)
+
+    def test_seq_lock(self):
+        """通し番号を更新中の場合は待ち、ロックを残さないことの確認"""
+        from unittest import mock
+
+        from blogs.preview import (
+            PREVIEW_CACHE_ALIAS,
+            PreviewSession,
+            StaleRequest
+        )
+
+        cache = caches[PREVIEW_CACHE_ALIAS]
+        preview = PreviewSession('session', 'editor1')
+        preview.start(1)
+        self.assertIsNone(cache.get(preview.seq_key + ':lock'))
+
+        cache.add(preview.seq_key + ':lock', 0)
+        with mock.patch('blogs.preview.SEQ_LOCK_ATTEMPTS', 2), \
+                mock.patch('blogs.preview.time.sleep') as sleep:
+            with self.assertRaises(StaleRequest):
+                preview.start(2)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(cache.get(preview.seq_key), 1)
+
+    def test_stale(self):
+        """古い通し番号のリクエストは409を返すことの確認"""
+        self.post(2, content='new')
+        response = self.post(1, content='old')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'error': 'stale'})
+        # 別の編集画面の通し番号とは比べない
+        response = self.client.post(
+            self.url, {'editor': 'editor2', 'seq': 1, 'content': 'old'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_superseded(self):
+        """変換中に新しいリクエストを受け付けた場合は409を返すことの確認"""
+        from unittest import mock
+
+        def render(text):
+            # 変換中に次のリクエストが届く
+            self.post(2, content='new')
+            return ''
+
+        with mock.patch('blogs.views._render_preview', render):
+            response = self.post(1, content='old')
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_invalid(self):
+        """パラメータが足りない場合は400を返すことの確認"""
+        response = self.post(1)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.url, {'editor': 'a b', 'seq': 2, 'content': 'a'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_render_failed(self):
+        """変換できなかった結果は保持せず、次のリクエストで変換し直すことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+
+        failed = RenderFailed('<pre>**a**</pre>')
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed):
+            response = self.post(1, content='**a**')
+        self.assertEqual(response.json()['html'], '<pre>**a**</pre>')
+
+        response = self.post(2, base=response.json()['hash'],
+                             start=0, end=0, insert='')
+
+        self.assertEqual(response.json()['html'], '<p><strong>a</strong></p>')
+
+    def test_budget_exceeded(self):
+        """上限を超えた結果は保持し、変換し直さないことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+
+        failed = RenderFailed('<pre>**a**</pre>', transient=False)
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed) as render:
+            self.post(1, content='**a**')
+            response = self.post(2, content='**a**')
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(response.json()['html'], '<pre>**a**</pre>')
+
+    def test_not_login(self):
+        """ログインしていない場合は403を返すことの確認"""
+        self.client.logout()
+
+        response = self.post(1, content='text')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class MarkdownxUrlsTest(TestCase):
+    """markdownxのURLのテスト"""
+    def test_markdownify(self):
+        """markdownxの変換のURLがないことの確認"""
+        response = self.client.post('/markdownx/markdownify/',
+                                    {'content': '# head'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_upload_not_login(self):
+        """ログインしていない場合は画像をアップロードできないことの確認"""
+        response = self.client.post(reverse('markdownx_upload'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('users:login'), response.url)
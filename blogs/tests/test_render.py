@@ -0,0 +1,351 @@
+from django.core.cache import caches
+from django.test import TestCase
+
+
+class RenderCacheTest(TestCase):
+    """変換後のhtmlのキャッシュのテスト"""
+    def setUp(self):
+        caches['default'].clear()
+        self.calls = []
+
+    def _render(self, text):
+        self.calls.append(text)
+        return '<p>%s</p>' % text
+
+    def test_local_hit(self):
+        """2回目はプロセス内のキャッシュから返すことの確認"""
+        from blogs.render import RenderCache
+
+        cache = RenderCache(max_bytes=1024)
+        self.assertEqual(cache.get_or_render('a', self._render), '<p>a</p>')
+        self.assertEqual(cache.get_or_render('a', self._render), '<p>a</p>')
+
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.local_hits, 1)
+
+    def test_shared_hit(self):
+        """プロセス内になくても共有キャッシュから返すことの確認"""
+        from blogs.render import RenderCache
+
+        RenderCache(max_bytes=1024).get_or_render('a', self._render)
+        cache = RenderCache(max_bytes=1024)
+        cache.get_or_render('a', self._render)
+
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(cache.shared_hits, 1)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_namespace(self):
+        """namespaceが違う場合は別に変換することの確認"""
+        from blogs.render import RenderCache
+
+        cache = RenderCache(max_bytes=1024)
+        cache.get_or_render('a', self._render)
+        cache.get_or_render('a', self._render, namespace='escape')
+
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_eviction(self):
+        """上限を超えた分が古い順に捨てられることの確認"""
+        from blogs.render import RenderCache
+
+        # '<p>x</p>'は8バイト
+        cache = RenderCache(max_bytes=16)
+        for text in ('a', 'b', 'c'):
+            cache.get_or_render(text, self._render)
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size, 16)
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+
+        caches['default'].clear()
+        cache.get_or_render('a', self._render)
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'a'])
+
+    def test_too_large(self):
+        """上限より大きいhtmlはプロセス内に保持しないことの確認"""
+        from blogs.render import RenderCache
+
+        cache = RenderCache(max_bytes=4)
+        cache.get_or_render('a', self._render)
+
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.evictions, 0)
+
+    def test_shared_cache_error(self):
+        """共有キャッシュの障害はキャッシュにない場合と同じに扱うことの確認"""
+        from unittest import mock
+
+        from blogs.render import RenderCache
+
+        shared = caches['default']
+        cache = RenderCache(max_bytes=1024)
+        with mock.patch.object(shared, 'get_many', side_effect=OSError), \
+                mock.patch.object(shared, 'set_many', side_effect=OSError):
+            with self.assertLogs('blogs.render', 'WARNING') as logs:
+                html = cache.get_or_render('a', self._render)
+                htmls = cache.get_many_or_render(['b', 'c'], self._render)
+
+        self.assertEqual(html, '<p>a</p>')
+        self.assertEqual(htmls, ['<p>b</p>', '<p>c</p>'])
+        self.assertEqual(len(logs.output), 4)
+        self.assertEqual(cache.misses, 3)
+
+    def test_detach(self):
+        """detachした後は共有キャッシュを読み書きしないことの確認"""
+        from blogs.render import RenderCache
+
+        RenderCache(max_bytes=1024).get_or_render('a', self._render)
+        cache = RenderCache(max_bytes=1024)
+        cache.detach()
+        cache.get_or_render('a', self._render)
+        cache.get_many_or_render(['b'], self._render)
+
+        self.assertEqual(self.calls, ['a', 'a', 'b'])
+        self.assertEqual(cache.shared_hits, 0)
+        self.assertIsNone(caches['default'].get(cache.make_key('b')))
+
+    def test_filters(self):
+        """テンプレートフィルタがキャッシュを使うことの確認"""
+        from blogs.render import render_cache
+        from blogs.templatetags.markdown import (
+            markdown_to_html,
+            markdown_to_html_with_escape
+        )
+
+        render_cache.clear()
+        render_cache.reset_stats()
+        self.assertEqual(markdown_to_html('**a**'),
+                         markdown_to_html('**a**'))
+        markdown_to_html_with_escape('**a**')
+
+        self.assertEqual(render_cache.misses, 2)
+        self.assertEqual(render_cache.local_hits, 1)
+
+    def test_filters_render_failed(self):
+        """一時的に変換できなかった結果はキャッシュしないことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import render_cache
+        from blogs.templatetags.markdown import (
+            markdown_to_html,
+            markdown_to_html_with_escape
+        )
+
+        render_cache.clear()
+        failed = RenderFailed('<pre>**a**</pre>')
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed):
+            self.assertEqual(markdown_to_html('**a**'), '<pre>**a**</pre>')
+            self.assertEqual(
+                markdown_to_html_with_escape('**a**'), '<pre>**a**</pre>')
+
+        self.assertEqual(render_cache.stats()['entries'], 0)
+        self.assertIn('<strong>a</strong>', markdown_to_html('**a**'))
+
+    def test_filters_budget_exceeded(self):
+        """上限を超えた結果はキャッシュし、変換し直さないことの確認"""
+        from unittest import mock
+
+        from blogs.isolation import RenderFailed, isolated_renderer
+        from blogs.render import render_cache
+        from blogs.templatetags.markdown import (
+            markdown_to_html,
+            markdown_to_html_with_escape
+        )
+
+        render_cache.clear()
+        failed = RenderFailed('<pre>**a**</pre>', transient=False)
+        with mock.patch.object(isolated_renderer, 'render',
+                               side_effect=failed) as render:
+            self.assertEqual(markdown_to_html('**a**'), '<pre>**a**</pre>')
+            self.assertEqual(
+                markdown_to_html_with_escape('**a**'), '<pre>**a**</pre>')
+            render_cache.clear()
+            self.assertEqual(markdown_to_html('**a**'), '<pre>**a**</pre>')
+
+        self.assertEqual(render.call_count, 2)
+
+
+class ConverterPoolTest(TestCase):
+    """Markdownのインスタンスのプールのテスト"""
+    extensions = ['markdown.extensions.toc']
+
+    def test_reuse(self):
+        """同じスレッドでは同じインスタンスを使い回すことの確認"""
+        from blogs.render import ConverterPool
+
+        pool = ConverterPool()
+        converter = pool.get(self.extensions)
+
+        self.assertIs(pool.get(self.extensions), converter)
+        self.assertIsNot(pool.get([]), converter)
+
+    def test_per_thread(self):
+        """スレッドごとに別のインスタンスを使うことの確認"""
+        import threading
+
+        from blogs.render import ConverterPool
+
+        pool = ConverterPool()
+        converters = []
+        thread = threading.Thread(
+            target=lambda: converters.append(pool.get(self.extensions)))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(pool.get(self.extensions), converters[0])
+
+    def test_reset(self):
+        """変換ごとに状態が初期化されることの確認"""
+        from blogs.render import ConverterPool
+
+        pool = ConverterPool()
+        first = pool.convert('# head', self.extensions)
+        second = pool.convert('# head', self.extensions)
+
+        self.assertEqual(first, second)
+        self.assertIn('id="head"', second)
+
+    def test_reset_md_in_html(self):
+        """markdown属性のあるhtmlを続けて変換できることの確認"""
+        from blogs.render import ConverterPool
+
+        pool = ConverterPool()
+        extensions = ['markdown.extensions.extra']
+        text = '<div markdown="1">\n*a*\n</div>'
+        first = pool.convert(text, extensions)
+
+        self.assertEqual(pool.convert(text, extensions), first)
+        self.assertIn('<em>a</em>', first)
+
+    def test_escape_filter_extensions(self):
+        """エスケープ付きの変換で拡張機能が有効なことの確認"""
+        from blogs.templatetags.markdown import markdown_to_html_with_escape
+
+        html = markdown_to_html_with_escape(
+            '# head\n\n|a|b|\n|-|-|\n|1|2|\n\n<script>x</script>')
+
+        self.assertIn('<h1 id="head">', html)
+        self.assertIn('<table>', html)
+        self.assertIn('&lt;script&gt;', html)
+
+
+class BlockRenderTest(TestCase):
+    """ブロックごとの変換のテスト"""
+    text = (
+        '# Head\n\n'
+        'para *one*\nline\n\n'
+        '```python\ncode\n\nmore code\n```\n\n'
+        '- a\n\n- b\n\n'
+        '> quote\n\n> quote2\n\n'
+        '    indented\n\n'
+        '# Head\n\n'
+        'para two\n'
+    )
+
+    def setUp(self):
+        from blogs.render import render_cache
+
+        caches['default'].clear()
+        render_cache.clear()
+        render_cache.reset_stats()
+
+    def test_split_blocks(self):
+        """空行をまたぐブロックが分けられないことの確認"""
+        from blogs.render import split_blocks
+
+        self.assertEqual(split_blocks(self.text), [
+            '# Head',
+            'para *one*\nline',
+            '```python\ncode\n\nmore code\n```',
+            '- a\n\n- b',
+            '> quote\n\n> quote2\n\n    indented',
+            '# Head',
+            'para two',
+        ])
+
+    def test_split_blocks_html(self):
+        """htmlのブロック以降は1つのブロックになることの確認"""
+        from blogs.render import split_blocks
+
+        blocks = split_blocks('a\n\n<ul>\n<li>x</li>\n\n</ul>\n\nb\n\n')
+
+        self.assertEqual(blocks, ['a', '<ul>\n<li>x</li>\n\n</ul>\n\nb\n\n'])
+
+    def test_same_as_document(self):
+        """記事全体を変換した場合と同じ結果になることの確認"""
+        from blogs.render import _render_document, render_blocks
+
+        html = render_blocks(self.text)
+
+        self.assertEqual(html, _render_document(self.text))
+        self.assertIn('<h1 id="head">', html)
+        self.assertIn('<h1 id="head_1">', html)
+
+    def test_same_as_document_continued(self):
+        """前のブロックの続きになる書き方でも同じ結果になることの確認"""
+        from blogs.render import _render_document, render_blocks
+
+        texts = [
+            '> a\n\n　\n> b',
+            '- a\n\n- b\n\n    c',
+            'term\n\n: definition',
+            'a\n\n<div>\n\nb\n\n</div>\n\nc',
+            # 3つまでの空白でインデントしたリスト、引用
+            'Intro\n\n  - first\n\n- second',
+            'a\n\n   1. one\n\n2. two',
+            '  > a\n\n> b',
+            'term\n: def\n\n  > quote\n\n> quote2',
+            '***\n: def\n\n> quote\ntext\n: def',
+        ]
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(render_blocks(text), _render_document(text))
+
+    def test_render_changed_blocks(self):
+        """変わったブロックだけ変換し直すことの確認"""
+        from blogs.render import render_blocks, render_cache
+
+        render_blocks(self.text)
+        render_cache.reset_stats()
+        render_blocks(self.text.replace('para two', 'para three'))
+
+        self.assertEqual(render_cache.misses, 1)
+        self.assertEqual(render_cache.local_hits, 6)
+
+    def test_document_wide(self):
+        """記事全体に影響する記法はブロックに分けないことの確認"""
+        from blogs.render import can_render_blocks
+
+        self.assertTrue(can_render_blocks(self.text))
+        self.assertFalse(can_render_blocks('a[^1]\n\n[^1]: note'))
+        self.assertFalse(can_render_blocks('[a][x]\n\n[x]: /url'))
+        self.assertFalse(can_render_blocks('[TOC]\n\n# Head'))
+
+    def test_render_markdown(self):
+        """長い記事もrender_markdownの結果が変わらないことの確認"""
+        from blogs.render import (
+            BLOCK_RENDER_MIN_LENGTH, _render_document, render_markdown,
+        )
+
+        text = self.text * (BLOCK_RENDER_MIN_LENGTH // len(self.text) + 1)
+
+        self.assertEqual(render_markdown(text), _render_document(text))
+
+    def test_render_markdown_indented_list(self):
+        """インデントしたリストの項目が別のリストにならないことの確認"""
+        from blogs.render import (
+            BLOCK_RENDER_MIN_LENGTH, _render_document, render_markdown,
+        )
+
+        text = 'Intro\n\n  - first\n\n- second\n\n' + \
+            'padding\n\n' * (BLOCK_RENDER_MIN_LENGTH // 9)
+
+        html = render_markdown(text)
+
+        self.assertEqual(html, _render_document(text))
+        self.assertEqual(html.count('<ul>'), 1)
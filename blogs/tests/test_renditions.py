@@ -0,0 +1,180 @@
+import io
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from blogs.models import Article
+from users.models import Profile
+
+
+User = get_user_model()
+
+
+def _upload(name='thumbnail.png', size=(480, 480)):
+    data = io.BytesIO()
+    Image.new('RGB', size=size, color=(255, 0, 0)).save(data, format='PNG')
+    return SimpleUploadedFile(name, data.getvalue(), 'image/png')
+
+
+@override_settings(IMAGE_RENDITION_FORMATS=('webp', ))
+class RenditionTest(TestCase):
+    """画像のレンディションのテスト"""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.user = User.objects.create_user(
+            email='test@test.com', password='password')
+        Profile.objects.create(user=self.user, user_name='testname')
+        self.article = Article.objects.create(
+            title='title', text='text', author=self.user)
+        self.client.login(email='test@test.com', password='password')
+        self.url = reverse('blogs:article_edit', args=(self.article.pk, ))
+
+    def _post(self, **data):
+        data.setdefault('title', 'title')
+        data.setdefault('text', 'text')
+        data.setdefault('is_public', 'on')
+        return self.client.post(self.url, data=data)
+
+    def _process(self, **data):
+        from blogs.image_jobs import process_jobs
+
+        self._post(**data)
+        process_jobs()
+        return Article.objects.get(pk=self.article.pk)
+
+    def test_make(self):
+        """元の画像より大きくしない幅ごとに作ることの確認"""
+        from blogs.renditions import loads
+
+        article = self._process(thumbnail=_upload())
+
+        renditions = loads(article.thumbnail_renditions)
+        self.assertEqual(
+            [(r['format'], r['width'], r['height']) for r in renditions],
+            [('webp', 150, 150), ('webp', 300, 300)]
+        )
+        storage = article.thumbnail.storage
+        for rendition in renditions:
+            self.assertTrue(storage.exists(rendition['name']))
+            with storage.open(rendition['name']) as f:
+                self.assertEqual(Image.open(f).format, 'WEBP')
+
+    def test_small_source(self):
+        """小さい画像でも最小の幅のレンディションは作ることの確認"""
+        from blogs.renditions import loads
+
+        article = self._process(thumbnail=_upload(size=(100, 50)))
+
+        renditions = loads(article.thumbnail_renditions)
+        self.assertEqual(
+            [(r['width'], r['height']) for r in renditions], [(150, 150)]
+        )
+
+    @override_settings(IMAGE_RENDITION_FORMATS=('unknown', 'webp'))
+    def test_unavailable_format(self):
+        """Pillowが保存できない形式は作らないことの確認"""
+        from blogs.renditions import loads
+
+        article = self._process(thumbnail=_upload())
+
+        formats = {r['format'] for r in loads(article.thumbnail_renditions)}
+        self.assertEqual(formats, {'webp'})
+
+    def test_replace(self):
+        """画像を差し替えると変更前のレンディションを削除することの確認"""
+        from blogs.renditions import loads
+
+        first = self._process(thumbnail=_upload('first.png'))
+        article = self._process(thumbnail=_upload('second.png'))
+
+        storage = article.thumbnail.storage
+        for rendition in loads(first.thumbnail_renditions):
+            self.assertFalse(storage.exists(rendition['name']))
+        for rendition in loads(article.thumbnail_renditions):
+            self.assertTrue(storage.exists(rendition['name']))
+
+    def test_clear(self):
+        """画像をクリアするとレンディションも削除することの確認"""
+        from blogs.renditions import loads
+
+        first = self._process(thumbnail=_upload())
+        article = self._process(**{'thumbnail-clear': 'on'})
+
+        self.assertEqual(article.thumbnail_renditions, '')
+        storage = first.thumbnail.storage
+        for rendition in loads(first.thumbnail_renditions):
+            self.assertFalse(storage.exists(rendition['name']))
+
+    def test_picture(self):
+        """pictureタグのsourceにsrcsetを並べることの確認"""
+        article = self._process(thumbnail=_upload())
+        self.client.logout()
+
+        response = self.client.get(reverse('blogs:index'))
+
+        storage = article.thumbnail.storage
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '%s 150w, %s 300w' % (
+            storage.url('thumbnail/renditions/thumbnail-150.webp'),
+            storage.url('thumbnail/renditions/thumbnail-300.webp'),
+        ))
+        self.assertContains(
+            response, '<img src="%s" class="card-img"' % article.thumbnail.url
+        )
+
+    def test_picture_without_renditions(self):
+        """レンディションのない画像はimgだけにすることの確認"""
+        Article.objects.filter(pk=self.article.pk).update(
+            thumbnail='thumbnail/old.png', thumbnail_renditions='[broken')
+        self.client.logout()
+
+        response = self.client.get(reverse('blogs:index'))
+
+        self.assertNotContains(response, '<source')
+        self.assertContains(response, 'thumbnail/old.png')
+
+    def test_profile_image(self):
+        """プロフィール画像もレンディションを作ることの確認"""
+        from blogs.image_jobs import process_jobs
+
+        self.client.post(
+            reverse('users:profile_image_edit', args=('testname', )),
+            data={'image': _upload('profile.png')}
+        )
+        process_jobs()
+
+        profile = Profile.objects.get(user=self.user)
+        self.assertNotEqual(profile.image_renditions, '')
+        response = self.client.get(
+            reverse('users:profile', args=('testname', )))
+        self.assertContains(response, '<source type="image/webp"')
+
+    def test_command(self):
+        """レンディションのない保存済みの画像に作ることの確認"""
+        from django.core.management import call_command
+        from blogs.renditions import loads
+
+        article = self._process(thumbnail=_upload())
+        Article.objects.filter(pk=article.pk).update(thumbnail_renditions='')
+
+        out = io.StringIO()
+        call_command('make_image_renditions', stdout=out)
+
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(
+            [r['width'] for r in loads(article.thumbnail_renditions)], [150]
+        )
+        self.assertIn('created renditions for 1 images', out.getvalue())
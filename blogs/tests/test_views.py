@@ -2,12 +2,13 @@ import io
 import uuid
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from PIL import Image
 
+from blogs.image_jobs import process_jobs
+from blogs.renditions import delete_renditions
 from blogs.models import Article, Category
-from blogs.views import _set_full_name
 from users.models import Profile
 
 
@@ -18,7 +19,7 @@ class ImageResizeTest(TestCase):
     """画像を指定のサイズにリサイズする関数のテスト"""
     def test_no_format(self):
         """画像に拡張子がない場合のテスト"""
-        from blogs.views import _image_resize
+        from blogs.image_jobs import resize_image
 
         # 画像の準備
         test_imgfile = io.BytesIO()
@@ -28,12 +29,12 @@ class ImageResizeTest(TestCase):
         test_imgfile.name = 'ImageResizeTest_test_no_format'
         test_imgfile.seek(0)
 
-        result_img = _image_resize(test_imgfile, size=(100, 100))
+        result_img = resize_image(test_imgfile, size=(100, 100))
         self.assertTrue('.' not in result_img.name)
 
     def test_png_resize_success(self):
         """png形式リサイズが成功する場合のテスト"""
-        from blogs.views import _image_resize
+        from blogs.image_jobs import resize_image
 
         # 画像の準備
         test_imgfile = io.BytesIO()
@@ -43,7 +44,7 @@ class ImageResizeTest(TestCase):
         test_imgfile.name = 'ImageResizeTest_test_no_format.png'
         test_imgfile.seek(0)
 
-        result_img = _image_resize(test_imgfile, size=(100, 100))
+        result_img = resize_image(test_imgfile, size=(100, 100))
         result_img_size = Image.open(result_img).size
         self.assertEqual(result_img_size, (100, 100))
         self.assertEqual(result_img.content_type, 'image/png')
@@ -51,7 +52,7 @@ class ImageResizeTest(TestCase):
 
     def test_jpeg_resize_success(self):
         """jpeg形式リサイズが成功する場合のテスト"""
-        from blogs.views import _image_resize
+        from blogs.image_jobs import resize_image
 
         # 画像の準備
         test_imgfile = io.BytesIO()
@@ -61,7 +62,7 @@ class ImageResizeTest(TestCase):
         test_imgfile.name = 'ImageResizeTest_test_no_format.jpeg'
         test_imgfile.seek(0)
 
-        result_img = _image_resize(test_imgfile, size=(100, 100))
+        result_img = resize_image(test_imgfile, size=(100, 100))
         result_img_size = Image.open(result_img).size
         self.assertEqual(result_img_size, (100, 100))
         self.assertEqual(result_img.content_type, 'image/jpeg')
@@ -69,7 +70,7 @@ class ImageResizeTest(TestCase):
 
     def test_jpg_resize_success(self):
         """jpg形式リサイズが成功する場合のテスト"""
-        from blogs.views import _image_resize
+        from blogs.image_jobs import resize_image
 
         # 画像の準備
         test_imgfile = io.BytesIO()
@@ -79,47 +80,13 @@ class ImageResizeTest(TestCase):
         test_imgfile.name = 'ImageResizeTest_test_no_format.jpg'
         test_imgfile.seek(0)
 
-        result_img = _image_resize(test_imgfile, size=(100, 100))
+        result_img = resize_image(test_imgfile, size=(100, 100))
         result_img_size = Image.open(result_img).size
         self.assertEqual(result_img_size, (100, 100))
         self.assertEqual(result_img.content_type, 'image/jpg')
         self.assertTrue('.jpg' in result_img.name)
 
 
-class SetFullNameTest(TestCase):
-    """コンテキストにユーザーのフルネームを設定する関数のテスト"""
-    def test_no_user(self):
-        """ユーザーがいない時の確認"""
-        context = {}
-        _set_full_name(context, None)
-        self.assertEqual(context.get('user_name'), '')
-
-    def test_no_username(self):
-        """フルネームがないユーザーの確認"""
-        user = User.objects.create_user(
-            email="test@test.com", password="password")
-        user.is_active = True
-        profile = Profile.objects.create(user=user, user_name='')
-        profile.save()
-
-        context = {}
-        _set_full_name(context, user)
-        self.assertEqual(context.get('user_name'), '')
-
-    def test_with_fullname(self):
-        """フルネームがあるプロフィールの確認"""
-        user = User.objects.create_user(
-            email="test@test.com", password="password")
-        user.is_active = True
-        user.save()
-        profile = Profile.objects.create(user=user, user_name='testname')
-        profile.save()
-
-        context = {}
-        _set_full_name(context, user)
-        self.assertEqual(context.get('user_name'), 'testname')
-
-
 class ArticleListViewTest(TestCase):
     """記事を表示するviewのテスト"""
     def test_no_article(self):
@@ -345,6 +312,9 @@ class ArticleCreateViewTest(TestCase):
         articles = Article.objects.all()
         self.assertEqual(articles[0].title, 'Test1')
         self.assertEqual(articles.count(), 1)
+        # 変換済みのhtmlが保存されていることの確認
+        self.assertIn('Test1 text', articles[0].html)
+        self.assertNotEqual(articles[0].html_version, 0)
 
     def test_danger_data(self):
         """textにscriptタグがある場合のテスト"""
@@ -388,6 +358,8 @@ class ArticleCreateViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -399,6 +371,8 @@ class ArticleCreateViewTest(TestCase):
         self.assertEqual(article.thumbnail.name, 'thumbnail/' + thumbnail.name)
 
         # 確認後画像を削除
+        delete_renditions(
+            article.thumbnail.storage, article.thumbnail_renditions)
         article.thumbnail.delete()
         article.save()
 
@@ -421,6 +395,8 @@ class ArticleCreateViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -432,6 +408,8 @@ class ArticleCreateViewTest(TestCase):
         self.assertEqual(article.thumbnail.name, 'thumbnail/' + thumbnail.name)
 
         # 確認後画像を削除
+        delete_renditions(
+            article.thumbnail.storage, article.thumbnail_renditions)
         article.thumbnail.delete()
         article.save()
 
@@ -487,6 +465,64 @@ class ArticleDetailViewTest(TestCase):
 
         # コンテキスト
         self.assertTrue(response.context['author_profile'] is not None)
+        self.assertIn('test text1', response.context['article_html'])
+
+    def test_query_count(self):
+        """記事、投稿者、プロフィールを1回のクエリで読み込むことの確認"""
+        from django.core.cache import cache
+
+        article = Article.objects.create(
+            title='test1',
+            text='test text1',
+            author=self.user)
+        article.render_html()
+        article.save()
+        url = reverse('blogs:article_detail', args=(article.id, ))
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        # 未ログインは記事だけ
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'testname')
+        cache.clear()
+
+        # ログイン時はセッションとユーザーが増える。ナビバーのユーザー名は
+        # キャッシュから読む
+        self.client.login(email='test@test.com', password='test_password')
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(
+            response, reverse('blogs:article_edit', args=(article.id, )))
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'test_cache',
+        },
+    })
+    def test_query_count_database_cache(self):
+        """DatabaseCacheでキャッシュの読み書きも含めたクエリの数の確認"""
+        from django.core.management import call_command
+
+        call_command('createcachetable', verbosity=0)
+        article = Article.objects.create(
+            title='test1',
+            text='test text1',
+            author=self.user)
+        url = reverse('blogs:article_detail', args=(article.id, ))
+
+        # キャッシュにない場合は、世代とページの読み込み、記事、ページの
+        # 保存(件数の確認、セーブポイントの作成、確認、追加、解放)
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertContains(response, 'testname')
+
+        # キャッシュにある場合は世代とページの読み込みだけ
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, 'testname')
 
 
 class ArticleEditViewTest(TestCase):
@@ -574,6 +610,36 @@ class ArticleEditViewTest(TestCase):
         confirm_redirect = '/login/?next=%2Fedit%2F' + str(self.id) + '/'
         self.assertRedirects(response, confirm_redirect)
 
+    def test_not_author_edit_post(self):
+        """投稿者でないユーザーがpostリクエストした場合のテスト"""
+        User.objects.create_user(email='test2@test.com', password='testpass')
+        self.client.login(email='test2@test.com', password='testpass')
+
+        response = self.client.post(self.url, data={
+            'title': 'rename test title',
+            'text': 'rename test text2'
+        })
+
+        # ステータス400で、記事は変わらない
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Article.objects.get(pk=self.id).title, 'test title')
+
+    def test_fetch_once(self):
+        """記事を1回だけ読み込むことの確認"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.login(email='test@test.com', password='testpass')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        selects = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "blogs_article"' in query['sql']
+        ]
+        self.assertEqual(len(selects), 1)
+
     def test_empty_title_post(self):
         """タイトルが空文字でpostリクエストした場合のテスト"""
         # ログイン
@@ -625,6 +691,9 @@ class ArticleEditViewTest(TestCase):
         # リダイレクトarticle_detail
         confirm_redirect = '/detail/' + str(self.id) + '/'
         self.assertRedirects(response, confirm_redirect)
+        # 変換済みのhtmlが更新されていることの確認
+        article = Article.objects.get(pk=self.id)
+        self.assertIn('rename test text2', article.html)
 
     def test_jpeg_post(self):
         """postリクエスト時、jpeg画像で更新可能である場合のテスト"""
@@ -645,6 +714,8 @@ class ArticleEditViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -656,6 +727,8 @@ class ArticleEditViewTest(TestCase):
         self.assertEqual(article.thumbnail.name, 'thumbnail/' + thumbnail.name)
 
         # 確認後画像を削除
+        delete_renditions(
+            article.thumbnail.storage, article.thumbnail_renditions)
         article.thumbnail.delete()
         article.save()
 
@@ -678,6 +751,8 @@ class ArticleEditViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -689,6 +764,8 @@ class ArticleEditViewTest(TestCase):
         self.assertEqual(article.thumbnail.name, 'thumbnail/' + thumbnail.name)
 
         # 確認後画像を削除
+        delete_renditions(
+            article.thumbnail.storage, article.thumbnail_renditions)
         article.thumbnail.delete()
         article.save()
 
@@ -710,6 +787,8 @@ class ArticleEditViewTest(TestCase):
             'text': 'test text',
         }
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # クリアでpost
         form_data = {
@@ -718,6 +797,8 @@ class ArticleEditViewTest(TestCase):
             'text': 'test text',
         }
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -826,3 +907,17 @@ class ArticleDeleteViewTest(TestCase):
         # 記事が存在しない
         aritlces = Article.objects.all()
         self.assertEqual(len(aritlces), 0)
+
+    def test_post_not_author(self):
+        """投稿者でないユーザが削除しようとした場合のテスト"""
+        get_user_model().objects.create_user(
+            email='notauthor@test.com',
+            password='notauthor'
+        )
+        self.client.login(email='notauthor@test.com', password='notauthor')
+
+        response = self.client.post(self.url)
+
+        # BadRequestで、記事は削除されない
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Article.objects.filter(pk=self.article_id).exists())
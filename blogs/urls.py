@@ -1,15 +1,27 @@
 from django.urls import path
 
 from blogs import views
+from blogs.page_cache import (
+    article_groups, cache_anonymous_page, index_groups,
+)
 
 
 app_name = 'blogs'
 
 urlpatterns = [
-    path('', views.ArticleListView.as_view(), name='index'),
+    path('',
+         cache_anonymous_page(
+             index_groups, params=('category', 'cursor', 'page')
+         )(views.ArticleListView.as_view()),
+         name='index'),
     path('create/', views.ArticleCreateView.as_view(), name='article_create'),
+    path('preview/',
+         views.ArticlePreviewView.as_view(),
+         name='article_preview'),
     path('detail/<uuid:pk>/',
-         views.ArticleDetailView.as_view(),
+         cache_anonymous_page(article_groups)(
+             views.ArticleDetailView.as_view()
+         ),
          name='article_detail'),
     path('edit/<uuid:pk>/',
          views.ArticleEditView.as_view(),
@@ -1,63 +1,36 @@
-import io
-import sys
+from functools import partial
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.http import HttpResponseBadRequest
+from django.http import (
+    Http404, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse,
+)
 from django.urls import reverse
+from django.utils.safestring import mark_safe
 from django.views import generic
-from PIL import Image
 
 from blogs.escape import escape_markdown
 from blogs.forms import ArticleForm
+from blogs.image_jobs import (
+    THUMBNAIL_SIZE, clear_image, enqueue, save_form, take_upload,
+)
+from blogs.isolation import isolated_renderer
 from blogs.models import Article, Category
-from users.models import Profile
+from blogs.pagination import CursorPaginator, InvalidCursor
+from blogs.preview import PreviewError, build_preview
+from blogs.render import render_markdown
 
 
 ACCEPT_TAGS = [
     'b', 'blockquote', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-    'li', 'ol', 'ol start="42"', 'p', 'pre', 'sub', 'sup', 'strong',
+    'li', 'ol', 'ol[start]', 'p', 'pre', 'sub', 'sup', 'strong',
     'strike', 'ul', 'br', 'hr',
 ]
 
 
-def _image_resize(image, size):
-    """画像を指定のサイズにリサイズする関数"""
-    # 画像のフォーマットを取得
-    im_format = 'png'
-    if '.' in image.name:
-        im_format = image.name.split('.')[1]
-
-    im = Image.open(image)
-    im = im.resize(size, Image.LANCZOS)
-
-    output_file = io.BytesIO()
-    if im_format == 'png':
-        im.save(output_file, format='PNG')
-    else:
-        im.save(output_file, format='JPEG')
-    output_file.seek(0)
-
-    return InMemoryUploadedFile(
-        output_file,
-        'ImageField',
-        image.name,
-        'image/%s' % im_format,
-        sys.getsizeof(output_file),
-        None
-    )
-
-
-def _set_full_name(context, user):
-    """ユーザーのフルネームがあればコンテキストに設定"""
-    if user is None:
-        context['user_name'] = ''
-        return context
-    if user.is_authenticated:
-        profile = Profile.objects.get(user=user)
-        name = profile.user_name
-        context['user_name'] = name if name is not None else ''
-        return context
+def _render_preview(text):
+    """保存時と同じようにエスケープしてから変換する"""
+    return render_markdown(escape_markdown(text, ACCEPT_TAGS))
 
 
 def _split_keywords(keywords):
@@ -67,42 +40,73 @@ def _split_keywords(keywords):
     return keywords.replace(',', ' ')
 
 
+class AuthorRequiredMixin:
+    """記事の投稿者だけが使えるviewのmixin
+
+    記事を投稿者と一緒に一度だけ読み込み、権限の確認とget_objectの
+    両方に使う。投稿者でなければGETでもPOSTでも400を返す。
+    LoginRequiredMixinより後に置く。
+    """
+    def get_queryset(self):
+        return Article.objects.select_related('author')
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_article'):
+            self._article = super().get_object()
+        return self._article
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.get_object().author != request.user:
+            return HttpResponseBadRequest()
+        return super().dispatch(request, *args, **kwargs)
+
+
 class ArticleListView(generic.ListView):
     """記事の一覧を表示するview"""
     model = Article
     context_object_name = 'articles'
     template_name = 'blogs/index.html'
     paginate_by = 12
+    # TrueならOFFSETとCOUNT(*)を使わず、?cursor=のトークンでページを分ける
+    cursor_pagination = getattr(
+        settings, 'ARTICLE_LIST_CURSOR_PAGINATION', False
+    )
 
     def get_queryset(self):
         # 公開記事のみ、作成日時の降順でソートして表示
-        articles = Article.objects.filter(is_public=True)
+        articles = Article.objects.for_list().filter(is_public=True)
         # カテゴリーでフィルターをかける場合
         if 'category' in self.request.GET:
             try:
                 category = Category.objects.get(
                     name=self.request.GET['category']
                 )
-            # カテゴリーがDBに存在しなかったら空リストを返す
+            # カテゴリーがDBに存在しなかったら空の一覧を返す
             except Category.DoesNotExist:
-                return []
+                return articles.none()
             return articles.filter(categories=category).order_by('-created_at')
         return articles.order_by('-created_at')
 
+    def paginate_queryset(self, queryset, page_size):
+        """cursor_paginationが有効ならトークンの位置のページを返す"""
+        if not self.cursor_pagination:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # ナブバー設定用ユーザーのフルネーム
-        _set_full_name(context, self.request.user)
-        # カテゴリー
-        categories = Category.objects.all()
-        category_counts = (
-            Article.objects.filter(categories=category, is_public=True).count()
-            for category in categories
-        )
-        category_dict = {}
-        for category, category_count in zip(categories, category_counts):
-            category_dict.setdefault(category, category_count)
-        context['category_dict'] = category_dict
+        # カテゴリーと公開記事の数
+        context['category_dict'] = {
+            category: category.public_article_count
+            for category in Category.objects.all()
+        }
         return context
 
 
@@ -122,27 +126,12 @@ class ArticleCreateView(LoginRequiredMixin, generic.CreateView):
             form.instance.keywords = _split_keywords(
                 keywords=form.instance.keywords
             )
-        # 画像処理後、親クラスのform_validを呼び出す
-        return self._image_proc(form)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        # ナブバー設定用ユーザーのフルネーム
-        _set_full_name(context, self.request.user)
-        return context
-
-    def _image_proc(self, form):
-        # formにデータがない場合
-        if form.cleaned_data['thumbnail'] is None:
-            return super(generic.CreateView, self).form_valid(form)
-
-        # 画像のリサイズ
-        form.instance.thumbnail = _image_resize(
-            image=form.instance.thumbnail,
-            size=(150, 150)
-        )
-
-        return super(generic.CreateView, self).form_valid(form)
+        # 画像はここでは保存せず、縮小と保存をジョブに任せる
+        thumbnail = take_upload(form, 'thumbnail')
+        response = super().form_valid(form)
+        if thumbnail is not None:
+            enqueue(self.object, 'thumbnail', thumbnail, THUMBNAIL_SIZE)
+        return response
 
 
 class ArticleDetailView(generic.DetailView):
@@ -151,39 +140,31 @@ class ArticleDetailView(generic.DetailView):
     context_object_name = 'article'
     template_name = 'blogs/article_detail.html'
 
+    def get_queryset(self):
+        # 投稿者のプロフィールも一緒に読み込む
+        return Article.objects.select_related('author__profile')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # ナブバー設定用ユーザーのフルネーム
-        _set_full_name(context, self.request.user)
 
         # 投稿者のプロフィール情報
-        author_profile = Profile.objects.get(user=kwargs['object'].author)
-        context['author_profile'] = author_profile
+        context['author_profile'] = kwargs['object'].author.profile
+
+        # 保存済みの本文のhtml
+        context['article_html'] = mark_safe(kwargs['object'].get_html())
 
         # ログインユーザ
         context['login_user'] = self.request.user
         return context
 
 
-class ArticleEditView(LoginRequiredMixin, generic.UpdateView):
+class ArticleEditView(LoginRequiredMixin, AuthorRequiredMixin,
+                      generic.UpdateView):
     """記事編集画面を表示する"""
     model = Article
     form_class = ArticleForm
     template_name = 'blogs/article_edit.html'
 
-    def get(self, request, *args, **kwargs):
-        """投稿者でないユーザがgetリクエスト投げたらエラーを返す"""
-        author = Article.objects.get(pk=kwargs['pk']).author
-        if self.request.user == author:
-            return super().get(self, request, *args, **kwargs)
-        return HttpResponseBadRequest()
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        # ナブバー設定用ユーザーのフルネーム
-        _set_full_name(context, self.request.user)
-        return context
-
     def form_valid(self, form):
         """記事のエスケープ処理"""
         if self.request.user.is_authenticated:
@@ -193,60 +174,48 @@ class ArticleEditView(LoginRequiredMixin, generic.UpdateView):
             form.instance.keywords = _split_keywords(
                 keywords=form.instance.keywords
             )
-        # 画像処理後、親クラスのform_validを呼び出す
-        return self._image_proc(form)
-
-    def _image_proc(self, form):
-        # formに画像がない場合そのまま親に渡す
-        if form.cleaned_data['thumbnail'] is None:
-            return super(generic.UpdateView, self).form_valid(form)
-
-        # クリアなら画像削除後そのまま親に渡す
-        article_pk = form.instance.pk
-        if 'thumbnail-clear' in form.data:
-            if form.data['thumbnail-clear'] == 'on':
-                self._del_image(article_pk)
-                return super(generic.UpdateView, self).form_valid(form)
-
-        # 画像のリサイズ
-        form.instance.thumbnail = _image_resize(
-            image=form.instance.thumbnail,
-            size=(150, 150)
-        )
-        # 更新前の画像を削除
-        self._del_image(article_pk)
-
-        return super(generic.UpdateView, self).form_valid(form)
-
-    def _del_image(self, article_pk):
-        """画像を削除"""
-        article = Article.objects.get(pk=article_pk)
-        if article.thumbnail:
-            article.thumbnail.delete()
-            article.save()
-
-
-class ArticleDeleteView(LoginRequiredMixin, generic.DeleteView):
+        # クリアなら変更前の画像を削除
+        if form.cleaned_data['thumbnail'] is False:
+            clear_image(form, 'thumbnail')
+        # 新しい画像はここでは保存せず、縮小と保存をジョブに任せる
+        thumbnail = take_upload(form, 'thumbnail')
+        self.object = save_form(form, 'thumbnail')
+        if thumbnail is not None:
+            enqueue(self.object, 'thumbnail', thumbnail, THUMBNAIL_SIZE)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class ArticleDeleteView(LoginRequiredMixin, AuthorRequiredMixin,
+                        generic.DeleteView):
     """記事削除画面を表示"""
     model = Article
     template_name = 'blogs/article_delete.html'
 
     def get_success_url(self):
-        profile = Profile.objects.get(user=self.request.user)
-        return reverse('users:profile', kwargs={'name': profile.user_name})
-
-    def get(self, request, *args, **kwargs):
-        """投稿者でないユーザがgetリクエスト投げたらエラーを返す"""
-        author = Article.objects.get(pk=kwargs['pk']).author
-        if self.request.user == author:
-            return super().get(self, request, *args, **kwargs)
-        return HttpResponseBadRequest()
+        return reverse(
+            'users:profile', kwargs={'name': self.request.profile.user_name}
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # ナブバー設定用ユーザーのフルネーム
-        _set_full_name(context, self.request.user)
 
         # 記事のタイトル
         context['article_title'] = kwargs['object'].title
         return context
+
+
+class ArticlePreviewView(LoginRequiredMixin, generic.View):
+    """編集中の記事のプレビューを返すview"""
+    # 編集画面から非同期に呼ばれるため、ログイン画面へリダイレクトしない
+    raise_exception = True
+
+    def post(self, request, *args, **kwargs):
+        try:
+            preview = build_preview(
+                request.session.session_key,
+                request.POST,
+                partial(isolated_renderer.render, _render_preview),
+            )
+        except PreviewError as e:
+            return JsonResponse({'error': e.code}, status=e.status)
+        return JsonResponse(preview)
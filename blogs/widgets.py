@@ -0,0 +1,18 @@
+from django.urls import reverse
+from markdownx.widgets import MarkdownxWidget
+
+
+class MarkdownPreviewWidget(MarkdownxWidget):
+    """プレビューに差分だけを送るmarkdownxのウィジェット
+
+    プレビューの更新はmarkdownx.jsの代わりにmarkdown_preview.jsが行う。
+    """
+    @staticmethod
+    def add_markdownx_attrs(attrs):
+        attrs = MarkdownxWidget.add_markdownx_attrs(attrs)
+        attrs['data-preview-url'] = reverse('blogs:article_preview')
+        return attrs
+
+    class Media:
+        extend = False
+        js = ['blogs/js/markdown_preview.js']
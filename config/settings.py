@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.nav_identity',
             ],
             'builtins': [
                 'bootstrap4.templatetags.bootstrap4',
@@ -130,7 +132,17 @@ logger.debug(f"static_root: {STATIC_ROOT}")
 MARKDOWNX_MARKDOWN_EXTENSIONS = [
     'markdown.extensions.extra',
     'markdown.extensions.toc',
+    'markdown.extensions.codehilite',
 ]
+MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS = {
+    # 保存時にPygmentsでハイライトする。色はstatic/blogs/css/highlight.css
+    'markdown.extensions.codehilite': {
+        'css_class': 'highlight',
+        'guess_lang': False,
+    },
+}
+# プレビューも記事の保存と同じ変換を使う
+MARKDOWNX_MARKDOWNIFY_FUNCTION = 'blogs.render.render_markdown'
 
 # media
 MEDIA_URL = '/media/'
@@ -149,6 +161,16 @@ LOGOUT_REDIRECT_URL = 'blogs:index'
 # display an email
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# cache
+# ページのキャッシュ(blogs.page_cache)は記事などを保存したプロセスで
+# 世代を変えて古いページを外すため、gunicornの全てのワーカーと
+# process_image_jobsのワーカーが同じキャッシュを使う必要がある。
+# 本番ではCACHE_URLでredisかmemcachedを必ず指定する。
+# 開発では指定しなければプロセスごとのLocMemCacheを使う
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env('DEBUG')
@@ -187,6 +209,11 @@ elif os.getenv('DB_ENV', '') == 'mysql':
     }
     DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+    # cache
+    CACHES = {
+        'default': env.cache('CACHE_URL'),
+    }
+
     # email
     EMAIL_HOST = env('EMAIL_HOST')
     EMAIL_PORT = env('EMAIL_PORT')
@@ -211,6 +238,11 @@ else:
     }
     DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+    # cache
+    CACHES = {
+        'default': env.cache('CACHE_URL'),
+    }
+
     ALLOWED_HOSTS.append(env('ALLOWED_HOSTS'))
 
     EMAIL_HOST = env('EMAIL_HOST')
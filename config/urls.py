@@ -16,7 +16,9 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
+from django.contrib.auth.decorators import login_required
 from django.urls import include, path
+from markdownx.views import ImageUploadView
 
 from config import settings
 
@@ -25,7 +27,11 @@ urlpatterns = [
     # blogs
     path('admin/', admin.site.urls),
     path('', include('blogs.urls')),
-    path('markdownx/', include('markdownx.urls')),
+    # markdownxの変換(markdownify)は使わず、プレビューはblogsの
+    # article_previewで行う。画像のアップロードはログインした場合だけ
+    path('markdownx/upload/',
+         login_required(ImageUploadView.as_view()),
+         name='markdownx_upload'),
 
     # users
     path('', include('users.urls'))
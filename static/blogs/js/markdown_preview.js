@@ -0,0 +1,197 @@
+/*
+ * 記事編集画面のプレビュー
+ *
+ * 入力が止まってから送信し、送信中の入力は応答を待ってからまとめて送る。
+ * サーバーが受け取った本文のハッシュを覚えておき、以降は差分だけを送る。
+ */
+(function () {
+    'use strict';
+
+    var LATENCY_MINIMUM = 500;
+
+    function getCookie(name) {
+        var cookies = document.cookie ? document.cookie.split(';') : [];
+        for (var i = 0; i < cookies.length; i++) {
+            var cookie = cookies[i].trim();
+            if (cookie.indexOf(name + '=') === 0) {
+                return decodeURIComponent(cookie.substring(name.length + 1));
+            }
+        }
+        return null;
+    }
+
+    function post(url, data, callback) {
+        var xhr = new XMLHttpRequest();
+        xhr.open('POST', url, true);
+        xhr.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+        xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+        xhr.onload = function () {
+            callback(xhr.status, xhr.responseText);
+        };
+        xhr.onerror = function () {
+            callback(0, null);
+        };
+        xhr.send(data);
+    }
+
+    function isLowSurrogate(text, index) {
+        var code = text.charCodeAt(index);
+        return code >= 0xDC00 && code <= 0xDFFF;
+    }
+
+    // baseをtextにする1か所の置き換えを求める
+    function diff(base, text) {
+        var limit = Math.min(base.length, text.length);
+        var start = 0;
+        while (start < limit && base[start] === text[start]) {
+            start++;
+        }
+        // サロゲートペアの途中で区切らない
+        if (start > 0 && isLowSurrogate(text, start)) {
+            start--;
+        }
+        var end = 0;
+        while (end < limit - start &&
+               base[base.length - 1 - end] === text[text.length - 1 - end]) {
+            end++;
+        }
+        if (end > 0 && isLowSurrogate(text, text.length - end)) {
+            end--;
+        }
+        return {
+            start: start,
+            end: base.length - end,
+            insert: text.substring(start, text.length - end)
+        };
+    }
+
+    function Preview(parent, editor, preview) {
+        this.parent = parent;
+        this.editor = editor;
+        this.preview = preview;
+        this.url = editor.getAttribute('data-preview-url');
+        this.latency = Math.max(
+            parseInt(editor.getAttribute('data-markdownx-latency'), 10) || 0,
+            LATENCY_MINIMUM
+        );
+        this.editorId = Math.random().toString(36).slice(2) +
+                        Date.now().toString(36);
+        this.seq = 0;
+        // サーバーが受け取った本文とそのハッシュ
+        this.base = null;
+        this.timeout = null;
+        this.sending = false;
+        this.pending = false;
+
+        editor.addEventListener('input', this.schedule.bind(this));
+        editor.addEventListener('dragover', function (event) {
+            event.preventDefault();
+        });
+        editor.addEventListener('drop', this.onDrop.bind(this));
+        this.send();
+    }
+
+    Preview.prototype.schedule = function () {
+        clearTimeout(this.timeout);
+        this.timeout = setTimeout(this.send.bind(this), this.latency);
+    };
+
+    Preview.prototype.send = function () {
+        if (this.sending) {
+            this.pending = true;
+            return;
+        }
+        var text = this.editor.value;
+        if (this.base !== null && this.base.text === text) {
+            return;
+        }
+        this.seq++;
+        var data = new FormData();
+        data.append('editor', this.editorId);
+        data.append('seq', this.seq);
+        if (this.base === null) {
+            data.append('content', text);
+        } else {
+            var change = diff(this.base.text, text);
+            data.append('base', this.base.hash);
+            data.append('start', change.start);
+            data.append('end', change.end);
+            data.append('insert', change.insert);
+        }
+
+        var self = this;
+        this.sending = true;
+        post(this.url, data, function (status, body) {
+            self.sending = false;
+            if (status === 200) {
+                self.update(text, JSON.parse(body));
+            } else if (status === 412) {
+                // サーバーに元の本文が残っていないため全文を送り直す
+                self.base = null;
+                self.pending = true;
+            }
+            if (self.pending) {
+                self.pending = false;
+                self.send();
+            }
+        });
+    };
+
+    Preview.prototype.update = function (text, response) {
+        this.base = {text: text, hash: response.hash};
+        this.preview.innerHTML = response.html;
+        this.parent.dispatchEvent(new CustomEvent('markdownx.update', {
+            detail: response.html
+        }));
+    };
+
+    Preview.prototype.onDrop = function (event) {
+        var files = event.dataTransfer ? event.dataTransfer.files : [];
+        if (!files.length) {
+            return;
+        }
+        event.preventDefault();
+        for (var i = 0; i < files.length; i++) {
+            this.upload(files[i]);
+        }
+    };
+
+    Preview.prototype.upload = function (file) {
+        var data = new FormData();
+        data.append('image', file);
+        var self = this;
+        this.editor.style.opacity = '0.3';
+        post(
+            this.editor.getAttribute('data-markdownx-upload-urls-path'),
+            data,
+            function (status, body) {
+                self.editor.style.opacity = '1';
+                if (status !== 200) {
+                    console.error(body);
+                    return;
+                }
+                self.insert(JSON.parse(body).image_code);
+            }
+        );
+    };
+
+    Preview.prototype.insert = function (text) {
+        var editor = this.editor;
+        var start = editor.selectionStart;
+        editor.value = editor.value.substring(0, start) + text +
+                       editor.value.substring(editor.selectionEnd);
+        editor.selectionStart = editor.selectionEnd = start + text.length;
+        this.schedule();
+    };
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var elements = document.getElementsByClassName('markdownx');
+        for (var i = 0; i < elements.length; i++) {
+            var editor = elements[i].querySelector('[data-preview-url]');
+            var preview = elements[i].querySelector('.markdownx-preview');
+            if (editor && preview) {
+                new Preview(elements[i], editor, preview);
+            }
+        }
+    });
+})();
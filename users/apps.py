@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        from users import signals  # noqa: F401
+        from users.identity import check_shared_cache
+
+        checks.register(check_shared_cache, checks.Tags.caches)
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from users.identity import get_nav_identity
+
+
+def nav_identity(request):
+    """ナビバーのユーザー名とプロフィールのURL
+
+    ナビバーを表示しないページではキャッシュも読まない。
+    """
+    return {
+        'nav_identity': SimpleLazyObject(
+            lambda: get_nav_identity(request.user)
+        ),
+    }
@@ -0,0 +1,70 @@
+"""ナビバーに表示するログインユーザーの名前とプロフィールのURL
+
+リクエストをまたいでキャッシュし、ページごとにProfileを読み込まない。
+プロフィールを保存、削除した時にキャッシュを消す。消したことが全ての
+プロセスに伝わるよう、共有のキャッシュを使う(config.settingsのCACHES)。
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from blogs.page_cache import PROCESS_LOCAL_BACKENDS
+from users.models import Profile
+
+
+DEFAULT_CACHE_ALIAS = 'default'
+# 消し損ねた場合も、古いユーザー名を表示し続けないよう短くする
+DEFAULT_TIMEOUT = 60 * 5
+
+KEY_PREFIX = 'nav-identity:'
+
+
+def _cache():
+    return caches[
+        getattr(settings, 'NAV_IDENTITY_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+    ]
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """キャッシュがプロセス間で共有されるか確認する"""
+    alias = getattr(settings, 'NAV_IDENTITY_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if settings.DEBUG or backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    return [checks.Warning(
+        'The navbar identity cache uses %s, which is not shared between '
+        'processes.' % backend,
+        hint='After a rename, other workers keep linking to the old '
+             'profile URL. Set CACHE_URL to a shared cache.',
+        id='users.W001',
+    )]
+
+
+def _key(user_id):
+    return '%s%s' % (KEY_PREFIX, user_id)
+
+
+def get_nav_identity(user):
+    """ユーザーのuser_nameとprofile_url。プロフィールがなければNone"""
+    if not user.is_authenticated:
+        return None
+    key = _key(user.pk)
+    identity = _cache().get(key)
+    if identity is None:
+        try:
+            profile = Profile.objects.only('user_name').get(user=user)
+        except Profile.DoesNotExist:
+            return None
+        identity = {
+            'user_name': profile.user_name,
+            'profile_url': profile.get_absolute_url(),
+        }
+        _cache().set(key, identity, getattr(
+            settings, 'NAV_IDENTITY_CACHE_TIMEOUT', DEFAULT_TIMEOUT
+        ))
+    return identity
+
+
+def forget_nav_identity(user_id):
+    """ユーザーのキャッシュを消す"""
+    _cache().delete(_key(user_id))
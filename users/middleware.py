@@ -0,0 +1,29 @@
+from django.utils.functional import SimpleLazyObject
+
+from users.models import Profile
+
+
+def get_profile(request):
+    """ログインユーザーのプロフィール。なければNone"""
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.profile
+    except Profile.DoesNotExist:
+        return None
+
+
+class ProfileMiddleware:
+    """request.profileにログインユーザーのプロフィールを設定する
+
+    最初に使われた時に一度だけ読み込む。ナビバーの表示には使わないため、
+    プロフィールを使わないviewではクエリを発行しない。
+    AuthenticationMiddlewareより後に置く。
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        return self.get_response(request)
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_auto_20201115_1312'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_profile_image_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -111,6 +111,12 @@ class Profile(models.Model):
     link = models.CharField('Link', max_length=255, blank=True)
     hobby = models.CharField('Hobby', max_length=255, blank=True)
     image = models.ImageField(upload_to='profile', blank=True)
+    # アップロードされた画像をImageJobで処理している間はTrue
+    image_pending = models.BooleanField(default=False, editable=False)
+    # imageから作ったWebPなどの画像の情報(blogs.renditions)
+    image_renditions = models.TextField(
+        default='', blank=True, editable=False
+    )
 
     def __str__(self):
         return self.user_name
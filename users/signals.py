@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.identity import forget_nav_identity
+from users.models import Profile
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def forget_identity(sender, instance, **kwargs):
+    """ユーザー名が変わったらナビバーのキャッシュを消す
+
+    コミット前に他のリクエストが古いユーザー名を保存した場合に備え、
+    コミット後にももう一度消す。
+    """
+    forget_nav_identity(instance.user_id)
+    transaction.on_commit(lambda: forget_nav_identity(instance.user_id))
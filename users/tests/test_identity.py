@@ -0,0 +1,97 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from users.models import Profile
+
+
+User = get_user_model()
+
+
+class NavIdentityTest(TestCase):
+    """ナビバーのユーザー名のキャッシュのテスト"""
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email='test@test.com', password='password')
+        self.profile = Profile.objects.create(
+            user=self.user, user_name='testname')
+        self.client.login(email='test@test.com', password='password')
+
+    def _profile_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [
+            query['sql'] for query in queries
+            if 'FROM "users_profile"' in query['sql']
+        ]
+
+    def test_cached(self):
+        """2回目以降のページではProfileを読み込まないことの確認"""
+        url = reverse('blogs:index')
+        self.client.get(url)
+
+        response, queries = self._profile_queries(url)
+
+        self.assertContains(response, 'testname')
+        self.assertContains(
+            response, reverse('users:profile', kwargs={'name': 'testname'}))
+        self.assertEqual(queries, [])
+
+    def test_profile_edit(self):
+        """ユーザー名を変更するとナビバーも変わることの確認"""
+        self.client.get(reverse('blogs:index'))
+
+        self.client.post(
+            reverse('users:profile_edit', kwargs={'name': 'testname'}),
+            {'user_name': 'renamed'}
+        )
+
+        response = self.client.get(reverse('blogs:index'))
+        self.assertContains(response, 'renamed')
+        self.assertContains(
+            response, reverse('users:profile', kwargs={'name': 'renamed'}))
+        # 変更前のユーザー名のプロフィールは404
+        response = self.client.get(
+            reverse('users:profile', kwargs={'name': 'testname'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous(self):
+        """ログインしていなければ読み込まないことの確認"""
+        from django.contrib.auth.models import AnonymousUser
+
+        from users.identity import get_nav_identity
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_nav_identity(AnonymousUser()))
+
+
+class SharedCacheCheckTest(TestCase):
+    """キャッシュの設定の確認のテスト"""
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django_redis.cache.RedisCache'},
+    })
+    def test_shared(self):
+        """共有のキャッシュなら警告しないことの確認"""
+        from users.identity import check_shared_cache
+
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    })
+    def test_process_local(self):
+        """プロセスごとのキャッシュなら警告することの確認"""
+        from users.identity import check_shared_cache
+
+        self.assertEqual(
+            [w.id for w in check_shared_cache(None)], ['users.W001'])
+        # 開発用のサーバーでは警告しない
+        with self.settings(DEBUG=True):
+            self.assertEqual(check_shared_cache(None), [])
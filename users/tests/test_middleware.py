@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from users.models import Profile
+
+
+User = get_user_model()
+
+
+class ProfileMiddlewareTest(TestCase):
+    """request.profileを設定するミドルウェアのテスト"""
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@test.com', password='password')
+        Profile.objects.create(user=self.user, user_name='testname')
+
+    def test_anonymous(self):
+        """ログインしていなければNoneになることの確認"""
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+
+        from users.middleware import ProfileMiddleware
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        ProfileMiddleware(lambda request: None)(request)
+
+        self.assertFalse(request.profile)
+
+    def test_loaded_once(self):
+        """使われた時に一度だけ読み込むことの確認"""
+        from django.test import RequestFactory
+
+        from users.middleware import ProfileMiddleware
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        ProfileMiddleware(lambda request: None)(request)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(request.profile.user_name, 'testname')
+            self.assertEqual(request.profile.user, self.user)
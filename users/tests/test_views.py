@@ -8,6 +8,8 @@ from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from PIL import Image
 
+from blogs.image_jobs import process_jobs
+from blogs.renditions import delete_renditions
 from blogs.models import Article
 from users.models import Profile
 
@@ -256,6 +258,8 @@ class ProfileImageEditViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -266,6 +270,7 @@ class ProfileImageEditViewTest(TestCase):
         self.assertEqual(profile.image.name, 'profile/' + profile_file.name)
 
         # 確認後画像を削除
+        delete_renditions(profile.image.storage, profile.image_renditions)
         profile.image.delete()
 
     def test_png_post(self):
@@ -285,6 +290,8 @@ class ProfileImageEditViewTest(TestCase):
         }
 
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -295,6 +302,7 @@ class ProfileImageEditViewTest(TestCase):
         self.assertEqual(profile.image.name, 'profile/' + profile_file.name)
 
         # 確認後画像を削除
+        delete_renditions(profile.image.storage, profile.image_renditions)
         profile.image.delete()
 
     def test_clear_post(self):
@@ -313,12 +321,16 @@ class ProfileImageEditViewTest(TestCase):
             'image': profile_file
         }
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # クリアでpost
         form_data = {
             'image-clear': 'on'
         }
         response = self.client.post(self.url, data=form_data)
+        # 画像はジョブで縮小して保存する
+        process_jobs()
 
         # ステータス302
         self.assertEqual(response.status_code, 302)
@@ -1,5 +1,6 @@
 from django.urls import path
 
+from blogs.page_cache import cache_anonymous_page, profile_groups
 from users.views import (
     Login,
     Logout,
@@ -21,7 +22,9 @@ app_name = 'users'
 
 urlpatterns = [
     # Profile
-    path('profile/<name>/', ProfileView.as_view(), name='profile'),
+    path('profile/<name>/',
+         cache_anonymous_page(profile_groups)(ProfileView.as_view()),
+         name='profile'),
     path('profile/<name>/edit/',
          ProfileEditView.as_view(), name='profile_edit'),
     path('profile/<name>/image/edit/',
@@ -1,5 +1,3 @@
-import io
-import sys
 import uuid
 
 from django.conf import settings
@@ -10,17 +8,18 @@ from django.contrib.auth.views import (
     PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView,
 )
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.signing import (
     BadSignature, dumps, loads, SignatureExpired,
 )
-from django.http import HttpResponseBadRequest
-from django.shortcuts import redirect
+from django.http import HttpResponseBadRequest, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import get_template
 from django.urls import reverse, reverse_lazy
 from django.views import generic
-from PIL import Image
 
+from blogs.image_jobs import (
+    PROFILE_IMAGE_SIZE, clear_image, enqueue, save_form, take_upload,
+)
 from blogs.models import Article
 from users.forms import (
     LoginForm, MyPasswordResetForm, MySetPasswordForm, ProfileEditForm,
@@ -44,15 +43,15 @@ class ProfileView(generic.TemplateView):
         login_user = self.request.user
         if login_user.is_authenticated:
             context['login_user'] = login_user
-            user_name = Profile.objects.get(user=login_user).user_name
-            context['user_name'] = user_name
 
-        # ユーザ名によるプロフィール情報
-        profile = Profile.objects.get(user_name=kwargs['name'])
+        # ユーザ名によるプロフィール情報。変更前のユーザ名なら404
+        profile = get_object_or_404(Profile, user_name=kwargs['name'])
         context['profile'] = profile
 
-        # ユーザが投稿した記事
-        articles = Article.objects.filter(author=profile.user)
+        # ユーザが投稿した記事を新しい順に
+        articles = Article.objects.for_list().filter(
+            author=profile.user
+        ).order_by('-created_at')
         context['articles'] = articles
         return context
 
@@ -81,7 +80,9 @@ class ProfileEditView(LoginRequiredMixin, generic.UpdateView):
             user_names = (p.user_name for p in Profile.objects.all())
             if fm_usrname in user_names:
                 return self.form_invalid(form)
-        return super(generic.UpdateView, self).form_valid(form)
+        # 画像の列は処理中のジョブが更新するため保存しない
+        self.object = save_form(form, 'image')
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_object(self):
         """URLにpkを含まないため"""
@@ -99,56 +100,20 @@ class ProfileImageEditView(LoginRequiredMixin, generic.UpdateView):
         if form.cleaned_data['image'] is None:
             return super().get(self.request)
 
-        # クリアなら画像削除後そのまま親に渡す
-        if 'image-clear' in form.data and form.data['image-clear'] == 'on':
-            self._del_image()
-            return super(generic.UpdateView, self).form_valid(form)
-
-        # 画像のリサイズ
-        form.instance.image = self._image_resize(
-            image=form.instance.image,
-            size=(150, 150)
-        )
-        # 更新前の画像を削除
-        self._del_image()
-
-        return super(generic.UpdateView, self).form_valid(form)
+        # クリアなら変更前の画像を削除
+        if form.cleaned_data['image'] is False:
+            clear_image(form, 'image')
+        # 新しい画像はここでは保存せず、縮小と保存をジョブに任せる
+        image = take_upload(form, 'image')
+        self.object = save_form(form, 'image')
+        if image is not None:
+            enqueue(self.object, 'image', image, PROFILE_IMAGE_SIZE)
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_object(self):
         """URLにpkを含まないため"""
         return Profile.objects.get(user=self.request.user)
 
-    def _image_resize(self, image, size):
-        """画像を指定のサイズにリサイズする関数"""
-        # 画像のフォーマットを取得
-        im_format = image.name.split('.')[1]
-
-        im = Image.open(image)
-        im = im.resize(size, Image.LANCZOS)
-
-        output_file = io.BytesIO()
-        if im_format == 'png':
-            im.save(output_file, format='PNG')
-        else:
-            im.save(output_file, format='JPEG')
-        output_file.seek(0)
-
-        return InMemoryUploadedFile(
-            output_file,
-            'ImageField',
-            image.name,
-            'image/%s' % im_format,
-            sys.getsizeof(output_file),
-            None
-        )
-
-    def _del_image(self):
-        """画像を削除"""
-        profile = Profile.objects.get(user=self.request.user)
-        if profile.image:
-            profile.image.delete()
-            profile.save()
-
 
 class Login(LoginView):
     """ログイン"""
@@ -160,10 +125,9 @@ class Login(LoginView):
         if next_url:
             return '%s' % (next_url)
         else:
-            profile = Profile.objects.get(user=self.request.user)
             redirect_url = reverse(
                 'users:profile',
-                kwargs={'name': profile.user_name})
+                kwargs={'name': self.request.profile.user_name})
             return redirect_url
 
 